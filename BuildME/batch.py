@@ -5,12 +5,19 @@ import os
 import datetime
 import json
 import pickle
+import numpy as np
+import pandas as pd
 
+# file with the BuildME aspects of each simulation in the batch simulation folder
+aspects_file = 'aspects.csv'
 
-def create_batch_simulation(combinations):
+
+def create_batch_simulation(combinations, subfolders=True):
     """
     Creates a dictionary 'batch_sim' and create a folder structure to store the simulation results
     :param combinations: a dictionary with the selected BuildME aspects and their values
+    :param subfolders: True if a folder should be created for each simulation (not needed for the in-memory material
+        simulation, see simulate.calculate_materials_in_memory())
     :returns: batch_sim: dictionary with batch simulation information
     :returns: run: batch simulation identifier
     """
@@ -19,6 +26,7 @@ def create_batch_simulation(combinations):
     # combinations = settings.debug_combinations
     default_aspects = ['occupation', 'en-std', 'res', 'climate_region', 'climate_scenario', 'cooling']
     batch_sim = {}
+    aspects = {}
     for region in combinations:
         keys = list(combinations[region].keys())
         values = list(combinations[region].values())
@@ -26,6 +34,7 @@ def create_batch_simulation(combinations):
         for comb in itertools.product(*values):
             comb_dict = {k: comb[i] for i, k in enumerate(keys)}
             sim = region+'_'+'_'.join(comb)
+            aspects[sim] = {'region': region, **comb_dict}
             # get default aspects (if one doesn't exist, set as None)
             for aspect in default_aspects:
                 try:
@@ -61,7 +70,8 @@ def create_batch_simulation(combinations):
                 batch_sim[sim][k] = v
 
     create_base_folder(run, combinations, batch_sim)
-    create_subfolders(batch_sim, run)
+    create_subfolders(batch_sim, run, subfolders)
+    save_aspects(aspects, os.path.join(settings.tmp_path, run))
     return batch_sim, run
 
 
@@ -87,22 +97,63 @@ def create_base_folder(run, combinations, batch_sim):
         conf_file.close()
 
 
-def create_subfolders(batch_sim, run):
+def create_subfolders(batch_sim, run, subfolders=True):
     """
     Creates a subfolder for each building instance in the batch simulation
     :param batch_sim: dictionary with batch simulation information
     :param run: batch simulation identifier
+    :param subfolders: False if only the list of all folders should be saved
     """
-    for sim in batch_sim:
-        fpath = os.path.join(settings.tmp_path, run, sim)
-        # create folder
-        os.makedirs(fpath)
+    if subfolders:
+        for sim in batch_sim:
+            fpath = os.path.join(settings.tmp_path, run, sim)
+            # create folder
+            os.makedirs(fpath)
     # save list of all folders
     scenarios_filename = os.path.join(settings.tmp_path, run + '.run')
     pickle.dump(batch_sim, open(scenarios_filename, "wb"))
     return
 
 
+def save_aspects(aspects, parent_dir):
+    """
+    Saves the BuildME aspects of each simulation into the batch simulation folder, so that they do not need to be
+    derived from the building names (which is ambiguous if aspect values contain underscores)
+    :param aspects: dictionary like {building name: {'region': 'USA', 'occupation': 'SFH', ...}}
+    :param parent_dir: batch simulation folder
+    """
+    df = pd.DataFrame.from_dict(aspects, orient='index')
+    df.index.name = 'Building name'
+    df.to_csv(os.path.join(parent_dir, aspects_file))
+    return
+
+
+def get_aspects(parent_dir, names, aspect_names):
+    """
+    Gets the BuildME aspects of simulations from the file 'aspects.csv' of the batch simulation folder. The building
+    names that are not in the file (e.g. of batch simulations created with older versions) are split at the
+    underscores.
+    :param parent_dir: batch simulation folder
+    :param names: list with the building names (folder names) of the simulations
+    :param aspect_names: names of the BuildME aspects, e.g., ['region', 'occupation', ...]
+    :returns: numpy array (simulations x aspects) with the aspect values as strings
+    """
+    names = [str(name) for name in names]
+    filename = os.path.join(parent_dir, aspects_file)
+    if os.path.exists(filename):
+        df = pd.read_csv(filename, index_col='Building name', dtype=str)
+        df = df.reindex(index=names, columns=list(aspect_names))
+    else:
+        df = pd.DataFrame(np.nan, index=names, columns=list(aspect_names), dtype=object)
+    missing = df.isnull().all(axis=1).to_numpy()
+    if missing.any():
+        split = [name.split('_') for name in np.array(names)[missing]]
+        if any(len(a) != len(aspect_names) for a in split):
+            raise Exception(f"The building names do not match the aspects {list(aspect_names)}")
+        df.loc[missing] = split
+    return df.fillna('').to_numpy(dtype=str)
+
+
 def find_and_load_last_run(path=settings.tmp_path):
     """
     Finds the last batch simulation run as saved in create_batch_simulation().
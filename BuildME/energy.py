@@ -3,23 +3,38 @@ Energy demand algorithm for the RECC building model
 
 Copyright: Niko Heeren, 2019
 """
+import csv
 import os
 import subprocess
 import shutil
 import platform
+import sqlite3
+import numpy as np
+import pandas as pd
 from BuildME import settings
 
+# number of rows of 'eplusout.csv' parsed at once by sum_eplusout_columns()
+eplusout_chunksize = 8760
+# annual meters aggregated by BuildME (column names as written by ReadVarsESO)
+energy_variables = ("Heating:EnergyTransfer [J](Annual)", "Cooling:EnergyTransfer [J](Annual)",
+                    "InteriorLights:Electricity [J](Annual)", "InteriorEquipment:Electricity [J](Annual)")
 
-def perform_energy_calculation(out_dir, ep_dir, epw_path, keep_all):
+
+def perform_energy_calculation(out_dir, ep_dir, epw_path, keep_all, readvars=None):
     """
     Copies the required EnergyPlus files and initiates the energy demand simulation
     :param out_dir: output folder directory
     :param ep_dir: EnergyPlus directory
     :param epw_path: path to the EPW file with weather data
     :param keep_all: boolean indicating whether to keep all simulation files (incl. the .eso file)
+    :param readvars: True if ReadVarsESO should convert the whole ESO file into 'eplusout.csv', otherwise only the
+        meters in energy_variables are extracted from the ESO file (see write_eso_meters()); ReadVarsESO is not needed
+        when the results are read from 'eplusout.sql' (default: settings.readvars, unless settings.sqlite)
     """
+    if readvars is None:
+        readvars = settings.readvars and not settings.sqlite
     copy_files(out_dir, ep_dir, epw_path)
-    run_energyplus_single(out_dir)
+    run_energyplus_single(out_dir, readvars=readvars)
     if not keep_all:
         delete_ep_files(out_dir)
     return
@@ -37,7 +52,7 @@ def perform_energy_calculation_mp(args):
     """
     out_dir, ep_dir, epw_path, keep_all, q, no = args
     copy_files(out_dir, ep_dir, epw_path)
-    run_energyplus_single(out_dir)
+    run_energyplus_single(out_dir, readvars=settings.readvars and not settings.sqlite)
     if not keep_all:
         delete_ep_files(out_dir)
     q.put(no)
@@ -126,11 +141,14 @@ def delete_temp_folder(tmp_run_path, verbose=False):
         print("Deleted '%s'" % tmp_run_path)
 
 
-def run_energyplus_single(out_dir, verbose=True):
+def run_energyplus_single(out_dir, verbose=True, readvars=True):
     """
     Runs the energy demand simulation in EnergyPlus
     :param out_dir: output folder directory
     :param verbose: Switch to print a delete confirmation
+    :param readvars: True if ReadVarsESO should be run after the simulation (option -r), otherwise the meters in
+        energy_variables are extracted directly from the ESO file into 'eplusout.csv' (unless the results are written
+        to 'eplusout.sql')
     """
     # 1. Run `./ExpandObjects`
     cwd = os.getcwd()
@@ -171,7 +189,7 @@ def run_energyplus_single(out_dir, verbose=True):
         run_idf = 'in.idf'
 
     with open("log_energyplus.txt", 'w+') as log_file:
-        cmd = f'"{os.path.join(out_dir, "energyplus")}" -r {run_idf}'
+        cmd = f'"{os.path.join(out_dir, "energyplus")}"{" -r" if readvars else ""} {run_idf}'
         log_file.write("%s\n\n" % cmd)
         log_file.flush()
         subprocess.call(cmd, shell=True, stdout=log_file, stderr=log_file)
@@ -182,10 +200,174 @@ def run_energyplus_single(out_dir, verbose=True):
                                  "See files 'log_energyplus.txt' and 'eplusout.err' for details."
                                  % os.path.basename(out_dir))
         log_file.close()
+    if not readvars and not os.path.exists(os.path.join(out_dir, 'eplusout.sql')):
+        write_eso_meters(out_dir)
     if verbose:
         print("Energy simulation successful in folder '%s'" % os.path.basename(out_dir))
     os.chdir(cwd)
 
 
+def sum_eplusout_columns(ep_file, variables, chunksize=eplusout_chunksize):
+    """
+    Sums up the columns of the EnergyPlus result file 'eplusout.csv' that start with one of the given variables. Only
+    the header is parsed as a whole, the selected columns are read in chunks of rows, so that the memory use does not
+    depend on the size of the file (e.g. with many hourly 'Output:Variable' objects).
+    :param ep_file: path to 'eplusout.csv'
+    :param variables: column names (or their beginnings), e.g. ("Heating:EnergyTransfer [J](Annual)", ...)
+    :param chunksize: number of rows read at once
+    :returns: pandas series with the sums of the selected columns (in the order of the file)
+    """
+    with open(ep_file, 'r', newline='') as infile:
+        header = next(csv.reader(infile))
+    usecols = [i for i, col in enumerate(header) if any(col.startswith(v) for v in variables)]
+    total = pd.Series(0.0, index=[header[i] for i in usecols])
+    if not usecols:
+        return total
+    for chunk in pd.read_csv(ep_file, usecols=usecols, chunksize=chunksize, dtype=float):
+        total += chunk.sum().to_numpy()
+    return total
+
+
+def read_eso_dictionary(infile):
+    """
+    Reads the data dictionary at the beginning of an EnergyPlus output file 'eplusout.eso'
+    :param infile: open ESO file (the lines after the data dictionary are not read)
+    :returns: dictionary like {report code: column name}, the column names follow ReadVarsESO, e.g.
+        'Heating:EnergyTransfer [J](Annual)' (meters) or 'ZONE 1:Zone Mean Air Temperature [C](Hourly)' (variables)
+    """
+    columns = {}
+    next(infile)  # program version
+    for line in infile:
+        if line.startswith('End of Data Dictionary'):
+            break
+        fields, _, comment = line.partition('!')
+        fields = fields.strip().split(',')
+        if int(fields[0]) <= 6:  # time stamps and environment information
+            continue
+        frequency = comment.split('[')[0].strip()  # e.g. 'Annual [Value,Min,Year,...]'
+        name = ':'.join(f.strip() for f in fields[2:] if f.strip())
+        columns[fields[0]] = f'{name}({frequency})'
+    return columns
+
+
+def read_eso(eso_file, variables=None):
+    """
+    Reads report variables and meters from an EnergyPlus output file 'eplusout.eso' without ReadVarsESO. Only the
+    values of the selected variables are converted.
+    :param eso_file: path to 'eplusout.eso'
+    :param variables: column names (or their beginnings) to read, e.g. energy_variables (default: all)
+    :returns: dictionary like {column name: numpy array with the values in the order of the file}
+    """
+    with open(eso_file, 'r') as infile:
+        columns = read_eso_dictionary(infile)
+        if variables is not None:
+            columns = {code: col for code, col in columns.items() if any(col.startswith(v) for v in variables)}
+        values = {code: [] for code in columns}
+        for line in infile:
+            code, _, rest = line.partition(',')
+            if code in values:
+                values[code].append(rest.partition(',')[0])
+            elif line.startswith('End of Data'):
+                break
+    return {columns[code]: np.array(values[code], dtype=float) for code in columns}
 
 
+def write_eso_meters(out_dir, variables=energy_variables):
+    """
+    Extracts the selected variables from 'eplusout.eso' into 'eplusout.csv' (one column per variable, the rows are
+    the reported values, not time stamps), instead of converting the whole ESO file with ReadVarsESO
+    :param out_dir: simulation folder with the file 'eplusout.eso'
+    :param variables: column names (or their beginnings) to extract (default: energy_variables)
+    """
+    values = read_eso(os.path.join(out_dir, 'eplusout.eso'), variables)
+    df = pd.DataFrame({col: pd.Series(v, dtype=float) for col, v in values.items()})
+    df.to_csv(os.path.join(out_dir, 'eplusout.csv'), index=False)
+    return
+
+
+def split_variable_name(variable):
+    """
+    Splits a column name as written by ReadVarsESO into the EnergyPlus name, unit and reporting frequency
+    :param variable: column name, e.g. 'Heating:EnergyTransfer [J](Annual)'
+    :returns: tuple like ('Heating:EnergyTransfer', 'J', 'Annual')
+    """
+    name, _, rest = variable.partition(' [')
+    units, _, frequency = rest.partition('](')
+    return name, units, frequency.rstrip(') ')
+
+
+def read_sql_meters(sql_file, variables=energy_variables):
+    """
+    Reads the sums of meters from the EnergyPlus result database 'eplusout.sql' (requires the object 'Output:SQLite').
+    The values are selected through the indexed report data dictionary, i.e. without parsing any text output.
+    :param sql_file: path to 'eplusout.sql'
+    :param variables: column names as written by ReadVarsESO, e.g. energy_variables
+    :returns: pandas series with the sums of the meters found in the database (in the order of variables)
+    """
+    keys = {split_variable_name(v): v for v in variables}
+    query = "SELECT d.Name, d.Units, d.ReportingFrequency, SUM(r.Value) FROM ReportDataDictionary AS d " \
+            "JOIN ReportData AS r ON r.ReportDataDictionaryIndex = d.ReportDataDictionaryIndex " \
+            "WHERE d.IsMeter = 1 AND d.Name IN (%s) GROUP BY d.Name, d.Units, d.ReportingFrequency" \
+            % ','.join('?' * len(keys))
+    con = sqlite3.connect(f'file:{sql_file}?mode=ro', uri=True)
+    rows = con.execute(query, [key[0] for key in keys]).fetchall()
+    con.close()
+    values = {keys[row[:3]]: row[3] for row in rows if row[:3] in keys}
+    return pd.Series([values[v] for v in variables if v in values], index=[v for v in variables if v in values],
+                     dtype=float)
+
+
+def read_sql_series(sql_file, variables):
+    """
+    Reads the time series of meters from 'eplusout.sql', e.g. hourly meters, in the order of the time steps
+    :param sql_file: path to 'eplusout.sql'
+    :param variables: column names as written by ReadVarsESO, e.g. ['Heating:EnergyTransfer [J](Hourly)']
+    :returns: dictionary like {column name: numpy array with the values} (like read_eso())
+    """
+    keys = {split_variable_name(v): v for v in variables}
+    query = "SELECT d.Name, d.Units, d.ReportingFrequency, r.Value FROM ReportDataDictionary AS d " \
+            "JOIN ReportData AS r ON r.ReportDataDictionaryIndex = d.ReportDataDictionaryIndex " \
+            "WHERE d.IsMeter = 1 AND d.Name IN (%s) ORDER BY r.TimeIndex" % ','.join('?' * len(keys))
+    con = sqlite3.connect(f'file:{sql_file}?mode=ro', uri=True)
+    rows = con.execute(query, [key[0] for key in keys]).fetchall()
+    con.close()
+    values = {}
+    for row in rows:
+        if row[:3] in keys:
+            values.setdefault(keys[row[:3]], []).append(row[3])
+    return {variable: np.array(v, dtype=float) for variable, v in values.items()}
+
+
+def read_sql_end_uses(sql_file):
+    """
+    Reads the end-use breakdown of the tabular report 'AnnualBuildingUtilityPerformanceSummary' from 'eplusout.sql'
+    (requires the 'AllSummary' or 'AnnualBuildingUtilityPerformanceSummary' summary report)
+    :param sql_file: path to 'eplusout.sql'
+    :returns: dataframe with the columns 'End use', 'Fuel', 'Unit' and 'Value' (empty if the report is missing)
+    """
+    query = "SELECT RowName, ColumnName, Units, Value FROM TabularDataWithStrings " \
+            "WHERE ReportName = 'AnnualBuildingUtilityPerformanceSummary' AND ReportForString = 'Entire Facility' " \
+            "AND TableName = 'End Uses' AND RowName != ''"
+    con = sqlite3.connect(f'file:{sql_file}?mode=ro', uri=True)
+    df = pd.read_sql_query(query, con)
+    con.close()
+    df.columns = ['End use', 'Fuel', 'Unit', 'Value']
+    df['Value'] = pd.to_numeric(df['Value'].str.strip(), errors='coerce')
+    return df[df['Unit'].str.strip() != ''].dropna(subset=['Value']).reset_index(drop=True)
+
+
+def read_sql_zone_sizing(sql_file):
+    """
+    Reads the zone design loads and air flows of the sizing calculation from 'eplusout.sql'
+    :param sql_file: path to 'eplusout.sql'
+    :returns: dataframe with one row per zone and load type (empty if no zone sizing was performed)
+    """
+    columns = {'ZoneName': 'Zone name', 'LoadType': 'Load type', 'CalcDesLoad': 'Design load [W]',
+               'CalcDesFlow': 'Design air flow [m3/s]', 'DesDayName': 'Design day', 'PeakHrMin': 'Peak time'}
+    con = sqlite3.connect(f'file:{sql_file}?mode=ro', uri=True)
+    if con.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'ZoneSizes'").fetchone() is None:
+        df = pd.DataFrame(columns=list(columns))
+    else:
+        df = pd.read_sql_query("SELECT %s FROM ZoneSizes ORDER BY ZoneSizesIndex" % ', '.join(columns), con)
+    con.close()
+    return df.rename(columns=columns)
@@ -0,0 +1,295 @@
+"""
+Vectorized geometry of the surfaces in an IDF file (areas, tilts, azimuths, heights, bounding boxes and footprints)
+
+The calculations follow eppy.geometry.surface, but are performed for all surfaces of a model at once. The results are
+kept in a geometry table, which is created once per model and shared by material.py and mmv.py.
+"""
+import collections
+import math
+import weakref
+import numpy as np
+import eppy.function_helpers
+
+# IDF objects with vertices
+vertex_objects = ['BuildingSurface:Detailed', 'FenestrationSurface:Detailed']
+# geometry tables by model, see get_geometry_table()
+geometry_tables = weakref.WeakKeyDictionary()
+
+
+def get_geometry_table(idf):
+    """
+    Returns the geometry table of a model. The table is created when it is requested for the first time and it is
+    created again if surfaces were added to or removed from the model. NB: Changes of the vertices of existing surfaces
+    are not detected.
+    :param idf: IDF file
+    :return: table: geometry table, see make_geometry_table()
+    """
+    table = geometry_tables.get(idf)
+    if table is None or len(table['names']) != sum(len(idf.idfobjects[obj_type.upper()])
+                                                   for obj_type in vertex_objects):
+        table = make_geometry_table(idf)
+        geometry_tables[idf] = table
+    return table
+
+
+def get_surface_geometry(obj, attribute):
+    """
+    Looks up a geometry attribute of a surface in the geometry table of its model
+    :param obj: eppy object of type BuildingSurface:Detailed or FenestrationSurface:Detailed
+    :param attribute: 'area', 'tilt', 'azimuth', 'height', 'z_max' or 'z_abs_max'
+    :return: value of the attribute
+    """
+    table = get_geometry_table(obj.theidf)
+    if obj.Name not in table['index']:
+        table = make_geometry_table(obj.theidf)
+        geometry_tables[obj.theidf] = table
+    return float(table[attribute][table['index'][obj.Name]])
+
+
+def make_geometry_table(idf):
+    """
+    Extracts the vertices of all surfaces into packed arrays and calculates their geometry
+    :param idf: IDF file
+    :return: table: dictionary with the surface names, their index, the vertices (surfaces x max. vertices x 3,
+        padded with zeros), the number of vertices and arrays with the area, tilt, azimuth, height, bounding box
+        (x_min, y_min, z_min, x_max, y_max, z_max), z_max and z_abs_max of each surface
+    """
+    objs = [obj for obj_type in vertex_objects for obj in idf.idfobjects[obj_type.upper()]]
+    coords = [eppy.function_helpers.getcoords(obj) for obj in objs]
+    n_vertices = np.array([len(c) for c in coords], dtype=int)
+    vertices = np.zeros((len(objs), max(n_vertices, default=0), 3))
+    for i, c in enumerate(coords):
+        vertices[i, :len(c)] = c
+    table = {'names': [obj.Name for obj in objs],
+             'index': {obj.Name: i for i, obj in enumerate(objs)},
+             'vertices': vertices,
+             'n_vertices': n_vertices,
+             'area': calc_areas(vertices, n_vertices),
+             'tilt': calc_tilts(vertices, n_vertices),
+             'azimuth': calc_azimuths(vertices, n_vertices),
+             'height': calc_heights(vertices, n_vertices),
+             'bbox': calc_bounding_boxes(vertices, n_vertices)}
+    table['z_max'] = table['bbox'][:, 5]
+    table['z_abs_max'] = np.maximum(np.abs(table['bbox'][:, 2]), np.abs(table['bbox'][:, 5]))
+    return table
+
+
+def get_absolute_vertices(idf, surfaces):
+    """
+    Returns the vertices of surfaces in the coordinate system of the building. If the coordinates of the IDF file are
+    relative (GlobalGeometryRules), the vertices are rotated by the relative north of their zone and moved by its
+    origin.
+    :param idf: IDF file
+    :param surfaces: list of eppy objects of type BuildingSurface:Detailed
+    :return: vertices: numpy array (surfaces x max. vertices x 3), n_vertices: numpy array
+    """
+    table = get_geometry_table(idf)
+    rows = [table['index'][surface.Name] for surface in surfaces]
+    vertices, n_vertices = table['vertices'][rows], table['n_vertices'][rows]
+    rules = idf.idfobjects['GlobalGeometryRules'.upper()]
+    if rules and rules[0].Coordinate_System.lower() not in ('', 'relative'):
+        return vertices, n_vertices
+    zones = {zone.Name.lower(): zone for zone in idf.idfobjects['Zone'.upper()]}
+    zone_objs = [zones[surface.Zone_Name.lower()] for surface in surfaces]
+    origins = np.array([[float(zone[field] or 0) for field in ('X_Origin', 'Y_Origin', 'Z_Origin')]
+                        for zone in zone_objs]).reshape(-1, 3)
+    angles = np.radians([-float(zone.Direction_of_Relative_North or 0) for zone in zone_objs])
+    cos, sin = np.cos(angles)[:, None], np.sin(angles)[:, None]
+    x, y = vertices[:, :, 0], vertices[:, :, 1]
+    absolute = np.stack([x * cos - y * sin, x * sin + y * cos, vertices[:, :, 2]], axis=2) + origins[:, None, :]
+    return absolute, n_vertices
+
+
+def calc_unit_normals(pt_a, pt_b, pt_c):
+    """
+    Calculates the unit normal vectors of the planes defined by three points (see eppy.geometry.surface.unit_normal())
+    :param pt_a: numpy array (surfaces x 3) with the first points
+    :param pt_b: numpy array (surfaces x 3) with the second points
+    :param pt_c: numpy array (surfaces x 3) with the third points
+    :return: normals: numpy array (surfaces x 3), valid: boolean array, False if the points are in a straight line
+    """
+    pts = np.stack([pt_a, pt_b, pt_c], axis=1)
+    ones = np.ones(pts.shape[:2])
+    x_val = np.linalg.det(np.stack([ones, pts[:, :, 1], pts[:, :, 2]], axis=2))
+    y_val = np.linalg.det(np.stack([pts[:, :, 0], ones, pts[:, :, 2]], axis=2))
+    z_val = np.linalg.det(np.stack([pts[:, :, 0], pts[:, :, 1], ones], axis=2))
+    magnitude = (x_val ** 2 + y_val ** 2 + z_val ** 2) ** 0.5
+    valid = magnitude >= 0.00000001
+    magnitude = np.where(valid, magnitude, 1)
+    normals = np.stack([x_val / magnitude, y_val / magnitude, z_val / magnitude], axis=1)
+    return normals, valid
+
+
+def calc_areas(vertices, n_vertices):
+    """
+    Calculates the area of polygons with Newell's method (see eppy.geometry.surface.area())
+    :param vertices: numpy array (surfaces x max. vertices x 3)
+    :param n_vertices: numpy array with the number of vertices of each surface
+    :return: numpy array with the areas
+    """
+    n_surfaces, max_vertices = vertices.shape[:2]
+    rows = np.arange(n_surfaces)
+    total = np.zeros((n_surfaces, 3))
+    for j in range(max_vertices):
+        has_vertex = j < n_vertices
+        nxt = np.where(has_vertex, (j + 1) % np.maximum(n_vertices, 1), 0)
+        prod = np.cross(vertices[:, j], vertices[rows, nxt])
+        total += np.where(has_vertex[:, None], prod, 0.0)
+    if n_surfaces == 0:
+        return np.zeros(0)
+    normals, valid = calc_unit_normals(vertices[:, 0], vertices[:, 1], vertices[:, 2])
+    # if the first three points are in a straight line, try each vertex of the polygon
+    for i in np.where(~valid & (n_vertices >= 3))[0]:
+        n = n_vertices[i]
+        for k in range(n):
+            normal, ok = calc_unit_normals(vertices[[i], k - 1], vertices[[i], k], vertices[[i], (k + 1) % n])
+            if ok[0]:
+                normals[i], valid[i] = normal[0], True
+                break
+    areas = np.abs((total[:, 0] * normals[:, 0] + total[:, 1] * normals[:, 1] + total[:, 2] * normals[:, 2]) / 2)
+    # not a plane, points in a straight line or all points in a straight line - no area
+    no_area = (n_vertices < 3) | np.all(total == 0, axis=1) | ~valid
+    return np.where(no_area, 0.0, areas)
+
+
+def calc_angles(vec, ref):
+    """
+    Calculates the angle (degrees) between vectors and a reference unit vector (see eppy.geometry.surface.angle2vecs())
+    :param vec: numpy array (surfaces x 3)
+    :param ref: reference unit vector, e.g. (0, 0, 1)
+    :return: numpy array with the angles
+    """
+    dot = vec[:, 0] * ref[0] + vec[:, 1] * ref[1] + vec[:, 2] * ref[2]
+    modulus = np.sqrt(vec[:, 0] * vec[:, 0] + vec[:, 1] * vec[:, 1] + vec[:, 2] * vec[:, 2])
+    cos_angle = np.where(modulus == 0, 1, dot / np.where(modulus == 0, 1, modulus))
+    return np.arccos(cos_angle) * (180 / math.pi)
+
+
+def calc_last_vertex_normals(vertices, n_vertices):
+    """
+    Calculates the unit normals defined by the first, second and last vertex of each surface (used for tilt and azimuth)
+    :param vertices: numpy array (surfaces x max. vertices x 3)
+    :param n_vertices: numpy array with the number of vertices of each surface
+    :return: numpy array (surfaces x 3) with the normals (nan if the points are in a straight line)
+    """
+    rows = np.arange(vertices.shape[0])
+    normals, valid = calc_unit_normals(vertices[:, 0], vertices[:, 1], vertices[rows, n_vertices - 1])
+    normals[~valid] = np.nan
+    return normals
+
+
+def calc_tilts(vertices, n_vertices):
+    """
+    Calculates the tilt of the surfaces (see eppy.geometry.surface.tilt())
+    :param vertices: numpy array (surfaces x max. vertices x 3)
+    :param n_vertices: numpy array with the number of vertices of each surface
+    :return: numpy array with the tilts (degrees)
+    """
+    if vertices.shape[0] == 0:
+        return np.zeros(0)
+    return calc_angles(calc_last_vertex_normals(vertices, n_vertices), (0, 0, 1))
+
+
+def calc_azimuths(vertices, n_vertices):
+    """
+    Calculates the azimuth of the surfaces (see eppy.geometry.surface.azimuth())
+    :param vertices: numpy array (surfaces x max. vertices x 3)
+    :param n_vertices: numpy array with the number of vertices of each surface
+    :return: numpy array with the azimuths (degrees)
+    """
+    if vertices.shape[0] == 0:
+        return np.zeros(0)
+    normals = calc_last_vertex_normals(vertices, n_vertices)
+    normals[:, 2] = 0
+    angles = calc_angles(normals, (0, 1, 0))
+    return np.where(normals[:, 0] < 0, 360 - angles, angles)
+
+
+def calc_heights(vertices, n_vertices):
+    """
+    Calculates the height of the surfaces (see eppy.geometry.surface.height())
+    :param vertices: numpy array (surfaces x max. vertices x 3)
+    :param n_vertices: numpy array with the number of vertices of each surface
+    :return: numpy array with the heights
+    """
+    if vertices.shape[0] == 0:
+        return np.zeros(0)
+    rows = np.arange(vertices.shape[0])
+    first, second, last = vertices[:, 0], vertices[:, 1], vertices[rows, n_vertices - 1]
+    dz_last = np.abs(last[:, 2] - first[:, 2])
+    dz_second = np.abs(second[:, 2] - first[:, 2])
+    dist_last = np.sqrt(np.sum((first - last) ** 2, axis=1))
+    dist_second = np.sqrt(np.sum((first - second) ** 2, axis=1))
+    return np.where(dz_last > dz_second, dist_last,
+                    np.where(dz_last < dz_second, dist_second, np.minimum(dist_last, dist_second)))
+
+
+def calc_bounding_boxes(vertices, n_vertices):
+    """
+    Calculates the bounding box of the surfaces
+    :param vertices: numpy array (surfaces x max. vertices x 3)
+    :param n_vertices: numpy array with the number of vertices of each surface
+    :return: numpy array (surfaces x 6) with x_min, y_min, z_min, x_max, y_max, z_max
+    """
+    has_vertex = np.arange(vertices.shape[1])[None, :] < n_vertices[:, None]
+    low = np.where(has_vertex[:, :, None], vertices, np.inf).min(axis=1, initial=np.inf)
+    high = np.where(has_vertex[:, :, None], vertices, -np.inf).max(axis=1, initial=-np.inf)
+    return np.hstack([low, high])
+
+
+def calc_footprint(vertices, n_vertices, decimals=4):
+    """
+    Calculates the area and perimeter of the outline (union) of floor polygons projected onto the xy plane, e.g. of
+    the ground floors of a building. The polygons are assumed not to overlap. All polygons are oriented
+    counterclockwise, so that an edge shared by two neighbouring polygons occurs in opposite directions and cancels
+    out. Edges are split at the vertices of the neighbouring polygons lying on them (T-junctions) first, so that partly
+    shared edges cancel out as well. The remaining edges form the outline of the footprint, incl. courtyards.
+    :param vertices: numpy array (surfaces x max. vertices x 3)
+    :param n_vertices: numpy array with the number of vertices of each surface
+    :param decimals: coordinates are compared after rounding to this number of decimals (default: 0.1 mm)
+    :return: area, perimeter
+    """
+    n_vertices = np.asarray(n_vertices)
+    if len(n_vertices) == 0:
+        return 0.0, 0.0
+    tol = 0.5 * 10.0 ** -decimals
+    # directed edges of all polygons, oriented counterclockwise
+    has_vertex = np.arange(vertices.shape[1])[None, :] < n_vertices[:, None]
+    rows = np.arange(len(n_vertices))
+    pts = vertices[:, :, :2]
+    nxt = np.where(has_vertex, (np.arange(vertices.shape[1])[None, :] + 1) % np.maximum(n_vertices, 1)[:, None], 0)
+    pts_next = pts[rows[:, None], nxt]
+    signed_area = np.where(has_vertex, pts[:, :, 0] * pts_next[:, :, 1] - pts_next[:, :, 0] * pts[:, :, 1], 0).sum(1)
+    clockwise = (signed_area < 0)[:, None] & has_vertex
+    start = np.where(clockwise[:, :, None], pts_next, pts)[has_vertex]
+    end = np.where(clockwise[:, :, None], pts, pts_next)[has_vertex]
+    direction = end - start
+    length2 = (direction ** 2).sum(axis=1)
+    keep = length2 > tol ** 2
+    start, end, direction, length2 = start[keep], end[keep], direction[keep], length2[keep]
+    # position of every vertex along every edge (t) and its distance from the edge
+    corners = np.unique(np.round(start, decimals), axis=0)
+    rel = corners[None, :, :] - start[:, None, :]
+    t = (rel[:, :, 0] * direction[:, None, 0] + rel[:, :, 1] * direction[:, None, 1]) / length2[:, None]
+    length = np.sqrt(length2)[:, None]
+    dist = np.abs(rel[:, :, 0] * direction[:, None, 1] - rel[:, :, 1] * direction[:, None, 0]) / length
+    eps = tol / length
+    splits = (dist < tol) & (t > eps) & (t < 1 - eps)
+    # split the edges into segments and count them; segments of opposite directions cancel out
+    segments = collections.Counter()
+    for i in range(len(start)):
+        ts = np.concatenate([[0.0], np.sort(t[i, splits[i]]), [1.0]])
+        seg_pts = np.round(start[i] + ts[:, None] * direction[i], decimals)
+        for a, b in zip(map(tuple, seg_pts[:-1]), map(tuple, seg_pts[1:])):
+            if a < b:
+                segments[(a, b)] += 1
+            elif b < a:
+                segments[(b, a)] -= 1
+    if not segments:
+        return 0.0, 0.0
+    outline = np.array([a + b for a, b in segments.keys()])
+    counts = np.array(list(segments.values()))
+    area = float((counts * (outline[:, 0] * outline[:, 3] - outline[:, 2] * outline[:, 1])).sum() / 2)
+    lengths = np.sqrt((outline[:, 2] - outline[:, 0]) ** 2 + (outline[:, 3] - outline[:, 1]) ** 2)
+    perimeter = float((np.abs(counts) * lengths).sum())
+    return area, perimeter
@@ -0,0 +1,179 @@
+"""
+Embodied and operational impacts (e.g. greenhouse gas emissions) of a batch simulation
+
+The embodied impacts are calculated from the material demand matrix of the batch (see results.py) and a table of
+impact factors per material or per aggregation category, e.g. kg CO2-eq/kg, with one column per factor scenario. The
+operational impacts are calculated from the energy demand of the simulations ('energy_demand.csv') and a table of
+factors per EnergyPlus output variable, e.g. the grid emission factor in kg CO2-eq/kWh. Both are one matrix product
+(simulations x materials or energy variables) @ (materials or energy variables x scenarios). The material and energy
+demand are read from the results store of the batch simulation (see store.py) and the impacts are written back into
+it ('results_store/impacts/part-00000.npz' and 'summary_impacts.csv').
+"""
+import os
+import numpy as np
+import pandas as pd
+from BuildME import results, settings, store
+
+# name of the impact results in the results store
+impact_name = 'impacts.csv'
+
+
+def read_factors(factors):
+    """
+    Reads a table of impact factors
+    :param factors: pandas dataframe indexed by material, aggregation category or energy variable with one column per
+        factor scenario (a pandas series, a dictionary like {name: factor} or the path to a csv file are also accepted)
+    :return: pandas dataframe (names x scenarios)
+    """
+    if isinstance(factors, str):
+        factors = pd.read_csv(factors, index_col=0)
+    elif isinstance(factors, dict):
+        factors = pd.Series(factors, dtype=float)
+    if isinstance(factors, pd.Series):
+        factors = factors.to_frame(name=factors.name if factors.name is not None else 'default')
+    return factors.astype(float)
+
+
+def make_material_factor_matrix(matrix, factors):
+    """
+    Creates the materials x scenarios matrix of impact factors. Factors given for a material take precedence over the
+    factors given for its aggregation category.
+    :param matrix: dictionary with the material demand matrix, see results.make_material_matrix()
+    :param factors: impact factors per material and/or aggregation category, see read_factors()
+    :return: numpy array (materials x scenarios)
+    :return: list of the materials without an impact factor
+    """
+    factors = read_factors(factors)
+    mat_categories = matrix['categories'][matrix['material_category']]
+    values = np.zeros((len(matrix['materials']), len(factors.columns)))
+    missing = []
+    for j, (mat, category) in enumerate(zip(matrix['materials'], mat_categories)):
+        if mat in factors.index:
+            values[j] = factors.loc[mat].to_numpy()
+        elif category in factors.index:
+            values[j] = factors.loc[category].to_numpy()
+        else:
+            missing.append(str(mat))
+    return values, missing
+
+
+def calc_embodied_impacts(matrix, factors):
+    """
+    Calculates the embodied impacts of all simulations and factor scenarios
+    :param matrix: dictionary with the material demand matrix, see results.make_material_matrix()
+    :param factors: impact factors per material and/or aggregation category (per kg), see read_factors()
+    :return: pandas dataframe (simulations x scenarios)
+    """
+    scenarios = read_factors(factors).columns
+    factor_matrix, missing = make_material_factor_matrix(matrix, factors)
+    if missing:
+        print(f'Warning: No impact factors found for the following materials (their impacts are set to 0): '
+              f'\n {missing}')
+    impacts = results.to_dense(matrix) @ factor_matrix
+    return pd.DataFrame(impacts, index=matrix['sims'], columns=scenarios)
+
+
+def collect_energy_matrix(parent_dir):
+    """
+    Collects the energy demand of the simulations ('energy_demand.csv' in the results store) into a simulations x
+    energy variables matrix
+    :param parent_dir: batch simulation folder
+    :return: pandas dataframe (simulations x energy variables), the unit is given by the attribute 'unit'
+    """
+    df = store.scan_results(parent_dir, 'energy_demand.csv')
+    if df is None:
+        raise Exception(f'No energy demand found in the results store of {parent_dir}')
+    df = df[df['EnergyPlus output variable'] != 'TOTAL']
+    units = set(df['Unit'].astype(str))
+    if len(units) > 1:
+        raise Exception(f'The energy demand of the simulations is given in different units: {units}')
+    energy = df.pivot_table(index=df['Building name'].astype(str), columns=df['EnergyPlus output variable'].astype(str),
+                            values='Value', aggfunc='sum', sort=False).fillna(0)
+    energy.index.name, energy.columns.name = None, None
+    energy.attrs['unit'] = str(units.pop()) if units else None
+    return energy
+
+
+def calc_operational_impacts(energy, factors, years=1):
+    """
+    Calculates the operational impacts of all simulations and factor scenarios
+    :param energy: pandas dataframe (simulations x energy variables), see collect_energy_matrix()
+    :param factors: impact factors per energy variable (per unit of the energy demand), see read_factors()
+    :param years: number of years of operation (default: 1, i.e. annual impacts)
+    :return: pandas dataframe (simulations x scenarios)
+    """
+    factors = read_factors(factors)
+    missing = [v for v in energy.columns if v not in factors.index]
+    if missing:
+        print(f'Warning: No impact factors found for the following energy variables (their impacts are set to 0): '
+              f'\n {missing}')
+    factor_matrix = factors.reindex(energy.columns).fillna(0).to_numpy()
+    impacts = energy.to_numpy() @ factor_matrix * years
+    return pd.DataFrame(impacts, index=energy.index, columns=factors.columns)
+
+
+def calculate_impacts(batch_sim=None, folder=None, material_factors=None, energy_factors=None, years=1,
+                      unit='kg CO2-eq', combinations=None):
+    """
+    Calculates the embodied and/or operational impacts of a batch simulation from its results store and writes them
+    into the store and the summary file 'summary_impacts.csv'
+    :param batch_sim: dictionary with batch simulation information
+    :param folder: batch simulation folder (required only when batch_sim is None)
+    :param material_factors: impact factors per material and/or aggregation category, see read_factors() (optional)
+    :param energy_factors: impact factors per energy variable, see read_factors() (optional)
+    :param years: number of years of operation for the operational impacts (default: 1)
+    :param unit: unit of the impacts (default: 'kg CO2-eq')
+    :param combinations: a dictionary with the selected BuildME aspects and their values
+    :return: dictionary like {'embodied': dataframe, 'operational': dataframe} (simulations x scenarios)
+    """
+    print("Calculating impacts...")
+    if batch_sim is not None:
+        folder = os.path.dirname(batch_sim[list(batch_sim.keys())[0]]['run_folder'])
+    elif folder is None:
+        raise Exception('Folder not given')
+    if combinations is None:
+        combinations = settings.debug_combinations
+    aspect_names = ['region'] + list(list(combinations.values())[0].keys())
+    impacts = {}
+    if material_factors is not None:
+        matrix = results.make_material_matrix_from_store(folder, aspect_names)
+        if matrix is None and os.path.exists(os.path.join(folder, results.matrix_file)):
+            # batch simulations in memory only save the matrix, see simulate.calculate_materials_in_memory()
+            matrix = results.load_material_matrix(folder)
+        if matrix is None:
+            raise Exception(f'No material demand found in the results store of {folder}')
+        impacts['embodied'] = calc_embodied_impacts(matrix, material_factors)
+    if energy_factors is not None:
+        impacts['operational'] = calc_operational_impacts(collect_energy_matrix(folder), energy_factors, years)
+    if not impacts:
+        raise Exception('Neither material nor energy impact factors given')
+    save_impacts(impacts, folder, aspect_names, unit)
+    return impacts
+
+
+def save_impacts(impacts, folder, aspect_names, unit='kg CO2-eq'):
+    """
+    Writes the impacts into the results store and saves the summary file indexed by the aspects of the simulations
+    :param impacts: dictionary like {'embodied': dataframe, 'operational': dataframe} (simulations x scenarios)
+    :param folder: batch simulation folder
+    :param aspect_names: names of the BuildME aspects, e.g., ['region', 'occupation', ...]
+    :param unit: unit of the impacts
+    """
+    dfs = []
+    for kind, df in impacts.items():
+        long = df.rename_axis(index='Building name', columns='Scenario').stack().rename('Value').reset_index()
+        long.insert(1, 'Impact', kind)
+        long.insert(3, 'Unit', unit)
+        dfs.append(long)
+    store.write_results(folder, impact_name, pd.concat(dfs, ignore_index=True), clear=True)
+    store.save_summaries(folder, [impact_name], aspect_names)
+    return
+
+
+def load_impacts(parent_dir):
+    """
+    Loads the impacts of a batch simulation from the results store
+    :param parent_dir: batch simulation folder
+    :return: pandas dataframe (or None if no impacts were calculated)
+    """
+    return store.scan_results(parent_dir, impact_name)
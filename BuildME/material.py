@@ -9,20 +9,102 @@ import os
 import numpy as np
 import pandas as pd
 from eppy.modeleditor import IDF
-import eppy.function_helpers
 import statistics
+from BuildME import geometry, settings, surrogate
+
+# Surface categories by (element type, "!- Outside Boundary Condition", "!- Surface Type") used by
+#  classify_surfaces(). Adiabatic floors are either internal or external floors, see classify_surfaces().
+surface_categories = {
+    ('BuildingSurface:Detailed', 'Outdoors', 'Wall'): 'ext_wall',
+    ('BuildingSurface:Detailed', 'Surface', 'Wall'): 'int_wall',
+    ('BuildingSurface:Detailed', 'Zone', 'Wall'): 'int_wall',
+    ('InternalMass', None, None): 'int_wall',
+    ('Door', None, None): 'door',
+    ('FenestrationSurface:Detailed', None, 'Door'): 'door',
+    ('Window', None, None): 'window',
+    ('FenestrationSurface:Detailed', None, 'Window'): 'window',
+    ('FenestrationSurface:Detailed', None, 'GlassDoor'): 'window',
+    ('BuildingSurface:Detailed', 'Outdoors', 'Floor'): 'int_floor',
+    ('BuildingSurface:Detailed', 'Surface', 'Floor'): 'int_floor',
+    ('BuildingSurface:Detailed', 'Zone', 'Floor'): 'int_floor',
+    ('BuildingSurface:Detailed', 'Surface', 'Ceiling'): 'int_ceiling',
+    ('BuildingSurface:Detailed', 'Adiabatic', 'Ceiling'): 'int_ceiling',
+    ('BuildingSurface:Detailed', 'GroundBasementPreprocessorAverageWall', 'Wall'): 'basement_ext_wall',
+    ('BuildingSurface:Detailed', 'GroundFCfactorMethod', 'Wall'): 'basement_ext_wall',
+    ('BuildingSurface:Detailed', 'Ground', 'Floor'): 'ext_floor',
+    ('BuildingSurface:Detailed', 'GroundSlabPreprocessorAverage', 'Floor'): 'ext_floor',
+    ('BuildingSurface:Detailed', 'GroundFCfactorMethod', 'Floor'): 'ext_floor',
+    ('BuildingSurface:Detailed', 'Adiabatic', 'Floor'): 'adiabatic_floor',
+    ('BuildingSurface:Detailed', 'Zone', 'Ceiling'): 'ceiling_roof',
+    ('BuildingSurface:Detailed', 'Outdoors', 'Roof'): 'roof'
+}
+element_types = ['BuildingSurface:Detailed', 'FenestrationSurface:Detailed', 'Window', 'Door', 'InternalMass']
+# Keys of surface_categories that contain FenestrationSurface:Detailed objects
+fenestration_keys = [key for key in surface_categories if key[0] == 'FenestrationSurface:Detailed']
 
 
 def perform_materials_calculation(idf_file, out_dir, atypical_materials, surrogates_dict,
-                                  ifsurrogates=True, replace_dict=None):
+                                  ifsurrogates=True, replace_dict=None, snapshot=None):
     """
     Runs the material demand simulation
     :param idf_file: IDF file
     :param out_dir: output folder directory
     :param atypical_materials: pandas dataframe with atypical materials and their thickness (m) and density (kg/m3)
-    :param surrogates_dict: dictionary with surrogate element information
+    :param surrogates_dict: surrogate elements of the simulation, either a surrogate table (see
+        surrogate.get_surrogate_rows()) or a dictionary with surrogate element information
     :param ifsurrogates: True if surrogate calculations are requested (default: False)
     :param replace_dict: dictionary with BuildME replacement aspects
+    :param snapshot: geometry snapshot of the archetype as created by make_geometry_snapshot() (optional)
+    :return: snapshot: geometry snapshot, which can be reused for other variants of the same archetype
+    """
+    inputs = make_material_inputs(idf_file, atypical_materials, replace_dict, snapshot)
+    mat_mass, geom_stats = calc_material_demand(inputs, surrogates_dict, ifsurrogates)
+    # export
+    save_dict_to_csv(geom_stats, out_dir, 'geom_stats.csv', header=['Geometry statistics', 'Unit', 'Value'],
+                     units_dict={'area': 'm^2', 'perimeter': 'm', 'height': 'm', 'num_of_floors': 'floors'})
+    save_dict_to_csv(mat_mass, out_dir, 'mat_demand.csv', header=['Material name', 'Unit', 'Value'],
+                     units_dict={'': 'kg'})
+    return inputs['snapshot']
+
+
+def calc_material_demand(inputs, surrogates_dict, ifsurrogates=True):
+    """
+    Calculates the material demand of a building from its material inputs
+    :param inputs: material inputs as created by make_material_inputs()
+    :param surrogates_dict: surrogate elements of the simulation, either a surrogate table (see
+        surrogate.get_surrogate_rows()) or a dictionary with surrogate element information
+    :param ifsurrogates: True if surrogate calculations are requested (default: True)
+    :return: mat_mass: dictionary like {material name: mass (kg)}
+    :return: geom_stats: dictionary with the geometry statistics (incl. the floor area of the basements)
+    """
+    geom_stats = dict(inputs['geom_stats'])
+    # calculate the total material volume (thickness * total area, by material)
+    mat_vol_bdg = calc_mat_vol_matrix(inputs['net_areas'], inputs['thickness'])
+    # calculate the total mass (total volume/density, by material)
+    mat_mass = calc_mat_mass_matrix(mat_vol_bdg, inputs['densities'])
+    mat_mass = dict(zip(inputs['mat_names'], mat_mass.tolist()))
+    # add surrogate materials
+    if ifsurrogates:
+        if not surrogate.is_surrogate_table(surrogates_dict):
+            surrogates_dict = surrogate.compile_surrogates_dict(surrogates_dict)
+        surrogate_mass, floor_area = surrogate.calc_surrogate_masses(surrogates_dict, geom_stats)
+        mat_mass = add_surrogate_element_to_mat_mass(mat_mass, dict(zip(surrogates_dict['materials'],
+                                                                        surrogate_mass[0].tolist())))
+        # the basements add to the floor area
+        geom_stats['total_floor_area'] = geom_stats['total_floor_area'] + float(floor_area[0])
+    return mat_mass, geom_stats
+
+
+def make_material_inputs(idf_file, atypical_materials, replace_dict=None, snapshot=None):
+    """
+    Prepares the inputs of the material demand calculation: the net area of the constructions, the thickness of the
+    materials in the constructions and the density of the materials
+    :param idf_file: IDF file
+    :param atypical_materials: pandas dataframe with atypical materials and their thickness (m) and density (kg/m3)
+    :param replace_dict: dictionary with BuildME replacement aspects
+    :param snapshot: geometry snapshot of the archetype as created by make_geometry_snapshot() (optional)
+    :return: dictionary with the material names, net areas (constructions), thickness (constructions x materials),
+        densities (materials), geometry statistics and the geometry snapshot
     """
     # find the materials used in the building
     materials = make_materials_dict(idf_file)
@@ -30,53 +112,18 @@ def perform_materials_calculation(idf_file, out_dir, atypical_materials, surroga
     densities = make_mat_density_dict(materials, atypical_materials)
     # find the thicknesses of material layers in various construction types
     constr_layers = make_construction_dict(idf_file, materials, atypical_materials, replace_dict)
-    # calculate the total area of surfaces (including surfaces from zone multipliers and surrogate surfaces)
-    surfaces = get_surfaces(idf_file)
-    surfaces = get_surfaces_from_floor_multipliers(idf_file, surfaces)
-    # add the total floor area and other area measures
-    geom_stats = get_building_geometry_stats(idf_file, surfaces)
-    # calculate the total material volume (thickness * total area, by material)
-    mat_vol_bdg = calc_mat_vol_bdg(idf_file, surfaces, constr_layers)
-    # calculate the total mass (total volume/density, by material)
-    mat_mass = {mat: mat_vol_bdg[mat] * densities[mat] for mat in mat_vol_bdg}
-    # add surrogate materials
-    if ifsurrogates:
-        for key, calc_dict in surrogates_dict.items():
-            if all(v == 0 for k, v in calc_dict.items()):
-                continue
-            elif key.startswith('basement'):
-                if '*' in key:
-                    multiplier = float(key.split('*')[1])
-                else:
-                    multiplier = 1
-                basement, area_slab = add_surrogate_basement(geom_stats, **surrogates_dict[key])
-                mat_mass = add_surrogate_element_to_mat_mass(mat_mass, {k: v*multiplier for k, v in basement.items()})
-                geom_stats['total_floor_area'] = geom_stats['total_floor_area']+area_slab*multiplier
-            elif key == 'foundation':
-                foundation = add_surrogate_foundation(geom_stats, **surrogates_dict[key])
-                mat_mass = add_surrogate_element_to_mat_mass(mat_mass, foundation)
-            elif key == 'beams':
-                beams = add_surrogate_beams(geom_stats, **surrogates_dict[key])
-                mat_mass = add_surrogate_element_to_mat_mass(mat_mass, beams)
-            elif key == 'columns':
-                columns = add_surrogate_columns(geom_stats, **surrogates_dict[key])
-                mat_mass = add_surrogate_element_to_mat_mass(mat_mass, columns)
-            elif key == 'studs':
-                studs = add_surrogate_studs(geom_stats, **surrogates_dict[key])
-                mat_mass = add_surrogate_element_to_mat_mass(mat_mass, studs)
-            elif key == 'roof_beams':
-                roof_beams = add_surrogate_roof_beams(geom_stats, **surrogates_dict[key])
-                mat_mass = add_surrogate_element_to_mat_mass(mat_mass, roof_beams)
-            elif key == 'shear_walls':
-                shear_walls = add_surrogate_shear_walls(geom_stats, **surrogates_dict[key])
-                mat_mass = add_surrogate_element_to_mat_mass(mat_mass, shear_walls)
-            else:
-                print(f'Warning: surrogate element {key} not recognized')
-    # export
-    save_dict_to_csv(geom_stats, out_dir, 'geom_stats.csv', header=['Geometry statistics', 'Unit', 'Value'],
-                     units_dict={'area': 'm^2', 'perimeter': 'm', 'height': 'm', 'num_of_floors': 'floors'})
-    save_dict_to_csv(mat_mass, out_dir, 'mat_demand.csv', header=['Material name', 'Unit', 'Value'],
-                     units_dict={'': 'kg'})
+    # calculate the area of surfaces (incl. zone multipliers) and other area measures, unless known for the archetype
+    if snapshot is None:
+        snapshot = make_geometry_snapshot(idf_file)
+    constr_names = get_construction_names(idf_file, snapshot['names'])
+    constructions, net_areas = make_net_area_vector_from_snapshot(snapshot, constr_names, constr_layers)
+    mat_names, thickness = make_thickness_matrix(constr_layers, constructions)
+    return {'mat_names': mat_names,
+            'net_areas': net_areas,
+            'thickness': thickness,
+            'densities': make_density_vector(densities, mat_names),
+            'geom_stats': snapshot['geom_stats'],
+            'snapshot': snapshot}
 
 
 def add_surrogate_element_to_mat_mass(mat_mass, surrogate_element):
@@ -219,42 +266,162 @@ class SurrogateElement:
             # self.Surface_Type = g.Surface_Type
 
 
-def calc_mat_vol_bdg(idff, surfaces, constr_layers):
+def calc_mat_vol_bdg(idff, surfaces, constr_layers, fenestration_dict=None, weights=None):
     """
     Calculate building's total volume
     :param idff: IDF file
     :param surfaces: A dictionary for each surface type, e.g. {'ext_wall': [object1, object2], 'roof': [object3]}
     :param constr_layers: dictionary with constructions and their layers incl. layer thickness
         e.g. { 'AtticRoofDeck': {'F12 Asphalt shingles': 0.0032, 'G02 16mm plywood': 0.0159}, ...}
+    :param fenestration_dict: fenestration objects by host surface as created by make_fenestration_dict() (optional)
+    :param weights: surface weights (zone multipliers) as created by get_surface_weights() (optional)
     :return: mat_vol: dictionary like {'material_name': volume, ...}
     """
-    mat_vol = {}
-    flat_surfaces = flatten_surfaces(surfaces)
-    for surface in flat_surfaces:
-        fenestration = get_fenestration_objects_from_surface(idff, surface)
-        if fenestration is None:
-            area = get_area(surface)
+    if fenestration_dict is None:
+        fenestration_dict = make_fenestration_dict(idff)
+    constructions, net_areas = make_net_area_vector(surfaces, constr_layers, fenestration_dict, weights)
+    mat_names, thickness = make_thickness_matrix(constr_layers, constructions)
+    mat_vol = calc_mat_vol_matrix(net_areas, thickness)
+    return dict(zip(mat_names, mat_vol.tolist()))
+
+
+def make_net_area_vector(surfaces, constr_layers, fenestration_dict, weights=None):
+    """
+    Sums up the net area (surface area minus fenestration area, multiplied by the surface weight) by construction
+    :param surfaces: A dictionary for each surface type, e.g. {'ext_wall': [object1, object2], 'roof': [object3]}
+    :param constr_layers: dictionary with constructions and their layers incl. layer thickness
+    :param fenestration_dict: fenestration objects by host surface as created by make_fenestration_dict()
+    :param weights: surface weights (zone multipliers) as created by get_surface_weights() (optional)
+    :return: constructions: list of the constructions used by the surfaces (in the order of first use)
+    :return: net_areas: numpy array with the net area (m2) of each construction
+    """
+    if weights is None:
+        weights = {key: [1] * len(surfaces[key]) for key in surfaces}
+    net_areas = {}
+    for surface, weight in zip(flatten_surfaces(surfaces), flatten_surfaces(weights)):
+        if surface.Name in fenestration_dict:
+            area = (get_area(surface) - fenestration_dict[surface.Name]['area']) * weight
         else:
-            fenestration_area = 0
-            for item in fenestration:
-                try:
-                    fenestration_area += item.area
-                except:
-                    fenestration_area += SurrogateElement(item).area
-            area = get_area(surface) - fenestration_area
+            area = get_area(surface) * weight
         constr_name = surface.Construction_Name
         if constr_name in constr_layers:
-            layers = constr_layers[constr_name]
-            for material in layers:
-                # thickness * surface
-                mat_in_element = constr_layers[constr_name][material] * area
-                if material not in mat_vol:
-                    mat_vol[material] = mat_in_element
-                else:
-                    mat_vol[material] += mat_in_element
+            net_areas[constr_name] = net_areas.get(constr_name, 0) + area
+        else:
+            print(f"Construction '{constr_name}' cannot be found")
+    return list(net_areas.keys()), np.array(list(net_areas.values()), dtype=float)
+
+
+def make_geometry_snapshot(idf):
+    """
+    Creates a snapshot of the archetype geometry, i.e. of everything in the material demand calculation that does not
+    depend on the constructions. The BuildME aspects (e.g. en-std, res) only replace constructions and a few
+    non-geometric fields, so the snapshot of one variant can be reused for all variants of the same archetype.
+    :param idf: IDF file
+    :return: snapshot: dictionary with the surface names (in the order of flatten_surfaces()), their categories,
+        the fenestration objects by host surface, the surface weights and net areas, and the geometry statistics
+    """
+    surfaces, categories = classify_surfaces(idf)
+    weights = get_surface_weights(idf, surfaces)
+    fenestration_dict = make_fenestration_dict(idf)
+    flat_surfaces = flatten_surfaces(surfaces)
+    flat_weights = flatten_surfaces(weights)
+    net_areas = []
+    for surface, weight in zip(flat_surfaces, flat_weights):
+        if surface.Name in fenestration_dict:
+            net_areas.append((get_area(surface) - fenestration_dict[surface.Name]['area']) * weight)
         else:
+            net_areas.append(get_area(surface) * weight)
+    snapshot = {'names': [surface.Name for surface in flat_surfaces],
+                'categories': categories,
+                'hosts': {k: [obj.Name for obj in v['objects']] for k, v in fenestration_dict.items()},
+                'weights': np.array(flat_weights),
+                'net_areas': np.array(net_areas, dtype=float),
+                'geom_stats': get_building_geometry_stats(idf, surfaces, weights)}
+    return snapshot
+
+
+def get_construction_names(idf, names):
+    """
+    Gets the construction names of the surfaces of a geometry snapshot from an IDF file (e.g. a variant of the
+    archetype the snapshot was created from)
+    :param idf: IDF file
+    :param names: list of surface names, see make_geometry_snapshot()
+    :return: list of construction names
+    """
+    constr_names = {obj.Name: obj.Construction_Name
+                    for element_type in element_types for obj in idf.idfobjects[element_type.upper()]}
+    missing = [name for name in names if name not in constr_names]
+    if missing:
+        raise Exception(f"The geometry snapshot does not match the IDF file. Surfaces not found: {missing}")
+    return [constr_names[name] for name in names]
+
+
+def make_net_area_vector_from_snapshot(snapshot, constr_names, constr_layers):
+    """
+    Sums up the net areas of a geometry snapshot by construction (see also make_net_area_vector())
+    :param snapshot: geometry snapshot as created by make_geometry_snapshot()
+    :param constr_names: list of construction names of the surfaces, see get_construction_names()
+    :param constr_layers: dictionary with constructions and their layers incl. layer thickness
+    :return: constructions: list of the constructions used by the surfaces (in the order of first use)
+    :return: net_areas: numpy array with the net area (m2) of each construction
+    """
+    for constr_name in constr_names:
+        if constr_name not in constr_layers:
             print(f"Construction '{constr_name}' cannot be found")
-    return mat_vol
+    constructions = list(dict.fromkeys(c for c in constr_names if c in constr_layers))
+    constr_index = {constr: i for i, constr in enumerate(constructions)}
+    index = np.array([constr_index.get(c, -1) for c in constr_names], dtype=int)
+    found = index >= 0
+    net_areas = np.bincount(index[found], weights=snapshot['net_areas'][found], minlength=len(constructions))
+    return constructions, net_areas
+
+
+def make_thickness_matrix(constr_layers, constructions):
+    """
+    Creates a matrix with the layer thickness of each material in each construction
+    :param constr_layers: dictionary with constructions and their layers incl. layer thickness
+    :param constructions: list of constructions (rows of the matrix)
+    :return: mat_names: list of materials (columns of the matrix, in the order of first use)
+    :return: thickness: numpy array (constructions x materials) with the thickness (m)
+    """
+    mat_names = list(dict.fromkeys(mat for constr in constructions for mat in constr_layers[constr]))
+    mat_index = {mat: j for j, mat in enumerate(mat_names)}
+    thickness = np.zeros((len(constructions), len(mat_names)))
+    for i, constr in enumerate(constructions):
+        for mat, value in constr_layers[constr].items():
+            thickness[i, mat_index[mat]] = value
+    return mat_names, thickness
+
+
+def calc_mat_vol_matrix(net_areas, thickness):
+    """
+    Calculates the material volumes as the product of the net areas and the thickness matrix. Several thickness
+    scenarios can be evaluated at once by stacking the matrices, i.e. (scenarios x constructions x materials).
+    :param net_areas: numpy array with the net area of each construction, see make_net_area_vector()
+    :param thickness: numpy array (constructions x materials) or (scenarios x constructions x materials)
+    :return: numpy array with the volume (m3) of each material, (materials) or (scenarios x materials)
+    """
+    return np.einsum('c,...cm->...m', net_areas, thickness)
+
+
+def calc_mat_mass_matrix(mat_vol, density):
+    """
+    Calculates the material masses from the material volumes. Several density scenarios can be evaluated at once.
+    :param mat_vol: numpy array with the material volumes, (materials) or (scenarios x materials)
+    :param density: numpy array with the material densities (kg/m3), (materials) or (scenarios x materials)
+    :return: numpy array with the mass (kg) of each material, (materials) or (scenarios x materials)
+    """
+    return mat_vol * density
+
+
+def make_density_vector(densities, mat_names):
+    """
+    Creates a vector of material densities in the order of the materials of the thickness matrix
+    :param densities: dictionary like {material.Name: density}
+    :param mat_names: list of materials, see make_thickness_matrix()
+    :return: numpy array with the densities (kg/m3)
+    """
+    return np.array([densities[mat] for mat in mat_names], dtype=float)
 
 
 def extract_surfaces(idf, element_type, boundary=None, surface_type=None):
@@ -303,99 +470,130 @@ def get_surfaces(idf):
     :param idf: IDF file
     :return: A dictionary for each surface type, e.g. {'ext_wall': [object1, object2], 'roof': [object3]}
     """
+    surfaces, categories = classify_surfaces(idf)
+    return surfaces
+
+
+def classify_surfaces(idf):
+    """
+    Sorts all surfaces of the IDF file into the categories of surface_categories in a single pass over the objects.
+    Within a category, the surfaces are ordered by the order of surface_categories and the order in the IDF file.
+    :param idf: IDF file
+    :return: surfaces: A dictionary for each surface type, e.g. {'ext_wall': [object1, object2], 'roof': [object3]}
+    :return: categories: A dictionary with the category of each surface, e.g. {'surface_name': 'ext_wall'}
+    """
+    buckets = {key: [] for key in surface_categories}
+    for element_type in element_types:
+        for s in idf.idfobjects[element_type.upper()]:
+            if element_type == 'BuildingSurface:Detailed':
+                key = (element_type, s.Outside_Boundary_Condition, s.Surface_Type)
+            elif element_type == 'FenestrationSurface:Detailed':
+                # extract_surfaces() does not filter by surface type if no boundary is given, so every
+                #  FenestrationSurface:Detailed object is counted in all of its categories (as in previous versions)
+                for key in fenestration_keys:
+                    buckets[key].append(s)
+                continue
+            else:
+                key = (element_type, None, None)
+            if key in buckets:
+                if element_type in ['Window', 'Door']:  # Window and Door objects need special handling
+                    s = SurrogateElement(s)
+                buckets[key].append(s)
     surfaces = {}
-    surfaces_to_count = ['Window', 'BuildingSurface:Detailed', 'Door', 'FenestrationSurface:Detailed']
-    # Extracting all surfaces from idf file
-    total_no_surfaces = [[s for s in idf.idfobjects[st.upper()]] for st in surfaces_to_count]
-    # flatten the list
-    total_no_surfaces = [item for sublist in total_no_surfaces for item in sublist]
-
-    surfaces['ext_wall'] = extract_surfaces(idf, 'BuildingSurface:Detailed', 'Outdoors', 'Wall')
-    surfaces['int_wall'] = extract_surfaces(idf, 'BuildingSurface:Detailed', 'Surface', 'Wall') + \
-                           extract_surfaces(idf, 'BuildingSurface:Detailed', 'Zone', 'Wall') + \
-                           extract_surfaces(idf, 'InternalMass')
-    surfaces['door'] = extract_surfaces(idf, 'Door') + \
-                       extract_surfaces(idf, 'FenestrationSurface:Detailed', None, 'Door')
-    surfaces['window'] = extract_surfaces(idf, 'Window') + \
-                         extract_surfaces(idf, 'FenestrationSurface:Detailed', None, 'Window') + \
-                         extract_surfaces(idf, 'FenestrationSurface:Detailed', None, 'GlassDoor')
-    surfaces['int_floor'] = extract_surfaces(idf, 'BuildingSurface:Detailed', 'Outdoors', 'Floor') + \
-                            extract_surfaces(idf, 'BuildingSurface:Detailed', 'Surface', 'Floor') + \
-                            extract_surfaces(idf, 'BuildingSurface:Detailed', 'Zone', 'Floor')
-    surfaces['int_ceiling'] = extract_surfaces(idf, 'BuildingSurface:Detailed', 'Surface', 'Ceiling') + \
-                              extract_surfaces(idf, 'BuildingSurface:Detailed', 'Adiabatic', 'Ceiling')
-    surfaces['basement_ext_wall'] = extract_surfaces(idf, 'BuildingSurface:Detailed', 'GroundBasementPreprocessorAverageWall', 'Wall') + \
-                                    extract_surfaces(idf, 'BuildingSurface:Detailed', 'GroundFCfactorMethod', 'Wall')
-    surfaces['ext_floor'] = extract_surfaces(idf, 'BuildingSurface:Detailed', 'Ground', 'Floor') + \
-                            extract_surfaces(idf, 'BuildingSurface:Detailed', 'GroundSlabPreprocessorAverage', 'Floor') + \
-                            extract_surfaces(idf, 'BuildingSurface:Detailed', 'GroundFCfactorMethod', 'Floor')
+    for key, category in surface_categories.items():
+        surfaces[category] = surfaces.get(category, []) + buckets[key]
     # adiabatic boundary condition could be used either for internal or external floors
     if surfaces['ext_floor']:
-        surfaces['int_floor'] += extract_surfaces(idf, 'BuildingSurface:Detailed', 'Adiabatic', 'Floor')
+        surfaces['int_floor'] += surfaces.pop('adiabatic_floor')
     else:
-        surfaces['ext_floor'] += extract_surfaces(idf, 'BuildingSurface:Detailed', 'Adiabatic', 'Floor')
-    surfaces['ceiling_roof'] = extract_surfaces(idf, 'BuildingSurface:Detailed', 'Zone', 'Ceiling')
-    surfaces['roof'] = extract_surfaces(idf, 'BuildingSurface:Detailed', 'Outdoors', 'Roof')
-    # Check if any surfaces are present in `total_no_surfaces` but were missed in `surfaces`
-    check = [s.Name for s in total_no_surfaces if s.Name not in [n.Name for n in flatten_surfaces(surfaces)]]
+        surfaces['ext_floor'] += surfaces.pop('adiabatic_floor')
+    categories = {s.Name: category for category in surfaces for s in surfaces[category]}
+    # Check if any surfaces are present in the IDF file but were missed in `surfaces`
+    surfaces_to_count = ['Window', 'BuildingSurface:Detailed', 'Door', 'FenestrationSurface:Detailed']
+    check = [s.Name for st in surfaces_to_count for s in idf.idfobjects[st.upper()] if s.Name not in categories]
     assert len(check) == 0, "Following elements are not accounted for: %s" % check
-    return surfaces
+    return surfaces, categories
 
 
-def get_surfaces_from_floor_multipliers(idf, surfaces):
+def get_zone_multipliers(idf):
     """
-    Looks for zones with floor multipliers and, if found, multiplies the surfaces belonging to these zones
+    Creates a dictionary with the multipliers of all zones that have one
     :param idf: IDF file
-    :param surfaces: A dictionary for each surface type, e.g. {'ext_wall': [object1, object2], 'roof': [object3]}
-    :return: surfaces including multiplied surfaces
+    :return: dictionary like {'zone_name': multiplier}
+    """
+    return {x.Name: int(float(x.Multiplier)) for x in idf.idfobjects["ZONE"] if x.Multiplier != ''}
+
+
+def make_surface_zone_dict(idf):
+    """
+    Creates a dictionary with the zone of every BuildingSurface:Detailed object
+    :param idf: IDF file
+    :return: dictionary like {'surface_name': 'zone_name'}
+    """
+    return {obj.Name: obj.Zone_Name for obj in idf.idfobjects['BuildingSurface:Detailed']}
+
+
+def get_surface_weights(idf, surfaces, multipliers=None, surface_zones=None):
     """
-    multipliers = {x.Name: int(float(x.Multiplier)) for x in idf.idfobjects["ZONE"] if x.Multiplier != ''}
+    Looks for zones with floor multipliers and assigns each surface an integer weight, i.e. the multiplier of the
+    zone it belongs to (or 1). Areas and volumes are multiplied by the weight instead of repeating the surfaces.
+    :param idf: IDF file
+    :param surfaces: A dictionary for each surface type, e.g. {'ext_wall': [object1, object2], 'roof': [object3]}
+    :param multipliers: dictionary with zone multipliers as created by get_zone_multipliers() (optional)
+    :param surface_zones: dictionary with surface zones as created by make_surface_zone_dict() (optional)
+    :return: weights: A dictionary for each surface type, e.g. {'ext_wall': [1, 10], 'roof': [1]}
+    """
+    if multipliers is None:
+        multipliers = get_zone_multipliers(idf)
+    if surface_zones is None:
+        surface_zones = make_surface_zone_dict(idf)
+    weights = {}
     for key in surfaces.keys():
-        temp_elem = []
+        weights[key] = []
         for elem in surfaces[key]:
             if elem.key == "InternalMass":
                 zone_name = elem.Zone_or_ZoneList_Name
             elif key in ['door', 'window']:
-                surface_name = elem.Building_Surface_Name
-                zone_name = [obj.Zone_Name for obj in idf.idfobjects['BuildingSurface:Detailed']
-                             if obj.Name == surface_name]
-                zone_name = zone_name[0]  # the window should belong to exactly one wall
+                # the window should belong to exactly one wall
+                zone_name = surface_zones[elem.Building_Surface_Name]
             else:
                 zone_name = elem.Zone_Name
-
-            if zone_name in multipliers.keys():
-                temp_elem.extend(np.repeat(elem, multipliers[zone_name] - 1).tolist())
-        surfaces[key].extend(temp_elem)
-    return surfaces
+            weights[key].append(multipliers.get(zone_name, 1))
+    return weights
 
 
-def get_building_geometry_stats(idf_file, surfaces):
+def get_building_geometry_stats(idf_file, surfaces, weights=None, footprint=None):
     """
     Create a dictionary with building geometry statistics, e.g., floor area, footprint area, building height, etc.
     :param idf_file: IDF file
     :param surfaces: A dictionary for each surface type, e.g. {'ext_wall': [object1, object2], 'roof': [object3]}
+    :param weights: surface weights (zone multipliers) as created by get_surface_weights() (optional)
+    :param footprint: 'bbox' (rectangle around the 'ext_floor' surfaces) or 'polygon' (outline of the 'ext_floor'
+        surfaces), default: settings.footprint
     :return: geom_stats: dictionary with building geometry statistics
     """
+    if weights is None:
+        weights = {key: [1] * len(surfaces[key]) for key in surfaces}
     geom_stats = {}
     for element in surfaces:
-        geom_stats[element+'_area'] = sum(get_area(e) for e in surfaces[element])
+        geom_stats[element+'_area'] = sum(get_area(e) * w for e, w in zip(surfaces[element], weights[element]))
     geom_stats['ext_wall_area_net'] = geom_stats['ext_wall_area'] - geom_stats['window_area']
-    # calculate footprint, assuming a rectangular one based on coordinates of 'ext_floor' surfaces
-    x_min, y_min = math.inf, math.inf
-    x_max, y_max = -math.inf, -math.inf
-    for surface in surfaces['ext_floor']:
-        coords = eppy.function_helpers.getcoords(surface)
-        for i in range(0, len(coords)):
-            if coords[i][0] < x_min:
-                x_min = coords[i][0]
-            if coords[i][1] < y_min:
-                y_min = coords[i][1]
-            if coords[i][0] > x_max:
-                x_max = coords[i][0]
-            if coords[i][1] > y_max:
-                y_max = coords[i][1]
-    geom_stats['footprint_area'] = (y_max-y_min)*(x_max-x_min)
-    geom_stats['footprint_perimeter'] = (y_max-y_min)*2+(x_max-x_min)*2
+    if footprint is None:
+        footprint = settings.footprint
+    table = geometry.get_geometry_table(idf_file)
+    if footprint == 'polygon':
+        # calculate footprint from the outline of the floors in contact with the ground
+        geom_stats['footprint_area'], geom_stats['footprint_perimeter'] = \
+            geometry.calc_footprint(*get_ground_floor_vertices(idf_file, surfaces))
+    elif footprint == 'bbox':
+        # calculate footprint, assuming a rectangular one based on coordinates of 'ext_floor' surfaces
+        bbox = table['bbox'][[table['index'][surface.Name] for surface in surfaces['ext_floor']]]
+        x_min, y_min = bbox[:, 0].min(initial=math.inf), bbox[:, 1].min(initial=math.inf)
+        x_max, y_max = bbox[:, 3].max(initial=-math.inf), bbox[:, 4].max(initial=-math.inf)
+        geom_stats['footprint_area'] = (y_max-y_min)*(x_max-x_min)
+        geom_stats['footprint_perimeter'] = (y_max-y_min)*2+(x_max-x_min)*2
+    else:
+        raise Exception(f"Footprint method '{footprint}' not known, use 'bbox' or 'polygon'")
     zones_with_people = [obj.Zone_or_ZoneList_Name for obj in idf_file.idfobjects['People'.upper()]]
     ideal_loads_obj_types = ['HVACTemplate:Zone:IdealLoadsAirSystem', 'ZoneHVAC:EquipmentConnections']
     ideal_loads_objs = [obj for obj_type in ideal_loads_obj_types for obj in idf_file.idfobjects[obj_type.upper()]]
@@ -404,30 +602,45 @@ def get_building_geometry_stats(idf_file, surfaces):
         print('Warning: No zones with IdealLoadsAirSystem found. The conditioned floor area will not be calculated.')
     floor_area_occupied = 0
     floor_area_conditioned = 0
-    for surface in surfaces['int_floor']+surfaces['ext_floor']:
+    for surface, weight in zip(surfaces['int_floor']+surfaces['ext_floor'], weights['int_floor']+weights['ext_floor']):
         if surface.Zone_Name in zones_with_people:
-            floor_area_occupied += get_area(surface)
+            floor_area_occupied += get_area(surface) * weight
         if surface.Zone_Name in zones_with_cond:
-            floor_area_conditioned += get_area(surface)
+            floor_area_conditioned += get_area(surface) * weight
     geom_stats['floor_area_occupied'] = floor_area_occupied
     geom_stats['floor_area_conditioned'] = floor_area_conditioned
     geom_stats['total_floor_area'] = geom_stats['ext_floor_area'] + geom_stats['int_floor_area']
     geom_stats['total_floor_area_wo_basement'] = geom_stats['ext_floor_area'] + geom_stats['int_floor_area']
-    heights = {obj.Name: obj.height for obj in idf_file.idfobjects['BuildingSurface:Detailed'.upper()] if
-               obj.Surface_Type == 'Wall'}
+    heights = {obj.Name: float(table['height'][table['index'][obj.Name]])
+               for obj in idf_file.idfobjects['BuildingSurface:Detailed'.upper()] if obj.Surface_Type == 'Wall'}
     geom_stats['median_floor_height'] = statistics.median(heights.values())
-    bld_height = 0
-    for surface in surfaces['roof']:
-        coords = eppy.function_helpers.getcoords(surface)
-        for i in range(0, len(coords)):
-            if coords[i][2] > bld_height:
-                bld_height = coords[i][2]
-    geom_stats['building_height'] = bld_height
+    roof_heights = table['z_max'][[table['index'][surface.Name] for surface in surfaces['roof']]]
+    geom_stats['building_height'] = float(roof_heights.max(initial=0))
     geom_stats['num_of_floors'] = geom_stats['total_floor_area'] / geom_stats['ext_floor_area']
     geom_stats['num_of_floors2'] = geom_stats['building_height'] / geom_stats['median_floor_height']
     return geom_stats
 
 
+def get_ground_floor_vertices(idf_file, surfaces):
+    """
+    Collects the vertices of the ground floors of a building, i.e. the 'ext_floor' surfaces and the adiabatic floors on
+    the same level (e.g. core zones modelled without ground contact), in the coordinate system of the building
+    :param idf_file: IDF file
+    :param surfaces: A dictionary for each surface type, e.g. {'ext_wall': [object1, object2], 'roof': [object3]}
+    :return: vertices: numpy array (surfaces x max. vertices x 3), n_vertices: numpy array
+    """
+    adiabatic = [surface for surface in surfaces['int_floor'] if surface.Outside_Boundary_Condition == 'Adiabatic']
+    vertices, n_vertices = geometry.get_absolute_vertices(idf_file, surfaces['ext_floor'] + adiabatic)
+    has_vertex = np.arange(vertices.shape[1])[None, :] < n_vertices[:, None]
+    z_max = np.where(has_vertex, vertices[:, :, 2], -math.inf).max(axis=1, initial=-math.inf)
+    n_ext = len(surfaces['ext_floor'])
+    ground = np.arange(len(n_vertices)) < n_ext
+    if n_ext > 0:
+        # the adiabatic floors count up to the level of the highest 'ext_floor' surface, which may be below grade
+        ground |= z_max <= z_max[:n_ext].max(initial=-math.inf) + 0.001
+    return vertices[ground], n_vertices[ground]
+
+
 def get_area(e):
     """
     Gets area from object e
@@ -436,8 +649,10 @@ def get_area(e):
     """
     if e.key == "InternalMass":
         area = e.Surface_Area
-    else:
+    elif isinstance(e, SurrogateElement):
         area = e.area
+    else:
+        area = geometry.get_surface_geometry(e, 'area')
     return area
 
 
@@ -456,6 +671,30 @@ def get_fenestration_objects_from_surface(idf, surface_obj):
     return fenestration
 
 
+def make_fenestration_dict(idf):
+    """
+    Creates an index of all fenestration (doors, windows) objects by the surface they are assigned to. The index is
+    created in one pass over the fenestration objects, so that the fenestration of a surface can be looked up directly
+    instead of scanning all fenestration objects for every surface (see get_fenestration_objects_from_surface()).
+    :param idf: The .idf file
+    :return: fenestration_dict: dictionary like {'surface_name': {'objects': [object1, ...], 'area': total area}}
+    """
+    fenestration_dict = {}
+    for item in ['Window', 'Door', 'FenestrationSurface:Detailed']:
+        for obj in idf.idfobjects[item]:
+            if item == 'FenestrationSurface:Detailed':
+                area = geometry.get_surface_geometry(obj, 'area')
+            else:
+                area = SurrogateElement(obj).area
+            surface = obj.Building_Surface_Name
+            if surface not in fenestration_dict:
+                fenestration_dict[surface] = {'objects': [obj], 'area': area}
+            else:
+                fenestration_dict[surface]['objects'].append(obj)
+                fenestration_dict[surface]['area'] += area
+    return fenestration_dict
+
+
 def add_ground_floor_ffactor_cfactor(constr_layers, obj, replace_dict):
     """
     Creates a surrogate ground floor slab (Ffactor and Cfactor object do not contain information about material layers)
@@ -476,195 +715,6 @@ def add_ground_floor_ffactor_cfactor(constr_layers, obj, replace_dict):
     return constr_layers
 
 
-def add_surrogate_basement(geom_stats, height=None, width=None, length=None, distance=None, materials=None,
-                           shares=[1], densities=None, room_h=2.8):
-    """
-    Adds a surrogate basement (floor slab + perimeter wall) to the material demand
-    :param geom_stats: dictionary with building geometry statistics
-    :param height: height of the floor slab and thickness of the basement walls (meters)
-    :param width: (unused)
-    :param length: (unused)
-    :param distance: (unused)
-    :param materials: list with material names
-    :param shares: list with material shares (i.e., % in total volume)
-    :param densities: list with material densities (kg/m3 per material)
-    :param room_h: basement height (default: 2.8 meters)
-    :returns: material mass dictionary like {'material1': mass1, ...} including the new surrogate element
-    :returns: area_slab
-    """
-    area_slab = geom_stats['footprint_area']
-    area_walls = geom_stats['footprint_perimeter'] * room_h
-    volume = height * (area_slab+area_walls)
-    return convert_volume_to_mass(volume, materials, shares, densities), area_slab
-
-
-def add_surrogate_foundation(geom_stats, height=None, width=None, length=None, distance=None, materials=None,
-                             shares=[1], densities=None):
-    """
-    Adds a surrogate foundation to the material demand
-    :param geom_stats: dictionary with building geometry statistics
-    :param height: height of the foundation (meters)
-    :param width: (unused)
-    :param length: (unused)
-    :param distance: (unused)
-    :param materials: list with material names
-    :param shares: list with material shares (i.e., % in total volume)
-    :param densities: list with material densities (kg/m3 per material)
-    :returns: material mass dictionary like {'material1': mass1, ...} including the new surrogate element
-    """
-    volume = geom_stats['footprint_area'] * height
-    return convert_volume_to_mass(volume, materials, shares, densities)
-
-
-def convert_volume_to_mass(volume, materials, shares, densities):
-    """
-    Converts the total surrogate element volume to volume by material and multiplies by density to obtain mass
-    :param volume: total volume of the surrogate element
-    :param materials: list with material names
-    :param shares: list with material shares (i.e., % in total volume)
-    :param densities: list with material densities (kg/m3 per material)
-    :returns: dictionary with the mass of surrogate element materials like {'material1': mass1, ...}
-    """
-    mat_mass = {}
-    if type(materials) is str:
-        materials = [str(i).strip() for i in materials.replace('[', '').replace(']', '').split(',')]
-    if type(shares) is str:
-        shares = [float(i) for i in shares.replace('[', '').replace(']', '').split(',')]
-    elif type(shares) is int or type(shares) is float:
-        shares = [shares]
-    if type(densities) is str:
-        densities = [float(i) for i in densities.replace('[', '').replace(']', '').split(',')]
-    else:
-        densities = [densities]
-    if shares == [0]:  # the cell was empty
-        shares = [1]
-    if len(materials) != len(shares) != len(densities):
-        raise Exception('The lengths of the provided material lists are not consistent')
-    if sum(shares) != 1:
-        raise Exception('The shares of the provided materials do not sum to 1')
-    for i, mat in enumerate(materials):
-        # if mat not in mat_mass:
-        #     mat_mass[mat] = volume * shares[i] * densities[i]
-        # else:
-        mat_mass[mat] = volume * shares[i] * densities[i]
-    return mat_mass
-
-
-def add_surrogate_columns(geom_stats, height=None, width=None, length=None, distance=None, materials=None,
-                          shares=[1], densities=None):
-    """
-    Adds surrogate columns (on the perimeter) to the material demand
-    :param geom_stats: dictionary with building geometry statistics
-    :param height: (unused)
-    :param width: width of the column (meters)
-    :param length: depth of the column (meters)
-    :param distance: distance between columns (meters)
-    :param materials: list with material names
-    :param shares: list with material shares (i.e., % in total volume)
-    :param densities: list with material densities (kg/m3 per material)
-    :returns: material mass dictionary like {'material1': mass1, ...} including the new surrogate element
-    """
-    vol_column = geom_stats['building_height'] * width * length
-    try:
-        number = geom_stats['footprint_perimeter'] / distance + 1
-    except ZeroDivisionError:
-        number = 0
-    volume = number * vol_column
-    return convert_volume_to_mass(volume, materials, shares, densities)
-
-
-def add_surrogate_beams(geom_stats, height=None, width=None, length=None, distance=None, materials=None,
-                        shares=[1], densities=None):
-    """
-    Adds surrogate beams to the material demand
-    :param geom_stats: dictionary with building geometry statistics
-    :param height: (unused)
-    :param width: width of the beam (meters)
-    :param length: depth of the beam (meters)
-    :param distance: distance between beams (meters)
-    :param materials: list with material names
-    :param shares: list with material shares (i.e., % in total volume)
-    :param densities: list with material densities (kg/m3 per material)
-    :returns: material mass dictionary like {'material1': mass1, ...} including the new surrogate elemen
-    """
-    blg_side_estimate = geom_stats['footprint_perimeter']/4
-    vol_beam = blg_side_estimate * width * length
-    try:
-        number_per_floor = blg_side_estimate / distance + 1
-    except ZeroDivisionError:
-        number_per_floor = 0
-    volume = number_per_floor * vol_beam * geom_stats['num_of_floors']
-    return convert_volume_to_mass(volume, materials, shares, densities)
-
-
-def add_surrogate_studs(geom_stats, height=None, width=None, length=None, distance=None, materials=None,
-                        shares=[1], densities=None):
-    """
-    Adds surrogate studs (studded wall) to the material demand
-    :param geom_stats: dictionary with building geometry statistics
-    :param height: height of one stud (meters)
-    :param width: width of one stud (meters)
-    :param length: depth of one stud (meters)
-    :param distance: distance between studs (meters)
-    :param materials: list with material names
-    :param shares: list with material shares (i.e., % in total volume)
-    :param densities: list with material densities (kg/m3 per material)
-    :returns: material mass dictionary like {'material1': mass1, ...} including the new surrogate elemen
-    """
-    vol_stud = height * width * length
-    try:
-        number_studs = (geom_stats['footprint_perimeter'] / distance + 1) * geom_stats['num_of_floors']
-    except ZeroDivisionError:
-        number_studs = 0
-    volume = number_studs * vol_stud
-    return convert_volume_to_mass(volume, materials, shares, densities)
-
-
-def add_surrogate_roof_beams(geom_stats, height=None, width=None, length=None, distance=None,
-                             materials=None, shares=[1], densities=None):
-    """
-    Adds surrogate roof beams to the material demand
-    :param geom_stats: dictionary with building geometry statistics
-    :param height: (unused)
-    :param width: width of one beam (meters)
-    :param length: depth of one beam (meters)
-    :param distance: distance between beams (meters)
-    :param materials: list with material names
-    :param shares: list with material shares (i.e., % in total volume)
-    :param densities: list with material densities (kg/m3 per material)
-    :returns: material mass dictionary like {'material1': mass1, ...} including the new surrogate elemen
-    """
-    vol_roof_beam = length * width
-    blg_side_estimate = geom_stats['footprint_perimeter']/4
-    try:
-        number_beams = blg_side_estimate / distance + 1
-    except ZeroDivisionError:
-        number_beams = 0
-    volume = vol_roof_beam * blg_side_estimate * number_beams
-    return convert_volume_to_mass(volume, materials, shares, densities)
-
-
-def add_surrogate_shear_walls(geom_stats, height=None, width=None, length=None, distance=None,
-                             materials=None, shares=[1], densities=None, shear_wall_ratio=0.02):
-    """
-    Adds surrogate shear walls to the material demand. Taller archetypes need shear/core walls for lateral load
-    resistance. The shear wall ratio is assumed 2% (the footprint of the shear walls to the floor area).
-    Based on: https://ascelibrary.org/doi/full/10.1061/(ASCE)ST.1943-541X.0000785
-    :param geom_stats: dictionary with building geometry statistics
-    :param height: (unused)
-    :param width: (unused)
-    :param length: (unused)
-    :param distance: (unused)
-    :param materials: list with material names
-    :param shares: list with material shares (i.e., % in total volume)
-    :param densities: list with material densities (kg/m3 per material)
-    :param shear_wall_ratio:
-    :returns: material mass dictionary like {'material1': mass1, ...} including the new surrogate elemen
-    """
-    volume = geom_stats['building_height'] * geom_stats['footprint_area'] * shear_wall_ratio
-    return convert_volume_to_mass(volume, materials, shares, densities)
-
-
 def save_dict_to_csv(dict_in, folder, filename, header=[], units_dict=None):
     """
     Saves a materials dictionary to a csv file.
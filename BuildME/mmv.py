@@ -7,10 +7,23 @@ from eppy.modeleditor import IDF
 import pandas as pd
 import numpy as np
 import openpyxl
-from . import settings
+from . import settings, geometry
 import os
 import datetime
 
+# AFN surface groups of BuildingSurface:Detailed objects by ("!- Outside Boundary Condition", "!- Surface Type"), as
+#  in material.surface_categories. The boundary None matches any other boundary condition, and surfaces with the
+#  group None are not included in the AFN model.
+afn_surface_groups = {
+    ('Outdoors', 'Wall'): 'Walls external',
+    # quoting an E+ error: "This type of surface (has ground, etc exposure) cannot be used in the AiflowNetwork model."
+    ('GroundFCfactorMethod', 'Wall'): None,
+    (None, 'Wall'): 'Walls internal',
+    (None, 'Roof'): 'Roofs',
+    ('Surface', 'Floor'): 'Floors internal',
+    ('Outdoors', 'Floor'): 'Floors external'
+}
+
 
 def create_dictionaries(idf, occupation):
     """
@@ -190,6 +203,7 @@ def create_surface_dict(idf):
     """
     surface_dict = {}
     # zone_list = [k['Zone_Name'] for v, k in zone_dict.items()]
+    surface_objects = {obj.Name: obj for obj in idf.idfobjects['BuildingSurface:Detailed']}
     i = 1
     for idf_object in ['BuildingSurface:Detailed']:
         for obj in idf.idfobjects[idf_object]:
@@ -200,20 +214,8 @@ def create_surface_dict(idf):
                 # the same name indicates internal partition separating like zones
                 # otherwise, there is error "The surface facing itself is not allowed."
                 continue
-            if outside == 'Outdoors' and surface_type == 'Wall':
-                surface_group = 'Walls external'
-            elif outside == 'GroundFCfactorMethod' and surface_type == 'Wall':
-                # quoting an E+ error: "This type of surface (has ground, etc exposure) cannot be used in the AiflowNetwork model."
-                continue
-            elif surface_type == 'Wall':
-                surface_group = 'Walls internal'
-            elif surface_type == 'Roof':
-                surface_group = 'Roofs'
-            elif outside == 'Surface' and surface_type == 'Floor':
-                surface_group = 'Floors internal'
-            elif outside == 'Outdoors' and surface_type == 'Floor':
-                surface_group = 'Floors external'
-            else:
+            surface_group = afn_surface_groups.get((outside, surface_type), afn_surface_groups.get((None, surface_type)))
+            if surface_group is None:
                 continue  # ignores surfaces such as ceilings, as we don't have AFN infiltration values for these
             surface_dict[i] = {}
             surface_dict[i]['Name'] = obj.Name
@@ -227,10 +229,9 @@ def create_surface_dict(idf):
             i += 1
     for idf_object in ['Window', 'Door', 'FenestrationSurface:Detailed']:
         for obj in idf.idfobjects[idf_object]:
-            surface = obj.Building_Surface_Name
-            zone = [obj2 for obj2 in idf.idfobjects['BuildingSurface:Detailed'] if obj2.Name == surface]
-            if zone[0].tilt == 90:
-                wall_obj = get_wall_object_from_fenestration(idf, obj)
+            wall_obj = surface_objects[obj.Building_Surface_Name]
+            wall_tilt = geometry.get_surface_geometry(wall_obj, 'tilt')
+            if wall_tilt == 90:
                 if wall_obj.Outside_Boundary_Condition == 'Outdoors':
                     if check_if_window(idf_object, obj):
                         surface_group = 'Windows external'
@@ -246,8 +247,8 @@ def create_surface_dict(idf):
                 surface_dict[i]['Object_Type'] = idf_object
                 surface_dict[i]['Surface_Group'] = surface_group
                 surface_dict[i]['Area'] = calculate_area(obj)
-                surface_dict[i]['Zone'] = zone[0].Zone_Name
-                surface_dict[i]['Tilt'] = zone[0].tilt
+                surface_dict[i]['Zone'] = wall_obj.Zone_Name
+                surface_dict[i]['Tilt'] = wall_tilt
                 surface_dict[i]['is_in_MMV_zone'] = False  # default value
                 i += 1
     return surface_dict
@@ -574,7 +575,7 @@ def assign_wpc_curve(obj, idf, zone_dict_mmv, shielding):
     :param shielding: the level of wind shielding (low, medium, high)
     :return wpc_curve_name: Name of the WPC curve (object with wind pressure coefficient values)
     """
-    deg = int(obj.azimuth)
+    deg = int(geometry.get_surface_geometry(obj, 'azimuth'))
     surface_type = obj.Surface_Type
     dirs = ['N', 'E', 'S', 'W']
     degs = [0, 90, 180, 270]  # North=0, East=90, South=180, West=270
@@ -720,9 +721,9 @@ def calculate_area(obj):
     :param obj: Idf surface object
     :return area: Area of the idf surface object
     """
-    try:
-        area = obj.area
-    except:
+    if obj.key in geometry.vertex_objects:
+        area = geometry.get_surface_geometry(obj, 'area')
+    else:
         area = obj.Length * obj.Height
     return area
 
@@ -850,11 +851,12 @@ def estimate_no_of_floors(idf, zone_dict_mmv):
     :return no_of_floors: Number of floors
     """
     mmv_zone_list = [i['Zone_Name'] for i in zone_dict_mmv.values()]
+    zone_objs = {z.Name: z for z in idf.idfobjects['Zone']}
     ceiling_heights = []
     for obj in idf.idfobjects['BuildingSurface:Detailed']:
         if obj.Zone_Name in mmv_zone_list:
-            ceiling_height = max(abs(pt[2]) for pt in obj.coords)
-            zone_obj = [z for z in idf.idfobjects['Zone'] if z.Name == obj.Zone_Name][0]
+            ceiling_height = geometry.get_surface_geometry(obj, 'z_abs_max')
+            zone_obj = zone_objs[obj.Zone_Name]
             multiplier = zone_obj.Multiplier
             if multiplier == "":
                 multiplier = 1
@@ -0,0 +1,244 @@
+"""
+Pipelined batch simulation, i.e. every building flows independently through the simulation stages
+(preparation -> energy and material simulation -> postprocessing) instead of waiting for the whole batch to finish
+each stage.
+"""
+import multiprocessing as mp
+import os
+from time import sleep, time
+from tqdm import tqdm
+from BuildME import energy, impact, profiles, settings, simulate, store
+from BuildME import results as results_matrix
+
+# Stages with a lower number are submitted first if several tasks are ready. Keeping EnergyPlus busy is the priority,
+#  as the energy simulations are the critical path of the batch simulation.
+stage_priority = {'energy': 0, 'prepare': 1, 'materials': 2, 'postprocess': 3}
+
+
+def run_pipeline(batch_sim, run_eplus=True, run_materials=True, ifsurrogates=True, keep_all=False, unit='kWh',
+                 ref_area='total_floor_area', cpus=None, combinations=None, material_summaries=False,
+                 material_factors=None, energy_factors=None):
+    """
+    Runs the batch simulation as a task graph, where each building is prepared, simulated (energy and material demand
+    in parallel) and postprocessed as soon as its own preceding stages are finished. The summary files are assembled
+    incrementally while the simulations are running. The material data is audited first (see
+    simulate.audit_materials()), which adds missing atypical materials to the config file; the material tasks run with
+    config=False and would only write them into 'atypical_materials.csv' of the simulation folders.
+    :param batch_sim: dictionary with batch simulation information
+    :param run_eplus: True if the energy demand simulation should be performed (default: True)
+    :param run_materials: True if the material demand simulation should be performed (default: True)
+    :param ifsurrogates: True if surrogate calculations are requested (default: True)
+    :param keep_all: boolean indicating whether to keep all simulation files (incl. the .eso file)
+    :param unit: energy units in the output file - kWh (default), J or MJ
+    :param ref_area: reference area for intensities (see simulate.calculate_intensities())
+    :param cpus: number of parallel processes (default: settings.cpus)
+    :param combinations: a dictionary with the selected BuildME aspects and their values
+    :param material_summaries: True if 'summary_mat_demand.csv' and 'summary_mat_demand_categorized.csv' should also be
+        saved (default: False, see store.save_summaries())
+    :param material_factors: impact factors per material and/or aggregation category, see impact.calculate_impacts()
+        (optional)
+    :param energy_factors: impact factors per energy variable, see impact.calculate_impacts() (optional)
+    :returns: list of simulations that failed
+    """
+    print("Initiating pipelined batch simulation...")
+    if combinations is None:
+        combinations = settings.debug_combinations
+    aspect_names = ['region'] + list(list(combinations.values())[0].keys())
+    ep_dir = settings.ep_path
+    # MMV variants are written next to the original archetypes, so they need to be created before the workers start
+    for sim in batch_sim:
+        idf_path = batch_sim[sim]['archetype_file']
+        if not os.path.exists(idf_path) and batch_sim[sim]['cooling'] == 'MMV':
+            simulate.create_mmv_variant(idf_path, ep_dir, batch_sim[sim]['occupation'])
+    simulate.validate_ep_version(list(set([batch_sim[sim]['archetype_file'] for sim in batch_sim])))
+    if cpus is None:
+        cpus = simulate.find_cpus()
+    if run_materials:
+        # fail before EnergyPlus is started if any material data is missing
+        simulate.audit_materials(batch_sim, ifsurrogates, cpus=cpus)
+    tasks = create_task_graph(batch_sim, run_eplus, run_materials, ifsurrogates, keep_all, unit, ref_area)
+    results = ['geom_stats.csv', 'mat_demand.csv', 'mat_demand_categorized.csv', 'mat_demand_aggregated.csv',
+               'mat_demand_aggregated_m2.csv', 'mat_demand_m2.csv']
+    if run_eplus:
+        results = ['energy_demand.csv', 'energy_demand_m2.csv'] + results
+    if not run_materials:
+        results = ['energy_demand.csv']
+    if run_eplus and settings.sqlite:
+        results = results + ['energy_end_uses.csv', 'zone_sizing.csv']
+    parent_dir = os.path.dirname(batch_sim[list(batch_sim.keys())[0]]['run_folder'])
+    results_store = store.open_store(parent_dir)
+    if run_eplus and settings.hourly_profiles:
+        profile_store = profiles.open_profile_store(parent_dir, aspect_names)
+    unknown_materials = []
+
+    def on_done(task_id, value):
+        sim, stage = task_id
+        if stage != 'postprocess':
+            return
+        dfs, unknown = value
+        unknown_materials.extend(unknown)
+        if 'hourly_profile' in dfs:
+            profiles.append_profile(profile_store, os.path.basename(batch_sim[sim]['run_folder']),
+                                    dfs['hourly_profile'])
+        # 'energy_end_uses.csv' and 'zone_sizing.csv' are only available if EnergyPlus wrote 'eplusout.sql'
+        for name in [name for name in results if name in dfs]:
+            store.append_results(results_store, name, os.path.basename(batch_sim[sim]['run_folder']), dfs[name])
+
+    print("Perform pipelined simulation on %s CPUs..." % cpus)
+    failed = execute_task_graph(tasks, cpus, on_done=on_done,
+                                pbar=tqdm(total=len(batch_sim), smoothing=0.1, unit='sim'), pbar_stage='postprocess')
+    # save the summary of the simulations that finished (in the order of batch_sim)
+    store.flush_store(results_store)
+    if run_eplus and settings.hourly_profiles:
+        profiles.flush_profiles(profile_store)
+    order = [os.path.basename(batch_sim[sim]['run_folder']) for sim in batch_sim]
+    store.save_summaries(parent_dir, results, aspect_names, order, material_summaries)
+    if run_materials:
+        # the material demand is also saved as a sparse matrix
+        matrix = results_matrix.make_material_matrix_from_store(parent_dir, aspect_names, order)
+        if matrix is not None:
+            results_matrix.save_material_matrix(matrix, parent_dir)
+    unknown_materials = list(set(unknown_materials))
+    if unknown_materials:
+        simulate.add_unknown_categories_to_config(unknown_materials)
+    if material_factors is not None or energy_factors is not None:
+        impact.calculate_impacts(folder=parent_dir, material_factors=material_factors, energy_factors=energy_factors,
+                                 combinations=combinations)
+    if run_materials:
+        simulate.report_material_groups(sum(1 for func, args, deps in tasks.values()
+                                            if func is simulate.calculate_materials_single), len(batch_sim))
+    failed_sims = sorted(set(sim for sim, stage in failed))
+    if failed_sims:
+        print(f'Warning: the following simulations were not successful: \n {failed_sims}')
+    print('Pipelined batch simulation finished.')
+    return failed_sims
+
+
+def create_task_graph(batch_sim, run_eplus, run_materials, ifsurrogates, keep_all, unit, ref_area):
+    """
+    Creates the task graph of a batch simulation. Each task is identified by a tuple (sim, stage). The material tasks
+    run with config=False, i.e. atypical materials missing in the config file only end up in 'atypical_materials.csv'
+    of the simulation folders, so simulate.audit_materials() should be run first (as in run_pipeline()).
+    :param batch_sim: dictionary with batch simulation information
+    :param run_eplus: True if the energy demand simulation should be performed
+    :param run_materials: True if the material demand simulation should be performed
+    :param ifsurrogates: True if surrogate calculations are requested
+    :param keep_all: boolean indicating whether to keep all simulation files (incl. the .eso file)
+    :param unit: energy units in the output file - kWh, J or MJ
+    :param ref_area: reference area for intensities
+    :returns: dictionary like {(sim, stage): (function, args, [dependencies])}
+    """
+    ep_dir = settings.ep_path
+    tasks = {}
+    # simulations with the same material demand copy the results of the first simulation of their group
+    groups, surrogates_dicts = simulate.group_material_simulations(batch_sim, ifsurrogates)
+    material_source = {sim: sims[0] for sims in groups.values() for sim in sims}
+    for sim in batch_sim:
+        out_dir = batch_sim[sim]['run_folder']
+        archetype = batch_sim[sim]['occupation']
+        replace_dict = batch_sim[sim]['replace_dict']
+        # without energy simulation, 'in.idf' is only needed by the simulations whose material demand is calculated
+        prepare = [(sim, 'prepare')] if run_eplus or material_source[sim] == sim else []
+        if prepare:
+            tasks[(sim, 'prepare')] = (simulate.copy_idf_file, (batch_sim[sim]['archetype_file'], out_dir,
+                                                                replace_dict, archetype, ep_dir,
+                                                                settings.replace_csv_dir), [])
+        deps = []
+        if run_eplus:
+            epw_path = batch_sim[sim]['climate_file']
+            if not os.path.exists(epw_path):
+                print(f"Weather file (defined as {epw_path}) was not not found. "
+                      f"\nA dummy weather file for New York city (US) will be used instead.")
+                epw_path = os.path.join(settings.climate_files_path, 'USA_NY_New.York-dummy.epw')
+            tasks[(sim, 'energy')] = (energy.perform_energy_calculation, (out_dir, ep_dir, epw_path, keep_all),
+                                      [(sim, 'prepare')])
+            deps.append((sim, 'energy'))
+        if run_materials:
+            source = material_source[sim]
+            if source == sim:
+                # config=False: the workers cannot safely write to the config file at the same time
+                tasks[(sim, 'materials')] = (simulate.calculate_materials_single,
+                                             (out_dir, ep_dir, settings.atypical_materials, surrogates_dicts[sim],
+                                              ifsurrogates, replace_dict, False), [(sim, 'prepare')])
+            else:
+                tasks[(sim, 'materials')] = (simulate.copy_material_results,
+                                             (batch_sim[source]['run_folder'], out_dir),
+                                             prepare + [(source, 'materials')])
+            deps.append((sim, 'materials'))
+        tasks[(sim, 'postprocess')] = (simulate.postprocess_single,
+                                       (out_dir, run_eplus, run_materials, unit, ref_area,
+                                        settings.material_aggregation, True, run_eplus and settings.hourly_profiles),
+                                       deps)
+    return tasks
+
+
+def execute_task_graph(tasks, cpus, on_done=None, pbar=None, pbar_stage=None):
+    """
+    Executes the tasks of a task graph on a pool of processes. A task is submitted as soon as all its dependencies
+    are finished and a process is free. If a task fails, the tasks depending on it are skipped.
+    :param tasks: dictionary like {(sim, stage): (function, args, [dependencies])}
+    :param cpus: number of parallel processes
+    :param on_done: function called in the main process with (task_id, return value) when a task is finished
+    :param pbar: tqdm progress bar (optional)
+    :param pbar_stage: stage that updates the progress bar when finished
+    :returns: dictionary like {task_id: error message} with the failed and skipped tasks
+    """
+    waiting = {task_id: set(deps) for task_id, (func, args, deps) in tasks.items()}
+    dependents = {task_id: [] for task_id in tasks}
+    for task_id, deps in waiting.items():
+        for dep in deps:
+            dependents[dep].append(task_id)
+    ready = [task_id for task_id, deps in waiting.items() if not deps]
+    running = {}
+    failed = {}
+    stage_time = {}
+    pool = mp.Pool(processes=cpus)
+    while ready or running:
+        # fill the free processes with the ready tasks of the most important stage
+        ready.sort(key=lambda t: stage_priority.get(t[1], len(stage_priority)))
+        while ready and len(running) < cpus:
+            task_id = ready.pop(0)
+            func, args, deps = tasks[task_id]
+            running[task_id] = (pool.apply_async(func, args), time())
+        finished = [task_id for task_id, (result, start) in running.items() if result.ready()]
+        if not finished:
+            sleep(0.05)
+            continue
+        for task_id in finished:
+            result, start = running.pop(task_id)
+            stage_time[task_id[1]] = stage_time.get(task_id[1], 0) + time() - start
+            try:
+                value = result.get()
+            except Exception as e:
+                failed[task_id] = repr(e)
+                print(f"Error in stage '{task_id[1]}' of simulation '{task_id[0]}': {e}")
+                skip_dependents(task_id, dependents, failed)
+                continue
+            if on_done is not None:
+                on_done(task_id, value)
+            if pbar is not None and task_id[1] == pbar_stage:
+                pbar.update(1)
+            for dependent in dependents[task_id]:
+                waiting[dependent].discard(task_id)
+                if not waiting[dependent] and dependent not in failed:
+                    ready.append(dependent)
+    pool.close()
+    pool.join()
+    if pbar is not None:
+        pbar.close()
+    print('Cumulative time per stage: ' + ', '.join(f'{k}: {v:.1f} s' for k, v in stage_time.items()))
+    return failed
+
+
+def skip_dependents(task_id, dependents, failed):
+    """
+    Marks all tasks depending (directly or indirectly) on a failed task as failed
+    :param task_id: failed task
+    :param dependents: dictionary like {task_id: [tasks depending on task_id]}
+    :param failed: dictionary like {task_id: error message}
+    """
+    for dependent in dependents[task_id]:
+        if dependent not in failed:
+            failed[dependent] = f'Skipped because {task_id} failed'
+            skip_dependents(dependent, dependents, failed)
+    return
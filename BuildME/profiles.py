@@ -0,0 +1,210 @@
+"""
+Hourly load profiles of a batch simulation
+
+In the hourly profile mode (see settings.hourly_profiles), copy_idf_file() adds hourly meters that EnergyPlus writes
+into 'eplusout.mtr' (or 'eplusout.sql'), so that 'eplusout.csv' keeps its size. The post-processing converts the
+hours x meters matrix of each simulation to kWh and appends it to the profile store of the batch simulation folder
+('profiles/chunk-00000.npy', ...): float32 arrays of shape (simulations, hours, meters) that are memory-mapped when
+read. The profiles of many simulations are aggregated chunk by chunk with weights (e.g. climate region shares and floor
+areas) into load curves and peak demands, so the store never has to fit into memory.
+"""
+import glob
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from BuildME import batch, energy
+
+# folder of the profile store in the batch simulation folder
+profile_folder = 'profiles'
+# meters saved as hourly profiles
+profile_meters = ('Heating:EnergyTransfer', 'Cooling:EnergyTransfer')
+# number of hours of the weather file run period
+hours = 8760
+# number of simulations per chunk (256 simulations x 8760 hours x 2 meters x 4 bytes = 18 MB)
+chunk_size = 256
+
+
+def read_profile(folder, meters=profile_meters):
+    """
+    Reads the hourly meters of a simulation from 'eplusout.sql' (if available) or 'eplusout.mtr'
+    :param folder: simulation folder
+    :param meters: names of the meters, e.g. ('Heating:EnergyTransfer', 'Cooling:EnergyTransfer')
+    :return: numpy array (hours x meters) with the energy in kWh per hour (i.e. the mean power in kW)
+    """
+    variables = ['%s [J](Hourly)' % meter for meter in meters]
+    sql_file = os.path.join(folder, 'eplusout.sql')
+    if os.path.exists(sql_file):
+        values = energy.read_sql_series(sql_file, variables)
+    else:
+        values = energy.read_eso(os.path.join(folder, 'eplusout.mtr'), variables)
+    profile = np.zeros((hours, len(meters)), dtype=np.float32)
+    for j, variable in enumerate(variables):
+        if variable not in values:
+            raise Exception(f"Hourly meter '{variable}' not found in the results of {folder}")
+        if len(values[variable]) < hours:
+            raise Exception(f"Hourly meter '{variable}' of {folder} has only {len(values[variable])} values")
+        # the weather file run period is the last environment of the simulation
+        profile[:, j] = values[variable][-hours:] / (3.6 * 10**6)
+    return profile
+
+
+def open_profile_store(parent_dir, aspect_names, meters=profile_meters, size=chunk_size, clear=True):
+    """
+    Opens the profile store of a batch simulation for appending
+    :param parent_dir: batch simulation folder
+    :param aspect_names: names of the BuildME aspects, e.g., ['region', 'occupation', ...]
+    :param meters: names of the meters of the profiles
+    :param size: number of simulations buffered before a chunk is written
+    :param clear: True if the profiles already in the store should be deleted (default: True)
+    :return: dictionary with the store information and the buffered profiles
+    """
+    folder = os.path.join(parent_dir, profile_folder)
+    if clear and os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder, exist_ok=True)
+    return {'folder': folder, 'aspect_names': list(aspect_names), 'meters': list(meters), 'size': size,
+            'sims': [], 'chunks': [], 'buffer': []}
+
+
+def append_profile(pstore, building_name, profile):
+    """
+    Appends the hourly profile of one simulation to the store
+    :param pstore: profile store, see open_profile_store()
+    :param building_name: building name (folder name) of the simulation
+    :param profile: numpy array (hours x meters), see read_profile()
+    """
+    if profile.shape != (hours, len(pstore['meters'])):
+        raise Exception(f'The profile of {building_name} has the shape {profile.shape} instead of '
+                        f'{(hours, len(pstore["meters"]))}')
+    pstore['buffer'].append((building_name, profile))
+    if len(pstore['buffer']) >= pstore['size']:
+        flush_profiles(pstore)
+    return
+
+
+def flush_profiles(pstore):
+    """
+    Writes the buffered profiles into a new chunk and updates the index of the store ('profiles/index.npz')
+    :param pstore: profile store, see open_profile_store()
+    """
+    if pstore['buffer']:
+        n = len(glob.glob(os.path.join(pstore['folder'], 'chunk-*.npy')))
+        building_names, chunk = zip(*pstore['buffer'])
+        np.save(os.path.join(pstore['folder'], 'chunk-%05d.npy' % n), np.stack(chunk).astype(np.float32))
+        pstore['sims'].extend(building_names)
+        pstore['chunks'].extend([n] * len(building_names))
+        pstore['buffer'] = []
+    aspects = batch.get_aspects(os.path.dirname(pstore['folder']), pstore['sims'], pstore['aspect_names'])
+    np.savez(os.path.join(pstore['folder'], 'index.npz'), sims=np.array(pstore['sims'], dtype=str),
+             chunk=np.array(pstore['chunks'], dtype=np.int32), meters=np.array(pstore['meters'], dtype=str),
+             aspect_names=np.array(pstore['aspect_names'], dtype=str),
+             aspects=aspects)
+    return
+
+
+def load_profiles(parent_dir):
+    """
+    Opens the profile store of a batch simulation for reading, the chunks are memory-mapped
+    :param parent_dir: batch simulation folder
+    :return: dictionary with the index of the store (sims, chunk, meters, aspect_names, aspects) and the list of the
+        memory-mapped chunks ('data')
+    """
+    folder = os.path.join(parent_dir, profile_folder)
+    with np.load(os.path.join(folder, 'index.npz')) as data:
+        index = {key: data[key] for key in data.files}
+    index['data'] = [np.load(f, mmap_mode='r') for f in sorted(glob.glob(os.path.join(folder, 'chunk-*.npy')))]
+    return index
+
+
+def get_profile(index, building_name):
+    """
+    Gets the hourly profile of one simulation
+    :param index: profile store, see load_profiles()
+    :param building_name: building name (folder name) of the simulation
+    :return: numpy array (hours x meters) in kWh per hour
+    """
+    i = np.flatnonzero(index['sims'] == building_name)
+    if len(i) == 0:
+        raise Exception(f'No profile found for {building_name}')
+    chunk = index['chunk'][i[0]]
+    return np.asarray(index['data'][chunk][i[0] - np.flatnonzero(index['chunk'] == chunk)[0]])
+
+
+def make_weights(index, climate_region_weight=None, floor_areas=None, reference_areas=None):
+    """
+    Creates the weights of the simulations for aggregate_profiles()
+    :param index: profile store, see load_profiles()
+    :param climate_region_weight: dataframe with the columns 'region', 'climate_region' and 'share', e.g.
+        settings.climate_region_weight; the profiles are multiplied by the share of their climate region (optional)
+    :param floor_areas: pandas series with a floor area (m2) per building name, e.g. the floor area of the stock
+        represented by the simulation (optional)
+    :param reference_areas: pandas series with the floor area (m2) of each simulated building (required with
+        floor_areas), e.g. from the material demand matrix; the profiles are scaled by floor_areas / reference_areas
+    :return: numpy array with the weight of each simulation of the store
+    """
+    weights = np.ones(len(index['sims']))
+    aspect_names = list(index['aspect_names'])
+    if climate_region_weight is not None:
+        shares = climate_region_weight.set_index(['region', 'climate_region'])['share']
+        keys = pd.MultiIndex.from_arrays([index['aspects'][:, aspect_names.index('region')],
+                                          index['aspects'][:, aspect_names.index('climate_region')]])
+        sim_shares = shares.reindex(keys).to_numpy()
+        if np.isnan(sim_shares).any():
+            print(f'Warning: No climate region weight found for the following regions (their weight is set to 0): '
+                  f'\n {sorted(set(keys[np.isnan(sim_shares)]))}')
+        weights *= np.nan_to_num(sim_shares)
+    if floor_areas is not None:
+        if reference_areas is None:
+            raise Exception('The floor areas of the simulated buildings (reference_areas) are required')
+        weights *= floor_areas.reindex(index['sims']).fillna(0).to_numpy() / \
+            reference_areas.reindex(index['sims']).to_numpy()
+    return weights
+
+
+def aggregate_profiles(index, weights=None, groups=None):
+    """
+    Calculates weighted sums of the profiles, e.g. regional load curves. The chunks are processed one by one, each
+    with one matrix product (groups x simulations) @ (simulations x hours*meters).
+    :param index: profile store, see load_profiles()
+    :param weights: numpy array with the weight of each simulation, see make_weights() (default: 1)
+    :param groups: name of an aspect (e.g. 'climate_region') or a list of aspects to group the simulations by
+        (default: one group with all simulations)
+    :return: numpy array (groups x hours x meters) with the load curves in kWh per hour
+    :return: pandas index with the groups
+    """
+    n_sims, n_meters = len(index['sims']), len(index['meters'])
+    if weights is None:
+        weights = np.ones(n_sims)
+    if groups is None:
+        labels, codes = pd.Index(['total']), np.zeros(n_sims, dtype=np.int64)
+    else:
+        groups = [groups] if isinstance(groups, str) else list(groups)
+        aspect_names = list(index['aspect_names'])
+        keys = [index['aspects'][:, aspect_names.index(g)] for g in groups]
+        keys = pd.Index(keys[0]) if len(groups) == 1 else pd.MultiIndex.from_arrays(keys)
+        codes, labels = pd.factorize(keys, sort=True)
+        labels.names = groups
+    curves = np.zeros((len(labels), hours * n_meters))
+    for chunk, data in enumerate(index['data']):
+        sims = np.flatnonzero(index['chunk'] == chunk)
+        onehot = np.zeros((len(labels), len(sims)))
+        onehot[codes[sims], np.arange(len(sims))] = weights[sims]
+        curves += onehot @ data.reshape(len(sims), hours * n_meters)
+    return curves.reshape(len(labels), hours, n_meters), labels
+
+
+def calc_peak_demand(curves, labels, meters):
+    """
+    Finds the peak demand of load curves
+    :param curves: numpy array (groups x hours x meters), see aggregate_profiles()
+    :param labels: pandas index with the groups
+    :param meters: names of the meters
+    :return: pandas dataframe with the peak demand (kW) and the hour of the year of the peak for each group and meter
+    """
+    peak_hours = curves.argmax(axis=1)
+    peaks = np.take_along_axis(curves, peak_hours[:, None, :], axis=1)[:, 0, :]
+    df = pd.DataFrame({'Meter': np.tile(list(meters), len(labels)), 'Unit': 'kW',
+                       'Peak demand': peaks.ravel(), 'Peak hour': peak_hours.ravel()},
+                      index=labels.repeat(len(meters)))
+    return df
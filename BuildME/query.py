@@ -0,0 +1,166 @@
+"""
+Query interface to the results of a batch simulation
+
+A Results object gives access to the results in the store of a batch simulation (see store.py), e.g.
+'energy_demand_m2.csv', with the BuildME aspects as categorical columns. The aspects are taken from 'aspects.csv' in
+the batch simulation folder (see batch.get_aspects()), so aspect values may contain underscores. A result is read from
+the store when it is first queried and then kept in memory. Simulations are selected with boolean masks over the
+simulations (not over the rows), which keeps queries over many simulations interactive.
+
+Example:
+    res = Results('tmp/261019-113303')
+    res.select('energy_demand_m2.csv', occupation='MFH', aspects={'en-std': ['ZEB', 'standard']})
+    res.pivot('energy_demand_m2.csv', index='climate_region', columns='en-std', occupation='MFH')
+    res.weighted_sum('energy_demand.csv', settings.climate_region_weight, by=['occupation', 'Unit'])
+"""
+import glob
+import os
+import numpy as np
+import pandas as pd
+from BuildME import batch, settings, store
+
+
+class Results:
+    """
+    Results of a batch simulation, loaded lazily from the results store
+    """
+    def __init__(self, parent_dir, combinations=None):
+        """
+        :param parent_dir: batch simulation folder
+        :param combinations: a dictionary with the selected BuildME aspects and their values
+        """
+        if combinations is None:
+            combinations = settings.debug_combinations
+        self.parent_dir = parent_dir
+        self.aspect_names = ['region'] + list(list(combinations.values())[0].keys())
+        # loaded results like {result name: (dataframe, aspects of the simulations, simulation of each row)}
+        self._results = {}
+
+    @property
+    def names(self):
+        """
+        Names of the results in the store, e.g. ['energy_demand.csv', ...]
+        """
+        folders = glob.glob(os.path.join(self.parent_dir, store.store_folder, '*', ''))
+        return sorted(os.path.basename(os.path.dirname(folder)) + '.csv' for folder in folders)
+
+    def load(self, name):
+        """
+        Loads a result from the store (only once) and adds the aspects of the simulations as categorical columns
+        :param name: the name of the result, e.g., 'energy_demand_m2.csv'
+        :return: pandas dataframe
+        """
+        if name not in self._results:
+            df = store.scan_results(self.parent_dir, name)
+            if df is None:
+                raise Exception(f'Result {name} not found in the results store of {self.parent_dir}, use one of '
+                                f'{self.names}')
+            if 'Building name' not in df.columns:
+                # results that are not split by simulation, e.g. 'stock_results.csv'
+                self._results[name] = (df, None, None)
+                return df
+            sims = df['Building name'].cat
+            aspects = batch.get_aspects(self.parent_dir, sims.categories, self.aspect_names)
+            codes = sims.codes.to_numpy()
+            columns = {}
+            for j, aspect in enumerate(self.aspect_names):
+                values = pd.Categorical(aspects[:, j])
+                columns[aspect] = pd.Categorical.from_codes(values.codes[codes], categories=values.categories)
+            df = pd.concat([pd.DataFrame(columns, index=df.index), df], axis=1)
+            self._results[name] = (df, aspects, codes)
+        return self._results[name][0]
+
+    def get_mask(self, name, aspects=None, **kwargs):
+        """
+        Finds the rows of a result that belong to the simulations with the given aspects. Other columns of the result
+        can be filtered in the same way, e.g. {'EnergyPlus output variable': 'Heating:EnergyTransfer'}.
+        :param name: the name of the result, e.g., 'energy_demand_m2.csv'
+        :param aspects: dictionary like {'en-std': 'ZEB', 'climate_region': ['4A', '5A']} (optional)
+        :param kwargs: aspects given as keyword arguments, e.g. occupation='MFH'
+        :return: boolean numpy array over the rows
+        """
+        df = self.load(name)
+        _, sim_aspects, codes = self._results[name]
+        sim_mask = None if sim_aspects is None else np.ones(len(sim_aspects), dtype=bool)
+        mask = np.ones(len(df), dtype=bool)
+        for col, values in dict(aspects or {}, **kwargs).items():
+            if isinstance(values, str) or not np.iterable(values):
+                values = [values]
+            if sim_mask is not None and col in self.aspect_names:
+                sim_mask &= np.isin(sim_aspects[:, self.aspect_names.index(col)], [str(v) for v in values])
+            elif col in df.columns:
+                mask &= df[col].isin(values).to_numpy()
+            else:
+                raise Exception(f"Aspect or column '{col}' not known, use one of {list(df.columns)}")
+        return mask if sim_mask is None else mask & sim_mask[codes]
+
+    def select(self, name, aspects=None, **kwargs):
+        """
+        Selects the rows of a result by aspect, e.g. select('energy_demand.csv', occupation='MFH')
+        :param name: the name of the result, e.g., 'energy_demand_m2.csv'
+        :param aspects: dictionary like {'en-std': 'ZEB', 'climate_region': ['4A', '5A']} (optional)
+        :param kwargs: aspects given as keyword arguments, e.g. occupation='MFH'
+        :return: pandas dataframe
+        """
+        return self.load(name)[self.get_mask(name, aspects, **kwargs)]
+
+    def sims(self, name, aspects=None, **kwargs):
+        """
+        Finds the simulations of a result with the given aspects
+        :param name: the name of the result, e.g., 'energy_demand_m2.csv'
+        :param aspects: dictionary like {'en-std': 'ZEB', 'climate_region': ['4A', '5A']} (optional)
+        :param kwargs: aspects given as keyword arguments, e.g. occupation='MFH'
+        :return: list of building names
+        """
+        sims = self.select(name, aspects, **kwargs)['Building name']
+        return [str(sim) for sim in sims.cat.remove_unused_categories().cat.categories]
+
+    def pivot(self, name, index, columns, values='Value', aggfunc='sum', aspects=None, **kwargs):
+        """
+        Selects the rows of a result by aspect and creates a pivot table, e.g. the heating demand of ZEB vs. standard
+        buildings by climate region
+        :param name: the name of the result, e.g., 'energy_demand_m2.csv'
+        :param index: column(s) of the pivot table rows, e.g. 'climate_region'
+        :param columns: column(s) of the pivot table columns, e.g. ['en-std', 'EnergyPlus output variable']
+        :param values: column with the values (default: 'Value')
+        :param aggfunc: aggregation of the values (default: 'sum')
+        :param aspects: dictionary like {'en-std': 'ZEB', 'climate_region': ['4A', '5A']} (optional)
+        :param kwargs: aspects given as keyword arguments, e.g. occupation='MFH'
+        :return: pandas dataframe
+        """
+        return self.select(name, aspects, **kwargs).pivot_table(index=index, columns=columns, values=values,
+                                                                aggfunc=aggfunc, observed=True)
+
+    def weighted_sum(self, name, weights, by=None, aspects=None, **kwargs):
+        """
+        Sums up the values of a result multiplied by a weight per simulation
+        :param name: the name of the result, e.g., 'energy_demand.csv'
+        :param weights: pandas series with a weight per building name, or a dataframe with aspect columns and a column
+            'share', e.g. settings.climate_region_weight (simulations without a weight are weighted with 0)
+        :param by: columns by which the weighted values are summed up, e.g. ['occupation', 'Material type'] (default:
+            all columns of the result that are neither aspects nor the building name)
+        :param aspects: dictionary like {'en-std': 'ZEB', 'climate_region': ['4A', '5A']} (optional)
+        :param kwargs: aspects given as keyword arguments, e.g. occupation='MFH'
+        :return: pandas series with the weighted sums
+        """
+        df = self.load(name)
+        _, sim_aspects, codes = self._results[name]
+        if sim_aspects is None:
+            raise Exception(f'Result {name} is not split by simulation')
+        sims = df['Building name'].cat.categories
+        if isinstance(weights, pd.Series):
+            sim_weights = weights.reindex(sims).to_numpy(dtype=float)
+        else:
+            keys = [col for col in weights.columns if col in self.aspect_names]
+            sim_keys = pd.MultiIndex.from_arrays([sim_aspects[:, self.aspect_names.index(k)] for k in keys])
+            shares = weights.set_index(keys)['share']
+            shares.index = pd.MultiIndex.from_arrays([shares.index.get_level_values(k).astype(str) for k in keys])
+            sim_weights = shares.reindex(sim_keys).to_numpy(dtype=float)
+        if np.isnan(sim_weights).any():
+            print(f'Warning: No weight found for {np.isnan(sim_weights).sum()} simulations (their weight is set to 0)')
+        if by is None:
+            by = [col for col in df.columns if col not in self.aspect_names + ['Building name', 'Value']]
+        mask = self.get_mask(name, aspects, **kwargs)
+        weighted = df['Value'].to_numpy()[mask] * np.nan_to_num(sim_weights)[codes[mask]]
+        return pd.Series(weighted, index=df.index[mask], name='Value').groupby([df.loc[mask, col] for col in by],
+                                                                               observed=True).sum()
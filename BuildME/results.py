@@ -0,0 +1,248 @@
+"""
+Material demand of a batch simulation as a sparse simulations x materials matrix
+
+The masses are kept in coordinate format (row = simulation, column = material, value = mass in kg) together with the
+material vocabulary, the aggregation category of each material and the BuildME aspects of each simulation (taken from
+the building name, e.g. 'USA_SFH_standard_RES0_4A_2015_HVAC'). The matrix is saved as one compressed numpy file, which
+is much smaller and faster to load than 'summary_mat_demand.csv'. Simulations can be selected by aspect and the masses
+aggregated by category with matrix products; the long-format table of the summary files is created on demand only.
+"""
+import os
+import numpy as np
+import pandas as pd
+from BuildME import batch, settings, store
+
+# file name of the matrix in the batch simulation folder
+matrix_file = 'mat_demand_matrix.npz'
+
+
+def make_material_matrix(names, demands, aspect_names, aggregation_categories=None, floor_areas=None, aspects=None):
+    """
+    Creates the sparse material demand matrix of a batch simulation
+    :param names: list with the building names (folder names) of the simulations
+    :param demands: list with the material demand of each simulation as a tuple (material names, masses in kg)
+    :param aspect_names: names of the BuildME aspects, e.g., ['region', 'occupation', ...]
+    :param aggregation_categories: dict with materials and their aggregation categories (default: from config)
+    :param floor_areas: list with the total floor area of each simulation (m2) (optional)
+    :param aspects: array (simulations x aspects) with the aspect values, see batch.get_aspects() (default: derived
+        from the building names)
+    :return: dictionary with the material demand matrix
+    """
+    if aggregation_categories is None:
+        aggregation_categories = settings.material_aggregation
+    materials = {}
+    rows, cols, values = [], [], []
+    for i, (mat_names, masses) in enumerate(demands):
+        for mat in mat_names:
+            materials.setdefault(mat, len(materials))
+        rows.append(np.full(len(mat_names), i, dtype=np.int32))
+        cols.append(np.array([materials[mat] for mat in mat_names], dtype=np.int32))
+        values.append(np.asarray(masses, dtype=float))
+    materials = list(materials)
+    mat_categories = [aggregation_categories.get(mat, '?') for mat in materials]
+    categories = list(dict.fromkeys(mat_categories))
+    if aspects is None:
+        aspects = [name.split('_') for name in names]
+        if any(len(a) != len(aspect_names) for a in aspects):
+            raise Exception(f"The building names do not match the aspects {aspect_names}")
+    matrix = {'sims': np.array(names, dtype=str),
+              'materials': np.array(materials, dtype=str),
+              'categories': np.array(categories, dtype=str),
+              'material_category': np.array([categories.index(c) for c in mat_categories], dtype=np.int32),
+              'aspect_names': np.array(aspect_names, dtype=str),
+              'aspects': np.array(aspects, dtype=str).reshape(len(names), len(aspect_names)),
+              'row': np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32),
+              'col': np.concatenate(cols) if cols else np.zeros(0, dtype=np.int32),
+              'value': np.concatenate(values) if values else np.zeros(0)}
+    if floor_areas is not None:
+        matrix['floor_area'] = np.asarray(floor_areas, dtype=float)
+    return matrix
+
+
+def read_material_demand(folder):
+    """
+    Reads the material demand of a simulation folder ('mat_demand.csv')
+    :param folder: simulation folder
+    :return: tuple (material names, masses in kg)
+    """
+    df = pd.read_csv(os.path.join(folder, 'mat_demand.csv'), float_precision='round_trip')
+    return df['Material name'].tolist(), df['Value'].to_numpy(dtype=float)
+
+
+def read_floor_area(folder):
+    """
+    Reads the total floor area of a simulation folder ('geom_stats.csv')
+    :param folder: simulation folder
+    :return: total floor area (m2)
+    """
+    df = pd.read_csv(os.path.join(folder, 'geom_stats.csv'), index_col=0, float_precision='round_trip')
+    return float(df.loc['total_floor_area', 'Value'])
+
+
+def collect_material_matrix(batch_sim=None, folders=None, groups=None, combinations=None,
+                            aggregation_categories=None):
+    """
+    Collects the material demand of the simulation folders into the sparse matrix and saves it into the batch
+    simulation folder
+    :param batch_sim: dictionary with batch simulation information
+    :param folders: a list of directories (required only when batch_sim is None)
+    :param groups: groups of simulations with the same material demand, see simulate.group_material_simulations(); only
+        the first simulation of each group is read (optional)
+    :param combinations: a dictionary with the selected BuildME aspects and their values
+    :param aggregation_categories: dict with materials and their aggregation categories (default: from config)
+    :return: dictionary with the material demand matrix
+    """
+    if combinations is None:
+        combinations = settings.debug_combinations
+    aspect_names = ['region'] + list(list(combinations.values())[0].keys())
+    if batch_sim is None:
+        if folders is None:
+            raise Exception('Folders not given')
+        sources = {folder: folder for folder in folders}
+    else:
+        folders = [batch_sim[sim]['run_folder'] for sim in batch_sim]
+        if groups is None:
+            sources = {folder: folder for folder in folders}
+        else:
+            sources = {batch_sim[sim]['run_folder']: batch_sim[sims[0]]['run_folder']
+                       for sims in groups.values() for sim in sims}
+    demands, floor_areas = {}, {}
+    for folder in set(sources.values()):
+        demands[folder] = read_material_demand(folder)
+        floor_areas[folder] = read_floor_area(folder)
+    names = [os.path.basename(folder) for folder in folders]
+    matrix = make_material_matrix(names, [demands[sources[folder]] for folder in folders], aspect_names,
+                                  aggregation_categories, [floor_areas[sources[folder]] for folder in folders],
+                                  batch.get_aspects(os.path.dirname(folders[0]), names, aspect_names))
+    save_material_matrix(matrix, os.path.dirname(folders[0]))
+    return matrix
+
+
+def make_material_matrix_from_store(parent_dir, aspect_names, order=None, aggregation_categories=None):
+    """
+    Creates the sparse material demand matrix from the results store of a batch simulation (see store.py)
+    :param parent_dir: batch simulation folder
+    :param aspect_names: names of the BuildME aspects, e.g., ['region', 'occupation', ...]
+    :param order: list of building names in the order of the matrix rows (default: order of appending)
+    :param aggregation_categories: dict with materials and their aggregation categories (default: from config)
+    :return: dictionary with the material demand matrix (or None if the store has no material demand)
+    """
+    mat_demand = store.load_summary(parent_dir, 'mat_demand.csv', aspect_names, order)
+    if mat_demand is None:
+        return None
+    groups = mat_demand.groupby('Building name', observed=True, sort=False)
+    names = [str(name) for name in groups.groups.keys()]
+    demands = [(df['Material name'].astype(str).tolist(), df['Value'].to_numpy(dtype=float)) for _, df in groups]
+    floor_areas = None
+    geom_stats = store.scan_results(parent_dir, 'geom_stats.csv')
+    if geom_stats is not None:
+        geom_stats = geom_stats[geom_stats['Geometry statistics'] == 'total_floor_area']
+        floor_areas = geom_stats.set_index(geom_stats['Building name'].astype(str))['Value'].reindex(names)
+    return make_material_matrix(names, demands, aspect_names, aggregation_categories, floor_areas,
+                                batch.get_aspects(parent_dir, names, aspect_names))
+
+
+def save_material_matrix(matrix, folder):
+    """
+    Saves the material demand matrix into a compressed numpy file
+    :param matrix: dictionary with the material demand matrix, see make_material_matrix()
+    :param folder: folder where the file 'mat_demand_matrix.npz' is saved
+    """
+    np.savez_compressed(os.path.join(folder, matrix_file), **matrix)
+    return
+
+
+def load_material_matrix(path):
+    """
+    Loads a material demand matrix
+    :param path: the file or the batch simulation folder containing 'mat_demand_matrix.npz'
+    :return: dictionary with the material demand matrix
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, matrix_file)
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def select_sims(matrix, aspects):
+    """
+    Finds the simulations with the given aspects
+    :param matrix: dictionary with the material demand matrix
+    :param aspects: dictionary like {'occupation': 'SFH', 'climate_region': ['4A', '5A']}
+    :return: numpy array with the indices of the selected simulations
+    """
+    mask = np.ones(len(matrix['sims']), dtype=bool)
+    aspect_names = list(matrix['aspect_names'])
+    for aspect, values in aspects.items():
+        if aspect not in aspect_names:
+            raise Exception(f"Aspect '{aspect}' not known, use one of {aspect_names}")
+        if isinstance(values, str):
+            values = [values]
+        mask &= np.isin(matrix['aspects'][:, aspect_names.index(aspect)], list(values))
+    return np.flatnonzero(mask)
+
+
+def slice_material_matrix(matrix, aspects):
+    """
+    Selects the simulations with the given aspects
+    :param matrix: dictionary with the material demand matrix
+    :param aspects: dictionary like {'occupation': 'SFH', 'climate_region': ['4A', '5A']}
+    :return: dictionary with the material demand matrix of the selected simulations
+    """
+    sims = select_sims(matrix, aspects)
+    new_index = np.full(len(matrix['sims']), -1, dtype=np.int32)
+    new_index[sims] = np.arange(len(sims), dtype=np.int32)
+    keep = new_index[matrix['row']] >= 0
+    sliced = dict(matrix)
+    sliced.update({'sims': matrix['sims'][sims], 'aspects': matrix['aspects'][sims],
+                   'row': new_index[matrix['row'][keep]], 'col': matrix['col'][keep],
+                   'value': matrix['value'][keep]})
+    if 'floor_area' in matrix:
+        sliced['floor_area'] = matrix['floor_area'][sims]
+    return sliced
+
+
+def to_dense(matrix):
+    """
+    Converts the material demand matrix into a dense array
+    :param matrix: dictionary with the material demand matrix
+    :return: numpy array (simulations x materials) with the masses in kg
+    """
+    n_mats = len(matrix['materials'])
+    dense = np.bincount(matrix['row'].astype(np.int64) * n_mats + matrix['col'], weights=matrix['value'],
+                        minlength=len(matrix['sims']) * n_mats)
+    return dense.reshape(len(matrix['sims']), n_mats)
+
+
+def aggregate_by_category(matrix, per_m2=False):
+    """
+    Aggregates the material demand by aggregation category, i.e. multiplies the matrix with the materials x categories
+    indicator matrix
+    :param matrix: dictionary with the material demand matrix
+    :param per_m2: True if the masses should be divided by the total floor area of the simulations
+    :return: pandas dataframe (simulations x categories) with the masses in kg (or kg/m2)
+    """
+    n_cats = len(matrix['categories'])
+    cats = matrix['material_category'][matrix['col']]
+    values = np.bincount(matrix['row'].astype(np.int64) * n_cats + cats, weights=matrix['value'],
+                         minlength=len(matrix['sims']) * n_cats).reshape(len(matrix['sims']), n_cats)
+    if per_m2:
+        values = values / matrix['floor_area'][:, None]
+    return pd.DataFrame(values, index=matrix['sims'], columns=matrix['categories'])
+
+
+def matrix_to_long(matrix, categorized=False):
+    """
+    Creates the long-format table of 'summary_mat_demand.csv' (or 'summary_mat_demand_categorized.csv')
+    :param matrix: dictionary with the material demand matrix
+    :param categorized: True if the column 'Material type' should be added
+    :return: pandas dataframe indexed by the aspects
+    """
+    df = pd.DataFrame({'Building name': matrix['sims'][matrix['row']],
+                       'Material name': matrix['materials'][matrix['col']]})
+    if categorized:
+        df['Material type'] = matrix['categories'][matrix['material_category'][matrix['col']]]
+    df['Unit'] = 'kg'
+    df['Value'] = matrix['value']
+    df.index = pd.MultiIndex.from_arrays(matrix['aspects'][matrix['row']].T, names=list(matrix['aspect_names']))
+    return df
@@ -30,3 +30,16 @@ if SimulationConfig['cover version'] != config_file_version:
 # Modelling settings
 shielding = SimulationConfig['shielding']  # wind shielding, needed for MMV simulations; set to low, medium or high
 cpus = SimulationConfig['cpus']  # Number of CPUs used for energy simulation. 'max' = all. 'auto' = available CPUSs - 1
+# Footprint of the buildings: 'bbox' = rectangle around the ground floors, 'polygon' = outline of the ground floors
+footprint = SimulationConfig.get('footprint', 'bbox')
+# True if ReadVarsESO converts the whole ESO file into 'eplusout.csv', False if only the meters used by BuildME are read
+readvars = SimulationConfig.get('readvars', True)
+# True if EnergyPlus writes the results into 'eplusout.sql' (Output:SQLite) and BuildME reads them from there
+sqlite = SimulationConfig.get('sqlite', False)
+# True if the reporting objects of the archetypes that are not read by BuildME are removed before the simulation
+lean_output = SimulationConfig.get('lean output', False)
+# Outputs kept in the lean output mode: names of output variables, meters, tables or summary reports separated by commas,
+# e.g. 'Zone Mean Air Temperature, Gas:Building'
+keep_outputs = [o.strip() for o in str(SimulationConfig.get('keep outputs') or '').split(',') if o.strip()]
+# True if hourly heating and cooling profiles are saved into the profile store of the batch simulation (see profiles.py)
+hourly_profiles = SimulationConfig.get('hourly profiles', False)
@@ -7,13 +7,31 @@ import datetime
 import multiprocessing as mp
 import os
 import shutil
-from time import sleep
+from time import sleep, time
 import pandas as pd
 from tqdm import tqdm
 from eppy.modeleditor import IDF
 import openpyxl
 import numpy as np
-from BuildME import energy, material, settings, batch, mmv
+from BuildME import energy, material, settings, batch, mmv, surrogate, results, store, profiles, impact
+
+# geometry snapshots of the archetypes processed by a worker process of calculate_materials_mp()
+worker_snapshots = {}
+# material object types without density and/or thickness data (defined in sheet 'atypical materials' of the config)
+atypical_obj_types = ['Material:NoMass', 'Material:InfraredTransparent', 'Material:AirGap',
+                      'Material:RoofVegetation', 'WindowMaterial:SimpleGlazingSystem', 'WindowMaterial:Glazing',
+                      'WindowMaterial:GlazingGroup:Thermochromic', 'WindowMaterial:Glazing:RefractionExtinctionMethod',
+                      'WindowMaterial:Gas', 'WindowMaterial:GasMixture', 'WindowMaterial:Gap', 'WindowMaterial:Shade',
+                      'WindowMaterial:ComplexShade', 'WindowMaterial:Blind', 'WindowMaterial:Screen']
+atypical_obj_types_with_thickness = ['Material:RoofVegetation', 'WindowMaterial:Glazing',
+                                     'WindowMaterial:Glazing:RefractionExtinctionMethod', 'WindowMaterial:Gas',
+                                     'WindowMaterial:GasMixture', 'WindowMaterial:Gap', 'WindowMaterial:Shade']
+# reporting object types removed from the IDF files in the lean output mode (see strip_outputs())
+output_obj_types = ['Output:Variable', 'Output:Meter', 'Output:Meter:MeterFileOnly', 'Output:Meter:Cumulative',
+                    'Output:Meter:Cumulative:MeterFileOnly', 'Output:Table:Monthly', 'Output:Table:Annual',
+                    'Output:Table:TimeBins', 'Output:Table:SummaryReports', 'Output:VariableDictionary',
+                    'Output:Surfaces:List', 'Output:Surfaces:Drawing', 'Output:Schedules', 'Output:Constructions',
+                    'Output:Diagnostics', 'OutputControl:Table:Style', 'OutputControl:ReportingTolerances']
 
 
 def validate_ep_version(idf_files, crash=True):
@@ -162,7 +180,8 @@ def apply_rule_from_excel(idf_f, aspect, aspect_value, archetype, csv_folder):
     return idf_f
 
 
-def copy_idf_file(idf_path, out_dir, replace_dict, archetype, ep_dir, replace_csv_dir):
+def copy_idf_file(idf_path, out_dir, replace_dict, archetype, ep_dir, replace_csv_dir, sqlite=None, lean_output=None,
+                  hourly=None):
     """
     Copies the chosen idf file to the building simulation folder
     :param idf_path: path to the IDF file
@@ -171,26 +190,91 @@ def copy_idf_file(idf_path, out_dir, replace_dict, archetype, ep_dir, replace_cs
     :param archetype: archetype name
     :param ep_dir: EnergyPlus directory
     :param replace_csv_dir: folder with replacement csv files, e.g., 'replace-en-std.csv'
+    :param sqlite: True if the object 'Output:SQLite' should be added, i.e. the results are also written into
+        'eplusout.sql' (default: settings.sqlite)
+    :param lean_output: True if the reporting objects not read by BuildME should be removed, except the outputs in
+        settings.keep_outputs (default: settings.lean_output)
+    :param hourly: True if the hourly meters of profiles.profile_meters should be written into 'eplusout.mtr'
+        (default: settings.hourly_profiles)
     """
+    # the defaults are looked up at runtime, as the settings may be changed after the import
+    if sqlite is None:
+        sqlite = settings.sqlite
+    if lean_output is None:
+        lean_output = settings.lean_output
+    if hourly is None:
+        hourly = settings.hourly_profiles
     idf_path_new = os.path.join(out_dir, 'in.idf')
     shutil.copy2(idf_path, idf_path_new)
     idf_file = read_idf(ep_dir, idf_path_new)
-    if replace_dict:
-        for aspect, aspect_value in replace_dict.items():
-            idf_file = apply_obj_name_change(idf_file, aspect, aspect_value)
-            if replace_csv_dir is not None and os.path.exists(replace_csv_dir):
-                idf_file = apply_rule_from_excel(idf_file, aspect, aspect_value, archetype, replace_csv_dir)
+    idf_file = apply_replacements(idf_file, replace_dict, archetype, replace_csv_dir)
     if archetype in os.path.basename(out_dir):
         idf_file.idfobjects['Building'.upper()][0].Name = os.path.basename(out_dir)
+    if lean_output:
+        idf_file = strip_outputs(idf_file, settings.keep_outputs, sqlite)
     for meter_name in ['Cooling:EnergyTransfer', 'Heating:EnergyTransfer', 'InteriorEquipment:Electricity',
                        'InteriorLights:Electricity']:
         new_object = idf_file.newidfobject('Output:Meter')
         new_object['Key_Name'] = meter_name
         new_object['Reporting_Frequency'] = 'annual'
+    if hourly:
+        for meter_name in profiles.profile_meters:
+            new_object = idf_file.newidfobject('Output:Meter:MeterFileOnly')
+            new_object['Key_Name'] = meter_name
+            new_object['Reporting_Frequency'] = 'hourly'
+    if sqlite and not idf_file.idfobjects['Output:SQLite'.upper()]:
+        new_object = idf_file.newidfobject('Output:SQLite')
+        new_object['Option_Type'] = 'SimpleAndTabular'
     idf_file.saveas(idf_path_new)
     return
 
 
+def strip_outputs(idf_file, keep=None, sqlite=False):
+    """
+    Removes the reporting objects (see output_obj_types) that are not read by BuildME from an IDF file. The annual
+    meters used by BuildME are added afterwards by copy_idf_file().
+    :param idf_file: IDF file
+    :param keep: list of outputs requested by the user, i.e. names of output variables, meters, tables or summary
+        reports, e.g. ['Zone Mean Air Temperature', 'Gas:Building']; the objects containing one of them are kept
+    :param sqlite: True if the summary report with the end uses read from 'eplusout.sql' should be kept
+    :returns: Modified idf file
+    """
+    keep = [k.lower() for k in keep] if keep else []
+    reports = []
+    for obj_type in output_obj_types:
+        for obj in list(idf_file.idfobjects[obj_type.upper()]):
+            fields = [str(v).strip().lower() for v in obj.fieldvalues[1:]]
+            if obj_type == 'Output:Table:SummaryReports':
+                reports += [v for v in obj.fieldvalues[1:] if str(v).strip().lower() in keep]
+            elif any(f in keep for f in fields):
+                continue
+            idf_file.removeidfobject(obj)
+    if sqlite:
+        reports.append('AnnualBuildingUtilityPerformanceSummary')
+    if reports:
+        new_object = idf_file.newidfobject('Output:Table:SummaryReports')
+        for i, report in enumerate(dict.fromkeys(reports)):
+            new_object['Report_%d_Name' % (i + 1)] = report
+    return idf_file
+
+
+def apply_replacements(idf_file, replace_dict, archetype, replace_csv_dir):
+    """
+    Applies the BuildME replacement aspects (e.g. en-std, res) to an IDF file
+    :param idf_file: IDF file
+    :param replace_dict: dictionary with BuildME replacement aspects
+    :param archetype: archetype name
+    :param replace_csv_dir: folder with replacement csv files, e.g., 'replace-en-std.csv'
+    :returns: Modified idf file
+    """
+    if replace_dict:
+        for aspect, aspect_value in replace_dict.items():
+            idf_file = apply_obj_name_change(idf_file, aspect, aspect_value)
+            if replace_csv_dir is not None and os.path.exists(replace_csv_dir):
+                idf_file = apply_rule_from_excel(idf_file, aspect, aspect_value, archetype, replace_csv_dir)
+    return idf_file
+
+
 def calculate_energy(batch_sim=None, idf_path=None, out_dir=None, ep_dir=None, replace_dict=None,
                      parallel=False, clear_folder=False, last_run=False, replace_csv_dir=None, epw_path=None,
                      keep_all=False):
@@ -274,8 +358,8 @@ def calculate_energy(batch_sim=None, idf_path=None, out_dir=None, ep_dir=None, r
 
 
 def calculate_materials(batch_sim=None, idf_path=None, out_dir=None, ep_dir=None, replace_dict=None,
-                        clear_folder=False, last_run=False, replace_csv_dir=None, atypical_materials=None,
-                        ifsurrogates=True, surrogates=None, region=None):
+                        parallel=False, clear_folder=False, last_run=False, replace_csv_dir=None,
+                        atypical_materials=None, ifsurrogates=True, surrogates=None, region=None):
     """
     Initiates the calculation of material demand
     :param batch_sim: dictionary with batch simulation information
@@ -283,6 +367,7 @@ def calculate_materials(batch_sim=None, idf_path=None, out_dir=None, ep_dir=None
     :param out_dir: output folder directory
     :param ep_dir: EnergyPlus directory
     :param replace_dict: dictionary with BuildME replacement aspects
+    :param parallel: True if parallel simulations (multiprocessing) should be performed (default: False)
     :param clear_folder: True if the simulation folder should be cleared before the simulation (default: False)
     :param last_run: True if the last simulation run should be loaded (default: False)
     :param replace_csv_dir: folder with replacement csv files, e.g., 'replace-en-std.csv'
@@ -302,7 +387,9 @@ def calculate_materials(batch_sim=None, idf_path=None, out_dir=None, ep_dir=None
             if surrogates is None:
                 raise Exception("Surrogate element calculations requested but no surrogate dictionary given")
             elif type(surrogates) == pd.core.frame.DataFrame:
-                surrogates = convert_surrogates_df_to_dict(surrogates, archetype, replace_dict, region)
+                table = surrogate.compile_surrogate_table(surrogates)
+                surrogates = surrogate.get_surrogate_rows(table, surrogate.select_surrogates(table, archetype,
+                                                                                             replace_dict, region))
         validate_ep_version([os.path.join(out_dir, 'in.idf')])
         # perform actual simulation
         idf_file = read_idf(ep_dir, os.path.join(out_dir, 'in.idf'))
@@ -313,32 +400,324 @@ def calculate_materials(batch_sim=None, idf_path=None, out_dir=None, ep_dir=None
         ep_dir = settings.ep_path
         replace_csv_dir = settings.replace_csv_dir
         atypical_materials = settings.atypical_materials
-        # copy the necessary files
         for sim in batch_sim:
             idf_path = batch_sim[sim]['archetype_file']
-            out_dir = batch_sim[sim]['run_folder']
-            archetype = batch_sim[sim]['occupation']
-            replace_dict = batch_sim[sim]['replace_dict']
             if not os.path.exists(idf_path) and batch_sim[sim]['cooling'] == 'MMV':
-                create_mmv_variant(idf_path, ep_dir, archetype)
-            copy_idf_file(idf_path, out_dir, replace_dict, archetype, ep_dir, replace_csv_dir)
+                create_mmv_variant(idf_path, ep_dir, batch_sim[sim]['occupation'])
         validate_ep_version(list(set([batch_sim[sim]['archetype_file'] for sim in batch_sim])))  # list with no duplicates
-        # perform actual simulation
-        for sim in tqdm(batch_sim):
-            out_dir = batch_sim[sim]['run_folder']
-            archetype = batch_sim[sim]['occupation']
-            replace_dict = batch_sim[sim]['replace_dict']
-            region = batch_sim[sim]['climate_region']
-            if ifsurrogates:
-                surrogates = convert_surrogates_df_to_dict(settings.surrogate_elements, archetype, replace_dict, region)
-            idf_file = read_idf(ep_dir, os.path.join(out_dir, 'in.idf'))
-            atypical_materials = check_atypical_materials(idf_file, atypical_materials, out_dir, config=True)
-            material.perform_materials_calculation(idf_file, out_dir, atypical_materials, surrogates,
-                                                   ifsurrogates, replace_dict=replace_dict)
+        # perform actual simulation (only once for the simulations with the same material demand and with the same
+        #  geometry snapshot for all variants of an archetype file)
+        groups, surrogates_dicts = group_material_simulations(batch_sim, ifsurrogates)
+        if parallel is False:  # ordinary simulation
+            snapshots = {}
+            for sims in tqdm(groups.values()):
+                sim = sims[0]
+                out_dir = batch_sim[sim]['run_folder']
+                replace_dict = batch_sim[sim]['replace_dict']
+                idf_path = batch_sim[sim]['archetype_file']
+                # copy the necessary files (only for the simulations that are calculated)
+                prepare_idf_file(idf_path, out_dir, replace_dict, batch_sim[sim]['occupation'], ep_dir,
+                                 replace_csv_dir)
+                snapshots[idf_path] = calculate_materials_single(out_dir, ep_dir, atypical_materials,
+                                                                 surrogates_dicts[sim], ifsurrogates, replace_dict,
+                                                                 snapshot=snapshots.get(idf_path))
+                for other_sim in sims[1:]:
+                    copy_material_results(out_dir, batch_sim[other_sim]['run_folder'])
+            results.collect_material_matrix(batch_sim, groups=groups)
+        else:  # parallel simulation
+            # the simulations of the same archetype file are submitted next to each other, so that the chunks
+            #  processed by one worker mostly share the same geometry snapshot; the workers also prepare the files
+            sims = sorted([sims[0] for sims in groups.values()], key=lambda x: batch_sim[x]['archetype_file'])
+            args = [(sim, batch_sim[sim]['run_folder'], ep_dir, atypical_materials, surrogates_dicts[sim],
+                     ifsurrogates, batch_sim[sim]['replace_dict'], batch_sim[sim]['archetype_file'],
+                     batch_sim[sim]['occupation'], replace_csv_dir) for sim in sims]
+            cpus = find_cpus()
+            chunksize = max(1, len(args) // (cpus * 4))
+            print("Perform material demand simulation on %s CPUs..." % cpus)
+            start = time()
+            timing = {}
+            with mp.Pool(processes=cpus) as pool:
+                for sim, duration, error in tqdm(pool.imap_unordered(calculate_materials_mp, args, chunksize),
+                                                 total=len(args), smoothing=0.1, unit='sim'):
+                    timing[sim] = (duration, error)
+            total_time = time() - start
+            failed = {sim: error for sim, (duration, error) in timing.items() if error is not None}
+            for sims in groups.values():
+                if sims[0] not in failed:
+                    for other_sim in sims[1:]:
+                        copy_material_results(batch_sim[sims[0]]['run_folder'], batch_sim[other_sim]['run_folder'])
+            save_material_timing(timing, groups, batch_sim)
+            durations = [duration for duration, error in timing.values()]
+            print(f"Material demand of {len(args)} simulations calculated in {total_time:.1f} s "
+                  f"({len(args) / total_time:.2f} sim/s). Time per simulation: mean {np.mean(durations):.2f} s, "
+                  f"max {max(durations):.2f} s.")
+            if failed:
+                print(f'Warning: the material demand simulation was not successful for the following simulations '
+                      f'(and the simulations with the same material demand):')
+                for sim, error in failed.items():
+                    print(f' {sim}: {error}')
+                print('The material demand matrix (see results.py) was not saved.')
+            else:
+                results.collect_material_matrix(batch_sim, groups=groups)
+        report_material_groups(len(groups), len(batch_sim))
     print('Material demand simulation finished.')
     return
 
 
+def calculate_materials_in_memory(batch_sim, ifsurrogates=True, combinations=None):
+    """
+    Material-only batch simulation that keeps all intermediate results in memory: each archetype file is parsed once,
+    its variants are created by resetting and replacing the fields of the parsed file, and the material demand of all
+    simulations is saved at the end as one sparse matrix ('mat_demand_matrix.npz', see results.py) in the batch
+    simulation folder. No simulation folders, IDF copies or per-simulation result files are needed.
+    :param batch_sim: dictionary with batch simulation information
+    :param ifsurrogates: True if surrogate calculations are requested (default: True)
+    :param combinations: a dictionary with the selected BuildME aspects and their values
+    :returns: dictionary with the material demand matrix
+    """
+    print("Initiating in-memory material demand simulation...")
+    ep_dir = settings.ep_path
+    atypical_materials = settings.atypical_materials
+    start = time()
+    groups, surrogates_dicts = group_material_simulations(batch_sim, ifsurrogates)
+    # the groups of one variant (archetype file, occupation and replace_dict) only differ by their surrogate elements
+    variants = {}
+    for key, sims in groups.items():
+        variants.setdefault(key[:3], []).append(sims)
+    archetypes = {}
+    snapshots = {}
+    masses = {}
+    geom_stats = {}
+    demands = {}
+    floor_areas = {}
+    unknown_materials = {}
+    for (idf_path, _, _), variant_groups in tqdm(sorted(variants.items()), unit='variant'):
+        sim = variant_groups[0][0]
+        if idf_path not in archetypes:
+            if not os.path.exists(idf_path) and batch_sim[sim]['cooling'] == 'MMV':
+                create_mmv_variant(idf_path, ep_dir, batch_sim[sim]['occupation'])
+            idf_file = read_idf(ep_dir, idf_path)
+            archetypes[idf_path] = (idf_file, get_idf_fields(idf_file))
+        idf_file, fields = archetypes[idf_path]
+        reset_idf_fields(fields)
+        idf_file = apply_replacements(idf_file, batch_sim[sim]['replace_dict'], batch_sim[sim]['occupation'],
+                                      settings.replace_csv_dir)
+        unknown = find_unknown_atypical_materials(idf_file, atypical_materials)
+        if unknown:
+            unknown_materials.update(unknown)
+            continue
+        inputs = material.make_material_inputs(idf_file, atypical_materials, batch_sim[sim]['replace_dict'],
+                                               snapshots.get(idf_path))
+        snapshots[idf_path] = inputs['snapshot']
+        # the surrogate elements of all groups are added below in one pass
+        mat_mass, variant_geom_stats = material.calc_material_demand(inputs, None, ifsurrogates=False)
+        for sims in variant_groups:
+            masses[sims[0]] = mat_mass
+            geom_stats[sims[0]] = variant_geom_stats
+    if unknown_materials:
+        add_unknown_atypical_materials_to_config(unknown_materials)
+        raise Exception(f'The following materials were not found in the atypical materials dictionary: '
+                        f'\n {list(unknown_materials.keys())}.'
+                        f"\n These materials were added in sheet 'atypical materials' of the file "
+                        f'{os.path.basename(settings.config_file)}')
+    if ifsurrogates:
+        selections = {sims[0]: key[3] for key, sims in groups.items()}
+        surrogate_mass, basement_area = surrogate.calc_batch_surrogate_masses(
+            surrogate.get_surrogate_table(), selections, pd.DataFrame.from_dict(geom_stats, orient='index'))
+    for sims in groups.values():
+        mat_mass = dict(masses[sims[0]])
+        floor_area = geom_stats[sims[0]]['total_floor_area']
+        if ifsurrogates:
+            # only the materials of the selected surrogate elements are added (see material.calc_material_demand())
+            surrogate_mats = surrogates_dicts[sims[0]]['materials']
+            mat_mass = material.add_surrogate_element_to_mat_mass(
+                mat_mass, dict(zip(surrogate_mats, surrogate_mass.loc[sims[0], surrogate_mats].tolist())))
+            # the basements add to the floor area
+            floor_area = floor_area + float(basement_area[sims[0]])
+        for sim in sims:
+            demands[sim] = (list(mat_mass.keys()), np.array(list(mat_mass.values())))
+            floor_areas[sim] = floor_area
+    if combinations is None:
+        combinations = settings.debug_combinations
+    aspect_names = ['region'] + list(list(combinations.values())[0].keys())
+    parent_dir = os.path.dirname(batch_sim[list(batch_sim.keys())[0]]['run_folder'])
+    names = [os.path.basename(batch_sim[sim]['run_folder']) for sim in batch_sim]
+    matrix = results.make_material_matrix(names, [demands[sim] for sim in batch_sim], aspect_names,
+                                          floor_areas=[floor_areas[sim] for sim in batch_sim],
+                                          aspects=batch.get_aspects(parent_dir, names, aspect_names))
+    results.save_material_matrix(matrix, parent_dir)
+    unknown_categories = [str(mat) for mat in matrix['materials'] if mat not in settings.material_aggregation]
+    if unknown_categories:
+        add_unknown_categories_to_config(unknown_categories)
+    print(f"Material demand of {len(batch_sim)} simulations ({len(snapshots)} archetype files, "
+          f"{len(variants)} variants) calculated in {time() - start:.1f} s and saved to "
+          f"'{os.path.join(parent_dir, results.matrix_file)}'.")
+    return matrix
+
+
+def get_idf_fields(idf_file):
+    """
+    Copies the field values of all objects of an IDF file, so that the file can be reset after modifications
+    :param idf_file: IDF file
+    :returns: list of tuples (object, list of field values)
+    """
+    return [(obj, list(obj.obj)) for objs in idf_file.idfobjects.values() for obj in objs]
+
+
+def reset_idf_fields(fields):
+    """
+    Resets the field values of the objects of an IDF file (objects added or removed since are not considered)
+    :param fields: field values as returned by get_idf_fields()
+    """
+    for obj, values in fields:
+        obj.obj[:] = values
+    return
+
+
+def calculate_materials_single(out_dir, ep_dir, atypical_materials, surrogates, ifsurrogates=True, replace_dict=None,
+                               config=True, snapshot=None):
+    """
+    Performs the material demand simulation for a prepared simulation folder (i.e. one containing 'in.idf')
+    :param out_dir: output folder directory
+    :param ep_dir: EnergyPlus directory
+    :param atypical_materials: pandas dataframe with thicknesses and densities of atypical materials
+    :param surrogates: surrogate elements (surrogate table, see surrogate.get_surrogate_rows(), or dictionary)
+    :param ifsurrogates: True if surrogate calculations are requested (default: True)
+    :param replace_dict: dictionary with BuildME replacement aspects
+    :param config: True if missing atypical materials should be added to the configuration file
+    :param snapshot: geometry snapshot of the archetype (see material.make_geometry_snapshot()), if already known
+    :returns: geometry snapshot of the archetype
+    """
+    idf_file = read_idf(ep_dir, os.path.join(out_dir, 'in.idf'))
+    atypical_materials = check_atypical_materials(idf_file, atypical_materials, out_dir, config=config)
+    snapshot = material.perform_materials_calculation(idf_file, out_dir, atypical_materials, surrogates,
+                                                      ifsurrogates, replace_dict=replace_dict, snapshot=snapshot)
+    return snapshot
+
+
+def calculate_materials_mp(args):
+    """
+    Prepares the simulation folder (see prepare_idf_file()) and performs the material demand simulation (with
+    multiprocessing). Errors are returned instead of raised, so that one failing simulation does not stop the others.
+    The geometry snapshots are kept in the worker process and shared by all its tasks with the same archetype file.
+    :param args: arguments (sim - simulation name,
+                            out_dir - output folder directory,
+                            ep_dir - EnergyPlus directory,
+                            atypical_materials - pandas dataframe with atypical materials,
+                            surrogates - surrogate elements (see calculate_materials_single()),
+                            ifsurrogates - True if surrogate calculations are requested,
+                            replace_dict - dictionary with BuildME replacement aspects,
+                            idf_path - path to the archetype file,
+                            archetype - archetype name,
+                            replace_csv_dir - folder with replacement csv files)
+    :returns: tuple (simulation name, duration in s, error message or None)
+    """
+    sim, out_dir, ep_dir, atypical_materials, surrogates, ifsurrogates, replace_dict, idf_path, archetype, \
+        replace_csv_dir = args
+    start = time()
+    error = None
+    try:
+        prepare_idf_file(idf_path, out_dir, replace_dict, archetype, ep_dir, replace_csv_dir)
+        # config=False: the workers cannot safely write to the config file at the same time
+        worker_snapshots[idf_path] = calculate_materials_single(out_dir, ep_dir, atypical_materials, surrogates,
+                                                                ifsurrogates, replace_dict, config=False,
+                                                                snapshot=worker_snapshots.get(idf_path))
+    except Exception as e:
+        error = repr(e)
+    return sim, time() - start, error
+
+
+def save_material_timing(timing, groups, batch_sim):
+    """
+    Saves the duration of the material demand simulations into 'material_timing.csv' in the batch simulation folder
+    :param timing: dictionary like {sim: (duration in s, error message or None)}
+    :param groups: groups of simulations with the same material demand, see group_material_simulations()
+    :param batch_sim: dictionary with batch simulation information
+    """
+    rows = []
+    for sims in groups.values():
+        if sims[0] in timing:
+            duration, error = timing[sims[0]]
+            rows.append([sims[0], duration, len(sims) - 1, error])
+    df = pd.DataFrame(rows, columns=['Building name', 'Duration (s)', 'Copied to (sims)', 'Error'])
+    parent_dir = os.path.dirname(batch_sim[list(batch_sim.keys())[0]]['run_folder'])
+    df.to_csv(os.path.join(parent_dir, 'material_timing.csv'), index=False)
+    return
+
+
+def group_material_simulations(batch_sim, ifsurrogates=True):
+    """
+    Groups the simulations with the same material demand, i.e. with the same archetype file, occupation, replace_dict
+    and surrogate elements. The climate region and scenario only affect the material demand through the surrogate
+    elements. The occupation is part of the key because archetype proxies (settings.archetype_proxies) can map several
+    occupations to the same archetype file, while the replacement rules (see apply_rule_from_excel()) and the building
+    name depend on the occupation.
+    :param batch_sim: dictionary with batch simulation information
+    :param ifsurrogates: True if surrogate calculations are requested (default: True)
+    :returns: groups: dictionary like {key: [sim1, sim2, ...]}, the first simulation of each group is calculated
+    :returns: surrogates_dicts: dictionary like {sim: surrogate table with the surrogate elements of the simulation}
+    """
+    groups = {}
+    surrogates_dicts = {}
+    # the surrogate elements sheet is compiled once, the simulations only keep their own rows
+    table = surrogate.get_surrogate_table()
+    tables = {}
+    for sim in batch_sim:
+        archetype = batch_sim[sim]['occupation']
+        replace_dict = batch_sim[sim]['replace_dict']
+        surrogates_dicts[sim] = None
+        rows = None
+        if ifsurrogates:
+            rows = surrogate.select_surrogates(table, archetype, replace_dict, batch_sim[sim]['climate_region'])
+            if rows not in tables:
+                tables[rows] = surrogate.get_surrogate_rows(table, rows)
+            surrogates_dicts[sim] = tables[rows]
+        key = (batch_sim[sim]['archetype_file'], archetype, repr(replace_dict), rows)
+        groups.setdefault(key, []).append(sim)
+    return groups, surrogates_dicts
+
+
+def prepare_idf_file(idf_path, out_dir, replace_dict, archetype, ep_dir, replace_csv_dir):
+    """
+    Copies the IDF file to the simulation folder (see copy_idf_file()), unless the folder already contains 'in.idf',
+    e.g. prepared by calculate_energy()
+    :param idf_path: path to the IDF file
+    :param out_dir: output folder directory
+    :param replace_dict: dictionary with BuildME replacement aspects
+    :param archetype: archetype name
+    :param ep_dir: EnergyPlus directory
+    :param replace_csv_dir: folder with replacement csv files, e.g., 'replace-en-std.csv'
+    """
+    if not os.path.exists(os.path.join(out_dir, 'in.idf')):
+        copy_idf_file(idf_path, out_dir, replace_dict, archetype, ep_dir, replace_csv_dir)
+    return
+
+
+def report_material_groups(n_calculated, n_sims):
+    """
+    Prints how many material demand simulations were saved by grouping the simulations with the same material demand
+    (see group_material_simulations())
+    :param n_calculated: number of simulations that were calculated
+    :param n_sims: number of simulations of the batch
+    """
+    print(f"Material demand calculated for {n_calculated} of {n_sims} simulations. The results of the remaining "
+          f"{n_sims - n_calculated} simulations were copied from simulations with the same archetype, aspects and "
+          f"surrogate elements.")
+    return
+
+
+def copy_material_results(src_dir, dst_dir):
+    """
+    Copies the results of a material demand simulation to the folder of another simulation with the same material
+    demand (see group_material_simulations())
+    :param src_dir: folder of the simulated building
+    :param dst_dir: folder of the building with the same material demand
+    """
+    for filename in ['mat_demand.csv', 'geom_stats.csv']:
+        shutil.copy2(os.path.join(src_dir, filename), os.path.join(dst_dir, filename))
+    return
+
+
 def check_input_variables_standalone(ep_dir, idf_path, out_dir, replace_csv_dir, clear_folder):
     """
     Checks whether input variables required for a standalone material or energy demand simulation are available
@@ -431,22 +810,10 @@ def check_atypical_materials(idf_file, atypical_materials, out_dir, config=True)
         thickness = [v for dic in atypical_materials.values() for k, v in dic.items() if 'thickness' in k]
         atypical_materials = pd.DataFrame({'density (kg/m3)': density, 'thickness (m)': thickness},
                                           index=atypical_materials.keys())
-    obj_types = ['Material:NoMass', 'Material:InfraredTransparent', 'Material:AirGap',
-                 'Material:RoofVegetation', 'WindowMaterial:SimpleGlazingSystem', 'WindowMaterial:Glazing',
-                 'WindowMaterial:GlazingGroup:Thermochromic', 'WindowMaterial:Glazing:RefractionExtinctionMethod',
-                 'WindowMaterial:Gas', 'WindowMaterial:GasMixture', 'WindowMaterial:Gap', 'WindowMaterial:Shade',
-                 'WindowMaterial:ComplexShade', 'WindowMaterial:Blind', 'WindowMaterial:Screen']
-    obj_types_with_thickness = ['Material:RoofVegetation', 'WindowMaterial:Glazing',
-                                'WindowMaterial:Glazing:RefractionExtinctionMethod', 'WindowMaterial:Gas',
-                                'WindowMaterial:GasMixture', 'WindowMaterial:Gap', 'WindowMaterial:Shade']
-    weird_mats = [obj for obj_type in obj_types for obj in idf_file.idfobjects[obj_type.upper()]]
-    unknown_materials = {}
-    for mat in weird_mats:
-        if mat.Name not in atypical_materials.index:
-            unknown_materials[mat.Name] = mat.obj[0]
+    unknown_materials = find_unknown_atypical_materials(idf_file, atypical_materials)
     if unknown_materials:
         if config is False:
-            thickness_list = ['?' if mat not in obj_types_with_thickness
+            thickness_list = ['?' if mat not in atypical_obj_types_with_thickness
                               else 'defined in ep' for mat in unknown_materials.values()]
             df = pd.DataFrame({'density (kg/m3)': ['?'], 'thickness (m)': thickness_list}, index=unknown_materials.keys())
             if os.path.exists(os.path.join(out_dir, 'atypical_materials.csv')):
@@ -458,20 +825,7 @@ def check_atypical_materials(idf_file, atypical_materials, out_dir, config=True)
                             f'\n These materials were added to file "atypical_materials.csv" located in "{out_dir}".'
                             f'\n Material demand calculation unsuccessful.')
         else:
-            wb = openpyxl.load_workbook(filename=settings.config_file)
-            ws = wb['atypical materials']
-            last_row = ws.max_row
-            c = 1
-            for mat, mat_type in unknown_materials.items():
-                ws.cell(column=3, row=last_row + c, value=mat)
-                ws.cell(column=4, row=last_row + c, value='?')
-                if mat_type in obj_types_with_thickness:
-                    ws.cell(column=5, row=last_row + c, value='defined in ep')
-                else:
-                    ws.cell(column=5, row=last_row + c, value='?')
-                c += 1
-            wb.save(filename=settings.config_file)
-            wb.close()
+            add_unknown_atypical_materials_to_config(unknown_materials)
             raise Exception(f'The following materials were not found in the atypical materials dictionary: '
                             f'\n {list(unknown_materials.keys())}.'
                             f"\n These materials were added in sheet 'atypical materials' of the file "
@@ -484,6 +838,155 @@ def check_atypical_materials(idf_file, atypical_materials, out_dir, config=True)
     return atypical_materials
 
 
+def find_unknown_atypical_materials(idf_file, atypical_materials):
+    """
+    Finds the atypical materials (with no density and/or thickness data) of an IDF file that are not defined in the
+    atypical materials dictionary
+    :param idf_file: IDF file
+    :param atypical_materials: pandas dataframe with thicknesses and densities of atypical materials
+    :return: dictionary like {material name: object type}
+    """
+    weird_mats = [obj for obj_type in atypical_obj_types for obj in idf_file.idfobjects[obj_type.upper()]]
+    unknown_materials = {}
+    for mat in weird_mats:
+        if mat.Name not in atypical_materials.index:
+            unknown_materials[mat.Name] = mat.obj[0]
+    return unknown_materials
+
+
+def add_unknown_atypical_materials_to_config(unknown_materials):
+    """
+    Adds atypical materials without data to the sheet 'atypical materials' of the config file
+    :param unknown_materials: dictionary like {material name: object type}
+    """
+    wb = openpyxl.load_workbook(filename=settings.config_file)
+    ws = wb['atypical materials']
+    last_row = ws.max_row
+    c = 1
+    for mat, mat_type in unknown_materials.items():
+        ws.cell(column=3, row=last_row + c, value=mat)
+        ws.cell(column=4, row=last_row + c, value='?')
+        if mat_type in atypical_obj_types_with_thickness:
+            ws.cell(column=5, row=last_row + c, value='defined in ep')
+        else:
+            ws.cell(column=5, row=last_row + c, value='?')
+        c += 1
+    wb.save(filename=settings.config_file)
+    wb.close()
+    return
+
+
+def audit_materials(batch_sim, ifsurrogates=True, config=True, cpus=None):
+    """
+    Pre-flight audit of the material data of a batch simulation. Every distinct variant (archetype file, occupation and
+    replace_dict) is checked once for atypical materials missing in the atypical materials dictionary, atypical
+    materials with '?' entries and materials without an aggregation category. Each archetype file is parsed once (in
+    parallel) and its variants are created in memory, as in calculate_materials_in_memory(), so no simulation folders
+    are written. All issues are written into one report ('material_audit.csv' in the batch simulation folder), so that
+    they can be fixed at once instead of one EnergyPlus/material run at a time.
+    :param batch_sim: dictionary with batch simulation information
+    :param ifsurrogates: True if surrogate calculations are requested (default: True)
+    :param config: True if the missing materials should be added to the configuration file (default: True)
+    :param cpus: number of parallel processes (default: settings.cpus)
+    :returns: pandas dataframe with the issues found
+    """
+    print("Auditing the material data of the batch simulation...")
+    ep_dir = settings.ep_path
+    atypical_materials = settings.atypical_materials
+    variants = {}
+    for sim in batch_sim:
+        idf_path = batch_sim[sim]['archetype_file']
+        if not os.path.exists(idf_path) and batch_sim[sim]['cooling'] == 'MMV':
+            create_mmv_variant(idf_path, ep_dir, batch_sim[sim]['occupation'])
+        variants.setdefault((idf_path, batch_sim[sim]['occupation'], repr(batch_sim[sim]['replace_dict'])), sim)
+    # the variants are audited by archetype file
+    archetypes = {}
+    for (idf_path, archetype, _), sim in variants.items():
+        archetypes.setdefault(idf_path, []).append((batch_sim[sim]['replace_dict'], archetype))
+    args = [(idf_path, archetype_variants, ep_dir, settings.replace_csv_dir, atypical_materials)
+            for idf_path, archetype_variants in archetypes.items()]
+    if cpus is None:
+        cpus = find_cpus()
+    with mp.Pool(processes=min(cpus, len(args))) as pool:
+        audits = pool.map(audit_materials_single, args)
+    # collect the issues by material, together with the archetype files they occur in
+    unknown_atypical = {}
+    used_materials = {}
+    for (idf_path, unknown, used) in audits:
+        for mat, mat_type in unknown.items():
+            unknown_atypical.setdefault(mat, (mat_type, set()))[1].add(os.path.basename(idf_path))
+        for mat in used:
+            used_materials.setdefault(mat, set()).add(os.path.basename(idf_path))
+    if ifsurrogates:
+        groups, surrogates_dicts = group_material_simulations(batch_sim, ifsurrogates)
+        for sims in groups.values():
+            for mat in surrogates_dicts[sims[0]]['materials']:
+                used_materials.setdefault(mat, set()).add('surrogate elements')
+    rows = []
+    for mat, (mat_type, files) in unknown_atypical.items():
+        rows.append(['missing atypical material', mat, mat_type, sorted(files)])
+    unspecified_materials = atypical_materials[(atypical_materials['density (kg/m3)'] == '?')
+                                               | (atypical_materials['thickness (m)'] == '?')]
+    for mat in unspecified_materials.index:
+        rows.append(["atypical material with '?'", mat, '', sorted(used_materials.get(mat, []))])
+    unknown_categories = [mat for mat in used_materials if mat not in settings.material_aggregation]
+    for mat in unknown_categories:
+        rows.append(['missing aggregation category', mat, '', sorted(used_materials[mat])])
+    for mat in used_materials:
+        if settings.material_aggregation.get(mat) == '?':
+            rows.append(["aggregation category '?'", mat, '', sorted(used_materials[mat])])
+    df = pd.DataFrame(rows, columns=['Issue', 'Material name', 'Object type', 'Archetype files'])
+    parent_dir = os.path.dirname(batch_sim[list(batch_sim.keys())[0]]['run_folder'])
+    df.to_csv(os.path.join(parent_dir, 'material_audit.csv'), index=False)
+    print(f"Audited {len(variants)} archetype variants of {len(batch_sim)} simulations: {len(df)} issues found"
+          f"{' (see material_audit.csv)' if len(df) else ''}.")
+    if config:
+        if unknown_atypical:
+            add_unknown_atypical_materials_to_config({k: v[0] for k, v in unknown_atypical.items()})
+        if unknown_categories:
+            add_unknown_categories_to_config(unknown_categories)
+    if unknown_atypical or len(unspecified_materials):
+        raise Exception(f'The material audit found atypical materials without data: '
+                        f'\n missing: {list(unknown_atypical.keys())}'
+                        f"\n with '?' entries: {list(unspecified_materials.index)}"
+                        f'\n See file "material_audit.csv" located in "{parent_dir}".'
+                        + (f"\n The missing materials were added in sheet 'atypical materials' of the file "
+                           f"{os.path.basename(settings.config_file)}" if config and unknown_atypical else ''))
+    return df
+
+
+def audit_materials_single(args):
+    """
+    Parses an archetype file once, creates its variants in memory (see apply_replacements()) and finds their atypical
+    materials without data and the materials of the constructions used by their surfaces (see audit_materials())
+    :param args: arguments (idf_path - path to the archetype file,
+                            variants - list of tuples (replace_dict, archetype name) of the variants,
+                            ep_dir - EnergyPlus directory,
+                            replace_csv_dir - folder with replacement csv files,
+                            atypical_materials - pandas dataframe with atypical materials)
+    :returns: tuple (archetype file, dictionary like {material name: object type}, list of used materials)
+    """
+    idf_path, variants, ep_dir, replace_csv_dir, atypical_materials = args
+    idf_file = read_idf(ep_dir, idf_path)
+    fields = get_idf_fields(idf_file)
+    unknown_materials = {}
+    used_materials = []
+    for replace_dict, archetype in variants:
+        reset_idf_fields(fields)
+        idf_file = apply_replacements(idf_file, replace_dict, archetype, replace_csv_dir)
+        unknown_materials.update(find_unknown_atypical_materials(idf_file, atypical_materials))
+        constr_names = set(obj.Construction_Name for element_type in material.element_types
+                           for obj in idf_file.idfobjects[element_type.upper()])
+        for construction in idf_file.idfobjects['Construction'.upper()]:
+            if construction.Name in constr_names:
+                used_materials.extend(material.extract_layers(construction).values())
+        for obj_type in ['Construction:FfactorGroundFloor', 'Construction:CfactorUndergroundWall']:
+            for obj in idf_file.idfobjects[obj_type.upper()]:
+                if obj.Name in constr_names:
+                    used_materials.extend(material.add_ground_floor_ffactor_cfactor({}, obj, replace_dict)[obj.Name])
+    return idf_path, unknown_materials, list(dict.fromkeys(used_materials))
+
+
 def aggregate_energy(batch_sim=None, last_run=False, folders=None, unit='MJ'):
     """
     Reads the EnergyPlus result file 'eplusout.csv' and aggregates the results (sums the column)
@@ -501,6 +1004,31 @@ def aggregate_energy(batch_sim=None, last_run=False, folders=None, unit='MJ'):
             raise Exception('Folders not given')
     else:
         folders = [batch_sim[sim]['run_folder'] for sim in batch_sim]
+    for folder in folders:
+        df_results = aggregate_energy_single(folder, unit)
+    return df_results
+
+
+def aggregate_energy_single(folder, unit='MJ'):
+    """
+    Aggregates the EnergyPlus results of one simulation folder and saves them to 'energy_demand.csv'
+    :param folder: simulation folder with the file 'eplusout.csv'
+    :param unit: energy units in the output file - kWh, J or MJ (default)
+    :returns: df_results
+    """
+    df_results = calc_energy_demand(folder, unit)
+    df_results.to_csv(os.path.join(folder, 'energy_demand.csv'), index=False)
+    return df_results
+
+
+def calc_energy_demand(folder, unit='MJ'):
+    """
+    Reads the EnergyPlus result file 'eplusout.csv' of one simulation folder and sums up the annual energy demand. If
+    the folder contains 'eplusout.sql' (see settings.sqlite), the meters are read from the database instead.
+    :param folder: simulation folder with the file 'eplusout.csv' or 'eplusout.sql'
+    :param unit: energy units in the output file - kWh, J or MJ (default)
+    :returns: df_results: dataframe with the columns 'EnergyPlus output variable', 'Unit' and 'Value'
+    """
     units = ['J', 'MJ', 'kWh']
     if unit is None:
         unit = 'MJ'
@@ -510,29 +1038,28 @@ def aggregate_energy(batch_sim=None, last_run=False, folders=None, unit='MJ'):
     multipliers = [1, 1/10**6, 1/(3.6*10**6)]
     multiplier = multipliers[units.index(unit)]
     # Note the trailing whitespace at the end of "InteriorEquipment:Electricity [J](Hourly) "
-    variables = ("Heating:EnergyTransfer [J](Annual)", "Cooling:EnergyTransfer [J](Annual)",
-                 "InteriorLights:Electricity [J](Annual)", "InteriorEquipment:Electricity [J](Annual)")
-    for folder in folders:
-        ep_file = os.path.join(folder, 'eplusout.csv')
+    variables = energy.energy_variables
+    sql_file = os.path.join(folder, 'eplusout.sql')
+    ep_file = os.path.join(folder, 'eplusout.csv')
+    if os.path.exists(sql_file):
+        df_results = energy.read_sql_meters(sql_file, variables)*multiplier
+    else:
         if os.path.getsize(ep_file)/10**6 > 185:
             print(f'The size of the file "eplusout.csv" located in {folder} is over 185 MB because of a large number '
                   f'of "Output:Variable" and "Output:Meter" objects requested in the idf file. '
                   f'\n This might cause the aggregated energy calculated below to be zero '
                   f'as some values might not be printed out due to overflow. '
                   f'\n Please consider removing some of the idf file output objects to fix this issue.')
-        ep_out = pd.read_csv(ep_file)
-        results_to_collect = [col for col in ep_out.columns for v in variables if col.startswith(v)]
-        df_results = ep_out.loc[:, results_to_collect].sum()*multiplier
-        df_results.index = [i.split(' [')[0] for i in df_results.index]
-        df_results = df_results.reset_index()
-        cols = list(df_results.columns)
-        new_cols = ['EnergyPlus output variable', 'Value']
-        df_results = df_results.rename(columns={k: new_cols[i] for i, k in enumerate(cols)})
-        df_results['Unit'] = unit
-        df_results = df_results[['EnergyPlus output variable', 'Unit', 'Value']]
-        total = pd.DataFrame([['TOTAL', unit, df_results['Value'].sum()]], columns=df_results.columns)
-        df_results = pd.concat([df_results, total], ignore_index=True)
-        df_results.to_csv(os.path.join(folder, 'energy_demand.csv'), index=False)
+        df_results = energy.sum_eplusout_columns(ep_file, variables)*multiplier
+    df_results.index = [i.split(' [')[0] for i in df_results.index]
+    df_results = df_results.reset_index()
+    cols = list(df_results.columns)
+    new_cols = ['EnergyPlus output variable', 'Value']
+    df_results = df_results.rename(columns={k: new_cols[i] for i, k in enumerate(cols)})
+    df_results['Unit'] = unit
+    df_results = df_results[['EnergyPlus output variable', 'Unit', 'Value']]
+    total = pd.DataFrame([['TOTAL', unit, df_results['Value'].sum()]], columns=df_results.columns)
+    df_results = pd.concat([df_results, total], ignore_index=True)
     return df_results
 
 
@@ -555,14 +1082,7 @@ def aggregate_materials(batch_sim=None, last_run=False, aggregation_categories=N
                 out_dir = folders[0]
             else:
                 out_dir = os.path.dirname(folders[0])
-            if os.path.exists(os.path.join(out_dir, 'aggregation_categories.csv')):
-                print(f'Aggregation categories automatically read from "aggregation_categories.csv" '
-                      f'located in "{out_dir}".')
-                aggregation_categories = pd.read_csv(os.path.join(out_dir, 'aggregation_categories.csv'), index_col=0)
-                aggregation_categories = aggregation_categories.T.to_dict(orient='list')
-                aggregation_categories = {k: v[0] for k, v in aggregation_categories.items()}
-            else:
-                aggregation_categories = {}
+            aggregation_categories = read_aggregation_categories_file(out_dir)
         elif type(aggregation_categories) == pd.core.frame.DataFrame:
             aggregation_categories = aggregation_categories.T.to_dict(orient='list')
             aggregation_categories = {k: v[0] for k, v in aggregation_categories.items()}
@@ -572,51 +1092,119 @@ def aggregate_materials(batch_sim=None, last_run=False, aggregation_categories=N
         folders = [batch_sim[sim]['run_folder'] for sim in batch_sim]
     unknown_materials = []
     for folder in folders:
-        df = pd.read_csv(os.path.join(folder, 'mat_demand.csv'))
-        mapping = df['Material name'].map(aggregation_categories)
-        df['Material type'] = mapping
-        unknown_materials = unknown_materials + df[df['Material type'].isna()]['Material name'].values.tolist()
-        df['Material type'] = df['Material type'].replace(np.nan, '?')
-        df = df[['Material name', 'Material type', 'Unit', 'Value']]
-        filename = os.path.join(folder, 'mat_demand_categorized.csv')
-        df.to_csv(filename, index=False)
-        df = df.drop(columns='Material name')
-        df = df.groupby(['Material type', 'Unit']).sum()
-        df = df.reset_index()
-        total = pd.DataFrame([['TOTAL', 'kg', df['Value'].sum()]], columns=df.columns)
-        df = pd.concat([df, total], ignore_index=True)
-        filename = os.path.join(folder, 'mat_demand_aggregated.csv')
-        df.to_csv(filename, index=False)
+        unknown_materials = unknown_materials + aggregate_materials_single(folder, aggregation_categories)
     unknown_materials = list(set(unknown_materials))  # deleting duplicates
     if unknown_materials:
         if batch_sim is None:
-            df = pd.DataFrame({'material category': ['?']}, index=unknown_materials)
-            if os.path.exists(os.path.join(out_dir, 'aggregation_categories.csv')):
-                df_old = pd.read_csv(os.path.join(out_dir, 'aggregation_categories.csv'), index_col=0)
-                df = pd.concat([df_old, df])
-            df.to_csv(os.path.join(out_dir, 'aggregation_categories.csv'))
-            print(f'The following materials were not found in the material aggregation dictionary: '
-                  f'\n {unknown_materials}'
-                  f'\n These materials were added to file "aggregation_categories.csv" located in "{out_dir}".'
-                  f"\n Unless the aggregation category is specified, "
-                  f" these materials will continue to be classified as '?'.")
+            add_unknown_categories_to_file(unknown_materials, out_dir)
         else:
-            wb = openpyxl.load_workbook(filename=settings.config_file)
-            ws = wb['material aggregation']
-            last_row = ws.max_row
-            c = 1
-            for i in unknown_materials:
-                ws.cell(column=3, row=last_row + c, value=i)
-                ws.cell(column=4, row=last_row + c, value='?')
-                c += 1
-            wb.save(filename=settings.config_file)
-            wb.close()
-            print(f'The following materials were not found in the material aggregation dictionary: '
-                  f'\n {unknown_materials}'
-                  f"\n These materials were added in sheet 'material aggregation' of the file"
-                  f"{os.path.basename(settings.config_file)}. "
-                  f"\n Unless the aggregation category is specified,"
-                  f" these materials will continue to be classified as '?'.")
+            add_unknown_categories_to_config(unknown_materials)
+    return
+
+
+def read_aggregation_categories_file(out_dir):
+    """
+    Reads the aggregation categories of standalone simulation folders from the file 'aggregation_categories.csv'
+    :param out_dir: folder with the file 'aggregation_categories.csv'
+    :return: dict with materials and their aggregation categories (empty if the file does not exist)
+    """
+    if not os.path.exists(os.path.join(out_dir, 'aggregation_categories.csv')):
+        return {}
+    print(f'Aggregation categories automatically read from "aggregation_categories.csv" '
+          f'located in "{out_dir}".')
+    aggregation_categories = pd.read_csv(os.path.join(out_dir, 'aggregation_categories.csv'), index_col=0)
+    aggregation_categories = aggregation_categories.T.to_dict(orient='list')
+    return {k: v[0] for k, v in aggregation_categories.items()}
+
+
+def add_unknown_categories_to_file(unknown_materials, out_dir):
+    """
+    Adds materials without an aggregation category to the file 'aggregation_categories.csv' (used for standalone
+    simulation folders instead of the config file)
+    :param unknown_materials: list of material names
+    :param out_dir: folder with the file 'aggregation_categories.csv'
+    """
+    df = pd.DataFrame({'material category': ['?']}, index=unknown_materials)
+    if os.path.exists(os.path.join(out_dir, 'aggregation_categories.csv')):
+        df_old = pd.read_csv(os.path.join(out_dir, 'aggregation_categories.csv'), index_col=0)
+        df = pd.concat([df_old, df])
+    df.to_csv(os.path.join(out_dir, 'aggregation_categories.csv'))
+    print(f'The following materials were not found in the material aggregation dictionary: '
+          f'\n {unknown_materials}'
+          f'\n These materials were added to file "aggregation_categories.csv" located in "{out_dir}".'
+          f"\n Unless the aggregation category is specified, "
+          f" these materials will continue to be classified as '?'.")
+    return
+
+
+def aggregate_materials_single(folder, aggregation_categories):
+    """
+    Aggregates the material results of one simulation folder into 'mat_demand_categorized.csv' and
+    'mat_demand_aggregated.csv'
+    :param folder: simulation folder with the file 'mat_demand.csv'
+    :param aggregation_categories: dict with materials and their aggregation categories
+    :returns: list of materials without an aggregation category
+    """
+    df = pd.read_csv(os.path.join(folder, 'mat_demand.csv'))
+    df_categorized, df_aggregated, unknown_materials = categorize_materials(df, aggregation_categories)
+    df_categorized.to_csv(os.path.join(folder, 'mat_demand_categorized.csv'), index=False)
+    df_aggregated.to_csv(os.path.join(folder, 'mat_demand_aggregated.csv'), index=False)
+    return unknown_materials
+
+
+def categorize_materials(df, aggregation_categories):
+    """
+    Assigns the aggregation categories to the materials of a material demand table and sums them up by category
+    :param df: dataframe with the material demand ('mat_demand.csv')
+    :param aggregation_categories: dict with materials and their aggregation categories
+    :returns: df_categorized: dataframe with the material demand and the category of each material
+    :returns: df_aggregated: dataframe with the material demand by category (incl. the total)
+    :returns: list of materials without an aggregation category
+    """
+    df = df.copy()
+    mapping = df['Material name'].map(aggregation_categories)
+    df['Material type'] = mapping
+    unknown_materials = df[df['Material type'].isna()]['Material name'].values.tolist()
+    df['Material type'] = df['Material type'].replace(np.nan, '?')
+    df_categorized = df[['Material name', 'Material type', 'Unit', 'Value']]
+    df = df_categorized.drop(columns='Material name')
+    df = df.groupby(['Material type', 'Unit']).sum()
+    df = df.reset_index()
+    total = pd.DataFrame([['TOTAL', 'kg', df['Value'].sum()]], columns=df.columns)
+    df_aggregated = pd.concat([df, total], ignore_index=True)
+    return df_categorized, df_aggregated, unknown_materials
+
+
+def add_unknown_categories_to_config(unknown_materials):
+    """
+    Adds materials without an aggregation category to the sheet 'material aggregation' of the config file (unless
+    they are already in the sheet) and classifies them as '?' in settings.material_aggregation, so that they are only
+    added once per run
+    :param unknown_materials: list of material names
+    """
+    for mat in unknown_materials:
+        settings.material_aggregation.setdefault(mat, '?')
+    wb = openpyxl.load_workbook(filename=settings.config_file)
+    ws = wb['material aggregation']
+    last_row = ws.max_row
+    in_sheet = set(ws.cell(column=3, row=row).value for row in range(1, last_row + 1))
+    unknown_materials = [mat for mat in unknown_materials if mat not in in_sheet]
+    if not unknown_materials:
+        wb.close()
+        return
+    c = 1
+    for i in unknown_materials:
+        ws.cell(column=3, row=last_row + c, value=i)
+        ws.cell(column=4, row=last_row + c, value='?')
+        c += 1
+    wb.save(filename=settings.config_file)
+    wb.close()
+    print(f'The following materials were not found in the material aggregation dictionary: '
+          f'\n {unknown_materials}'
+          f"\n These materials were added in sheet 'material aggregation' of the file"
+          f"{os.path.basename(settings.config_file)}. "
+          f"\n Unless the aggregation category is specified,"
+          f" these materials will continue to be classified as '?'.")
     return
 
 
@@ -644,29 +1232,191 @@ def calculate_intensities(batch_sim=None, last_run=False, results=None, folders=
     else:
         folders = [batch_sim[sim]['run_folder'] for sim in batch_sim]
     for folder in folders:
-        if ref_area in [int, float]:
-            area = ref_area
+        calculate_intensities_single(folder, results, ref_area)
+    return
+
+
+def calculate_intensities_single(folder, results, ref_area='total_floor_area'):
+    """
+    Calculates intensities of the results of one simulation folder
+    :param folder: simulation folder
+    :param results: the names of csv files with energy and material results
+    :param ref_area: reference area (see calculate_intensities())
+    """
+    if type(ref_area) in [int, float]:
+        area = ref_area
+    else:
+        try:
+            df_geom = pd.read_csv(os.path.join(folder, 'geom_stats.csv'))
+        except FileNotFoundError as e:
+            raise Exception('No geometry data available. Please perform material calculations first.') from e
+        area = get_reference_area(df_geom, ref_area)
+    for name in results:
+        new_name = name.replace('.csv', '_m2.csv')
+        try:
+            df = pd.read_csv(os.path.join(folder, name))
+        except FileNotFoundError:
+            pass
         else:
-            try:
-                df_geom = pd.read_csv(os.path.join(folder, 'geom_stats.csv'), index_col='Geometry statistics')
-            except FileNotFoundError as e:
-                raise Exception('No geometry data available. Please perform material calculations first.') from e
-            # df_geom.index = df_geom['Geometry statistics']
-            area = df_geom.loc[ref_area].Value
-        for name in results:
-            new_name = name.replace('.csv', '_m2.csv')
-            try:
-                df = pd.read_csv(os.path.join(folder, name))
-            except FileNotFoundError:
-                pass
-            else:
-                df['Value'] = df['Value']/float(area)
-                df['Unit'] = df['Unit']+'/m2'
-                df.to_csv(os.path.join(folder, new_name), index=False)
+            calc_intensity(df, area).to_csv(os.path.join(folder, new_name), index=False)
     return
 
 
-def collect_results(batch_sim=None, last_run=False, results=None, folders=None, combinations=None):
+def get_reference_area(df_geom, ref_area='total_floor_area'):
+    """
+    Gets the reference area of a simulation from its geometry statistics
+    :param df_geom: dataframe with the geometry statistics ('geom_stats.csv')
+    :param ref_area: reference area (see calculate_intensities()), numbers are returned as they are
+    :returns: reference area (m2)
+    """
+    if type(ref_area) in [int, float]:
+        return ref_area
+    return df_geom.set_index('Geometry statistics').loc[ref_area].Value
+
+
+def calc_intensity(df, area):
+    """
+    Divides the results by the reference area
+    :param df: dataframe with the columns 'Unit' and 'Value'
+    :param area: reference area (m2)
+    :returns: dataframe with the intensities
+    """
+    df = df.copy()
+    df['Value'] = df['Value']/float(area)
+    df['Unit'] = df['Unit']+'/m2'
+    return df
+
+
+def postprocess(batch_sim=None, last_run=False, folders=None, run_eplus=True, run_materials=True, unit='kWh',
+                ref_area='total_floor_area', combinations=None, write_files=True, material_summaries=False,
+                material_factors=None, energy_factors=None):
+    """
+    Post-processes the simulations in parallel with postprocess_single() and saves the summary files from the results
+    in memory (replaces aggregate_energy(), aggregate_materials(), calculate_intensities() and collect_results())
+    :param batch_sim: dictionary with batch simulation information
+    :param last_run: True if the last simulation run should be loaded
+    :param folders: a list of directories (required only when batch_sim is None)
+    :param run_eplus: True if energy results are available (default: True)
+    :param run_materials: True if material results are available (default: True)
+    :param unit: energy units in the output file - kWh (default), J or MJ
+    :param ref_area: reference area for intensities (see calculate_intensities())
+    :param combinations: a dictionary with the selected BuildME aspects and their values
+    :param write_files: True if the results should also be saved in the simulation folders (default: True)
+    :param material_summaries: True if 'summary_mat_demand.csv' and 'summary_mat_demand_categorized.csv' should also be
+        saved (default: False, see store.save_summaries())
+    :param material_factors: impact factors per material and/or aggregation category, see impact.calculate_impacts()
+        (optional)
+    :param energy_factors: impact factors per energy variable, see impact.calculate_impacts() (optional)
+    """
+    print("Post-processing the simulation results...")
+    if last_run:
+        batch_sim = batch.find_and_load_last_run()
+    if combinations is None:
+        combinations = settings.debug_combinations
+    aspect_names = ['region'] + list(list(combinations.values())[0].keys())
+    if batch_sim is None:
+        if folders is None:
+            raise Exception('Folders not given')
+        # as in aggregate_materials(), the aggregation categories of standalone folders are kept in the file
+        #  'aggregation_categories.csv' instead of the config file
+        out_dir = folders[0] if len(folders) == 1 else os.path.dirname(folders[0])
+        aggregation_categories = read_aggregation_categories_file(out_dir)
+    else:
+        folders = [batch_sim[sim]['run_folder'] for sim in batch_sim]
+        aggregation_categories = settings.material_aggregation
+    parent_dir = os.path.dirname(folders[0])
+    hourly = run_eplus and settings.hourly_profiles
+    args = [(folder, run_eplus, run_materials, unit, ref_area, aggregation_categories, write_files, hourly)
+            for folder in folders]
+    results_store = store.open_store(parent_dir)
+    if hourly:
+        profile_store = profiles.open_profile_store(parent_dir, aspect_names)
+    unknown_materials = []
+    with mp.Pool(processes=find_cpus()) as pool:
+        for folder, (dfs, unknown) in zip(folders, tqdm(pool.imap(postprocess_mp, args, chunksize=8),
+                                                        total=len(args), smoothing=0.1, unit='sim')):
+            unknown_materials.extend(unknown)
+            if hourly:
+                profiles.append_profile(profile_store, os.path.basename(folder), dfs.pop('hourly_profile'))
+            for name, df in dfs.items():
+                store.append_results(results_store, name, os.path.basename(folder), df)
+    store.flush_store(results_store)
+    if hourly:
+        profiles.flush_profiles(profile_store)
+    store.save_summaries(parent_dir, list(results_store['buffers']), aspect_names,
+                         material_summaries=material_summaries)
+    if run_materials:
+        save_material_matrix_from_store(parent_dir, aspect_names, aggregation_categories)
+    unknown_materials = list(dict.fromkeys(unknown_materials))
+    if unknown_materials:
+        if batch_sim is None:
+            add_unknown_categories_to_file(unknown_materials, out_dir)
+        else:
+            add_unknown_categories_to_config(unknown_materials)
+    if material_factors is not None or energy_factors is not None:
+        impact.calculate_impacts(folder=parent_dir, material_factors=material_factors, energy_factors=energy_factors,
+                                 combinations=combinations)
+    return
+
+
+def postprocess_mp(args):
+    """
+    Post-processes one simulation folder (with multiprocessing), see postprocess_single()
+    :param args: arguments of postprocess_single() as a tuple
+    :returns: see postprocess_single()
+    """
+    return postprocess_single(*args)
+
+
+def postprocess_single(folder, run_eplus=True, run_materials=True, unit='kWh', ref_area='total_floor_area',
+                       aggregation_categories=None, write_files=True, hourly=False):
+    """
+    Post-processes one simulation folder in a single pass: each source file ('eplusout.csv', 'mat_demand.csv' and
+    'geom_stats.csv') is read once and the energy demand, the categorized and aggregated material demand and all
+    intensities are calculated in memory. If the folder contains 'eplusout.sql', the end-use breakdown and the zone
+    sizing are also read ('energy_end_uses.csv' and 'zone_sizing.csv').
+    :param folder: simulation folder
+    :param run_eplus: True if energy results are available
+    :param run_materials: True if material results are available
+    :param unit: energy units in the output file - kWh, J or MJ
+    :param ref_area: reference area for intensities (see calculate_intensities())
+    :param aggregation_categories: dict with materials and their aggregation categories (default: from config)
+    :param write_files: True if the results should be saved in the simulation folder (default: True)
+    :param hourly: True if the hourly profile should be read, see profiles.read_profile() (default: False)
+    :returns: dfs: dictionary like {result name: dataframe} with the results, e.g. {'mat_demand.csv': ...}; in the
+        hourly profile mode, the hours x meters array of the profile is added as 'hourly_profile'
+    :returns: unknown_materials: list of materials without an aggregation category
+    """
+    if aggregation_categories is None:
+        aggregation_categories = settings.material_aggregation
+    dfs = {}
+    unknown_materials = []
+    if run_eplus:
+        dfs['energy_demand.csv'] = calc_energy_demand(folder, unit)
+        sql_file = os.path.join(folder, 'eplusout.sql')
+        if os.path.exists(sql_file):
+            dfs['energy_end_uses.csv'] = energy.read_sql_end_uses(sql_file)
+            dfs['zone_sizing.csv'] = energy.read_sql_zone_sizing(sql_file)
+        if hourly:
+            dfs['hourly_profile'] = profiles.read_profile(folder)
+    if run_materials:
+        dfs['geom_stats.csv'] = pd.read_csv(os.path.join(folder, 'geom_stats.csv'), float_precision='round_trip')
+        dfs['mat_demand.csv'] = pd.read_csv(os.path.join(folder, 'mat_demand.csv'), float_precision='round_trip')
+        dfs['mat_demand_categorized.csv'], dfs['mat_demand_aggregated.csv'], unknown_materials = \
+            categorize_materials(dfs['mat_demand.csv'], aggregation_categories)
+        area = get_reference_area(dfs['geom_stats.csv'], ref_area)
+        for name in ['energy_demand.csv', 'mat_demand.csv', 'mat_demand_aggregated.csv']:
+            if name in dfs:
+                dfs[name.replace('.csv', '_m2.csv')] = calc_intensity(dfs[name], area)
+    if write_files:
+        for name, df in dfs.items():
+            if name not in ['geom_stats.csv', 'mat_demand.csv', 'hourly_profile']:
+                df.to_csv(os.path.join(folder, name), index=False)
+    return dfs, unknown_materials
+
+
+def collect_results(batch_sim=None, last_run=False, results=None, folders=None, combinations=None,
+                    material_summaries=False):
     """
     Collect results from multiple simulations into one summary file
     :param batch_sim: dictionary with batch simulation information
@@ -674,11 +1424,13 @@ def collect_results(batch_sim=None, last_run=False, results=None, folders=None,
     :param results: the names of csv files with energy and material results
     :param folders: a list of directories (required only when batch_sim is None)
     :param combinations: a dictionary with the selected BuildME aspects and their values
+    :param material_summaries: True if 'summary_mat_demand.csv' and 'summary_mat_demand_categorized.csv' should also be
+        saved (default: False, the material demand is saved as matrix instead, see store.save_summaries())
     """
     if results is None:
         results = ['energy_demand.csv', 'geom_stats.csv', 'mat_demand.csv', 'mat_demand_categorized.csv',
                    'mat_demand_aggregated.csv', 'energy_demand_m2.csv', 'mat_demand_aggregated_m2.csv',
-                   'mat_demand_m2.csv']
+                   'mat_demand_m2.csv', 'energy_end_uses.csv', 'zone_sizing.csv']
     if last_run:
         batch_sim = batch.find_and_load_last_run()
     if combinations is None:
@@ -690,24 +1442,29 @@ def collect_results(batch_sim=None, last_run=False, results=None, folders=None,
     else:
         folders = [batch_sim[sim]['run_folder'] for sim in batch_sim]
     parent_dir = os.path.dirname(folders[0])
-    for name in results:
-        summary_name = 'summary_'+name
-        summary_df = pd.DataFrame()
-        flag = True
-        for folder in folders:
-            try:
-                df = pd.read_csv(os.path.join(folder, name))
-            except FileNotFoundError:
-                flag = False
-                break
-            df['Building name'] = os.path.basename(folder)
-            summary_df = pd.concat([summary_df, df])
-        if flag:
-            summary_df.index = pd.MultiIndex.from_tuples(tuple(summary_df['Building name'].str.split('_')))
-            summary_df.index.names = aspect_names
-            summary_df = summary_df[['Building name']+list(summary_df.columns[:-1])]
-            filename = os.path.join(parent_dir, summary_name)
-            summary_df.to_csv(filename)
+    # only the results available for all simulations are collected
+    results = [name for name in results if all(os.path.exists(os.path.join(folder, name)) for folder in folders)]
+    results_store = store.open_store(parent_dir)
+    for folder in folders:
+        store.append_folder(results_store, folder, results)
+    store.flush_store(results_store)
+    store.save_summaries(parent_dir, results, aspect_names, material_summaries=material_summaries)
+    if 'mat_demand.csv' in results:
+        save_material_matrix_from_store(parent_dir, aspect_names)
+    return
+
+
+def save_material_matrix_from_store(parent_dir, aspect_names, aggregation_categories=None):
+    """
+    Saves the material demand matrix of a batch simulation from its results store, see results.py
+    :param parent_dir: batch simulation folder
+    :param aspect_names: names of the BuildME aspects, e.g., ['region', 'occupation', ...]
+    :param aggregation_categories: dict with materials and their aggregation categories (default: from config)
+    """
+    matrix = results.make_material_matrix_from_store(parent_dir, aspect_names,
+                                                     aggregation_categories=aggregation_categories)
+    if matrix is not None:
+        results.save_material_matrix(matrix, parent_dir)
     return
 
 
@@ -0,0 +1,209 @@
+"""
+Energy and material demand of a building stock from the intensities of a batch simulation
+
+A floor-area table of the building stock (e.g. the projections of a stock model by region, occupation, cohort and
+year) is combined with the energy and material intensities per m2 of the simulations ('energy_demand_m2.csv' and
+'mat_demand_aggregated_m2.csv' in the results store). The stock table is indexed by some of the BuildME aspects, e.g.
+'region', 'occupation' and 'en-std' for the cohort; the intensities of all simulations with the same values of these
+aspects are averaged over the climate regions, weighted by their shares (settings.climate_region_weight). The other
+aspects that are not in the stock table (e.g. 'res' or 'climate_scenario') are not averaged: if the batch simulation
+has several values of such an aspect, one of them needs to be selected. The results (stock
+aspects x years x energy variables and material categories) are one NumPy broadcast per scenario and are streamed into
+the results store ('results_store/stock_results/part-00000.npz', ...).
+"""
+import numpy as np
+import pandas as pd
+from BuildME import batch, settings, store
+
+# name of the stock results in the results store
+stock_name = 'stock_results.csv'
+# per m2 results used as intensities and the columns with their item names
+intensity_results = {'energy_demand_m2.csv': 'EnergyPlus output variable',
+                     'mat_demand_aggregated_m2.csv': 'Material type'}
+
+
+def read_stock(stock):
+    """
+    Reads a floor-area table of the building stock
+    :param stock: pandas dataframe in long format with columns named like the BuildME aspects (e.g. 'region',
+        'occupation'), 'year', 'scenario' (optional) and 'Value' (floor area in m2); the path to a csv file is also
+        accepted
+    :return: pandas dataframe
+    """
+    if isinstance(stock, str):
+        stock = pd.read_csv(stock)
+    missing = [col for col in ['year', 'Value'] if col not in stock.columns]
+    if missing:
+        raise Exception(f'The stock table has no column {missing}')
+    if 'scenario' not in stock.columns:
+        stock = stock.assign(scenario='default')
+    return stock
+
+
+def load_intensities(parent_dir, aspect_names, results=None):
+    """
+    Loads the per m2 results of all simulations from the results store into one matrix
+    :param parent_dir: batch simulation folder
+    :param aspect_names: names of the BuildME aspects, e.g., ['region', 'occupation', ...]
+    :param results: dictionary like {result name: item column} (default: intensity_results)
+    :return: pandas dataframe with the aspects of the simulations (index: building names)
+    :return: numpy array (simulations x items) with the intensities
+    :return: pandas dataframe with the 'Result', 'Item' and 'Unit' (per m2) of each item
+    """
+    if results is None:
+        results = intensity_results
+    dfs = {}
+    for name in results:
+        df = store.scan_results(parent_dir, name)
+        if df is None:
+            print(f'Warning: {name} not found in the results store, it is not used for the stock results')
+        else:
+            dfs[name] = df
+    if not dfs:
+        raise Exception(f'No intensities found in the results store of {parent_dir}')
+    sims = pd.Index(list(dict.fromkeys(str(sim) for df in dfs.values()
+                                       for sim in df['Building name'].cat.categories)))
+    matrices, items = [], []
+    for name, df in dfs.items():
+        item_col = results[name]
+        df = df[df[item_col] != 'TOTAL']
+        sim_codes = sims.get_indexer(df['Building name'].cat.categories.astype(str))[df['Building name'].cat.codes]
+        item_codes, item_names = pd.factorize(df[item_col].astype(str))
+        units = df.groupby(item_codes)['Unit'].first().astype(str)
+        values = np.bincount(sim_codes.astype(np.int64) * len(item_names) + item_codes, weights=df['Value'],
+                             minlength=len(sims) * len(item_names))
+        matrices.append(values.reshape(len(sims), len(item_names)))
+        items.append(pd.DataFrame({'Result': name.replace('_m2.csv', ''), 'Item': item_names,
+                                   'Unit': units.to_numpy()}))
+    aspects = batch.get_aspects(parent_dir, sims, aspect_names)
+    return pd.DataFrame(aspects, index=sims, columns=aspect_names), np.hstack(matrices), \
+        pd.concat(items, ignore_index=True)
+
+
+def calc_key_intensities(aspects, intensities, sim_codes, n_keys, climate_region_weight=None):
+    """
+    Averages the intensities of the simulations that belong to the same key of the stock table over the climate regions
+    (the simulations of a key must not differ in any other aspect, see calc_stock_results())
+    :param aspects: pandas dataframe with the aspects of the simulations, see load_intensities()
+    :param intensities: numpy array (simulations x items)
+    :param sim_codes: numpy array with the key of each simulation (-1 if the simulation is not in the stock table)
+    :param n_keys: number of keys of the stock table
+    :param climate_region_weight: dataframe with the columns 'region', 'climate_region' and 'share' (optional, default:
+        equal weights)
+    :return: numpy array (keys x items) with the average intensities
+    :return: numpy array with the sum of the weights of each key (0 if no simulation was found)
+    """
+    weights = np.ones(len(aspects))
+    if climate_region_weight is not None:
+        shares = climate_region_weight.set_index(['region', 'climate_region'])['share']
+        sim_shares = shares.reindex(pd.MultiIndex.from_frame(aspects[['region', 'climate_region']])).to_numpy()
+        if np.isnan(sim_shares[sim_codes >= 0]).any():
+            missing = aspects[['region', 'climate_region']][np.isnan(sim_shares) & (sim_codes >= 0)]
+            print(f'Warning: No climate region weight found for the following regions (their weight is set to 0): '
+                  f'\n {sorted(set(map(tuple, missing.to_numpy())))}')
+        weights = np.nan_to_num(sim_shares)
+    used = sim_codes >= 0
+    totals = np.zeros((n_keys, intensities.shape[1]))
+    np.add.at(totals, sim_codes[used], intensities[used] * weights[used, None])
+    weight_sums = np.bincount(sim_codes[used], weights=weights[used], minlength=n_keys)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nan_to_num(totals / weight_sums[:, None]), weight_sums
+
+
+def calc_stock_results(parent_dir, stock, combinations=None, climate_region_weight=None, group_by=None,
+                       results=None, selection=None):
+    """
+    Calculates the energy and material demand of a building stock (floor area x intensities) for all years and
+    scenarios of the stock table and streams them into the results store, one partition per scenario. With a table of
+    the floor area in use, the material results are the material stock; with a table of the new floor area (inflow),
+    they are the material inflows.
+    :param parent_dir: batch simulation folder
+    :param stock: floor-area table of the building stock, see read_stock()
+    :param combinations: a dictionary with the selected BuildME aspects and their values
+    :param climate_region_weight: dataframe with the columns 'region', 'climate_region' and 'share' used to average
+        the intensities over the climate regions (default: settings.climate_region_weight; not used if the stock
+        table has a column 'climate_region')
+    :param group_by: list of aspects of the stock table by which the results are summed up, e.g. ['region']
+        (default: all aspects of the stock table)
+    :param results: dictionary like {result name: item column} of the intensities (default: intensity_results)
+    :param selection: dictionary like {aspect: value} that selects the simulations by the aspects that are not in the
+        stock table, e.g. {'res': 'RES0', 'climate_scenario': '2015'}; required for each of these aspects (except
+        'climate_region') with several values in the batch simulation
+    :return: number of rows written into the results store
+    """
+    print("Calculating the stock results...")
+    if combinations is None:
+        combinations = settings.debug_combinations
+    aspect_names = ['region'] + list(list(combinations.values())[0].keys())
+    stock = read_stock(stock)
+    key_aspects = [a for a in aspect_names if a in stock.columns]
+    if not key_aspects:
+        raise Exception(f'The stock table has none of the aspects {aspect_names}')
+    if group_by is None:
+        group_by = key_aspects
+    elif any(a not in key_aspects for a in group_by):
+        raise Exception(f'The results can only be grouped by the aspects of the stock table {key_aspects}')
+    if 'climate_region' in key_aspects:
+        climate_region_weight = None
+    elif climate_region_weight is None:
+        climate_region_weight = settings.climate_region_weight
+    if selection is None:
+        selection = {}
+    if any(a not in aspect_names or a in key_aspects for a in selection):
+        raise Exception(f'Only the aspects that are not in the stock table can be selected '
+                        f'{[a for a in aspect_names if a not in key_aspects]}')
+    aspects, intensities, items = load_intensities(parent_dir, aspect_names, results)
+    # keys of the stock table, e.g. ('USA', 'SFH', 'standard'), and the key of each simulation
+    stock_codes, keys = pd.factorize(pd.MultiIndex.from_frame(stock[key_aspects].astype(str)))
+    sim_codes = keys.get_indexer(pd.MultiIndex.from_frame(aspects[key_aspects]))
+    for a, value in selection.items():
+        sim_codes[aspects[a].to_numpy() != str(value)] = -1
+    # only the climate regions are averaged, any other aspect needs to have one value per key
+    ambiguous = {a: sorted(set(aspects[a][sim_codes >= 0])) for a in aspect_names
+                 if a not in key_aspects + ['climate_region'] and len(set(aspects[a][sim_codes >= 0])) > 1}
+    if ambiguous:
+        raise Exception(f'The simulations have several values of the following aspects that are not in the stock '
+                        f'table: {ambiguous}. \n Add them to the stock table or select one value with the argument '
+                        f'selection, e.g. {dict((a, values[0]) for a, values in ambiguous.items())}')
+    key_intensities, weight_sums = calc_key_intensities(aspects, intensities, sim_codes, len(keys),
+                                                        climate_region_weight)
+    if (weight_sums == 0).any():
+        print(f'Warning: No simulations found for the following entries of the stock table (their results are set to '
+              f'0): \n {list(keys[weight_sums == 0])}')
+    # floor area as an array (keys x years x scenarios)
+    year_codes, years = pd.factorize(stock['year'], sort=True)
+    scenario_codes, scenarios = pd.factorize(stock['scenario'])
+    floor_area = np.zeros((len(keys), len(years), len(scenarios)))
+    np.add.at(floor_area, (stock_codes, year_codes, scenario_codes), stock['Value'].to_numpy(dtype=float))
+    # the keys are summed up into the groups with a matrix product (groups x keys)
+    group_levels = [keys.get_level_values(key_aspects.index(a)) for a in group_by]
+    group_codes, groups = pd.factorize(pd.MultiIndex.from_arrays(group_levels))
+    to_groups = np.zeros((len(groups), len(keys)))
+    to_groups[group_codes, np.arange(len(keys))] = 1
+    items['Unit'] = items['Unit'].str.replace('/m2', '', regex=False)
+    # the text columns of the results are created as categorical columns from the codes of the groups and items
+    columns = {a: pd.Categorical.from_codes(np.repeat(groups.codes[i], len(years) * len(items)),
+                                            categories=groups.levels[i]) for i, a in enumerate(group_by)}
+    columns['year'] = np.tile(np.repeat(years, len(items)), len(groups))
+    for col in ['Result', 'Item', 'Unit']:
+        codes, categories = pd.factorize(items[col])
+        columns[col] = pd.Categorical.from_codes(np.tile(codes, len(groups) * len(years)), categories=categories)
+    rows = 0
+    for s, scenario in enumerate(scenarios):
+        values = floor_area[:, :, s, None] * key_intensities[:, None, :]
+        df = pd.DataFrame(columns)
+        df.insert(len(group_by) + 1, 'scenario', pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8),
+                                                                          categories=[scenario]))
+        df['Value'] = (to_groups @ values.reshape(len(keys), -1)).ravel()
+        store.write_results(parent_dir, stock_name, df, clear=(s == 0))
+        rows += len(df)
+    return rows
+
+
+def load_stock_results(parent_dir):
+    """
+    Loads the stock results of a batch simulation from the results store
+    :param parent_dir: batch simulation folder
+    :return: pandas dataframe (or None if no stock results were calculated)
+    """
+    return store.scan_results(parent_dir, stock_name)
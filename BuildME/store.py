@@ -0,0 +1,211 @@
+"""
+Columnar results store of a batch simulation
+
+The result tables of the simulations (e.g. 'mat_demand.csv') are appended to the store of the batch simulation folder
+('results_store/<result name>/part-00000.npz', ...) as they are completed. The rows of many simulations are buffered
+and written as one partition, with the text columns (e.g. 'Building name', 'Material name') encoded as integer codes
+and a vocabulary. A summary table is created with one scan over the partitions; the BuildME aspects of the summary
+index are derived once per simulation instead of once per row.
+"""
+import glob
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from BuildME import batch
+
+# folder of the store in the batch simulation folder
+store_folder = 'results_store'
+# number of simulations per partition
+partition_size = 1000
+# long material tables, whose summary files are only saved on demand (see results.matrix_to_long())
+long_results = ['mat_demand.csv', 'mat_demand_categorized.csv']
+
+
+def open_store(parent_dir, size=partition_size, clear=True):
+    """
+    Opens the results store of a batch simulation for appending
+    :param parent_dir: batch simulation folder
+    :param size: number of simulations buffered before a partition is written
+    :param clear: True if the results already in the store should be deleted (default: True)
+    :return: dictionary with the store information and the buffered results
+    """
+    folder = os.path.join(parent_dir, store_folder)
+    if clear and os.path.exists(folder):
+        shutil.rmtree(folder)
+    return {'folder': folder, 'size': size, 'buffers': {}}
+
+
+def append_results(store, name, building_name, df):
+    """
+    Appends the results of one simulation to the store
+    :param store: results store, see open_store()
+    :param name: the name of the csv file with results, e.g., 'mat_demand.csv'
+    :param building_name: building name (folder name) of the simulation
+    :param df: dataframe with the results of the simulation
+    """
+    buffer = store['buffers'].setdefault(name, [])
+    buffer.append((building_name, df))
+    if len(buffer) >= store['size']:
+        flush_store(store, name)
+    return
+
+
+def append_folder(store, folder, names):
+    """
+    Reads result files of a simulation folder and appends them to the store
+    :param store: results store, see open_store()
+    :param folder: simulation folder
+    :param names: the names of the csv files with results
+    """
+    for name in names:
+        df = pd.read_csv(os.path.join(folder, name), float_precision='round_trip')
+        append_results(store, name, os.path.basename(folder), df)
+    return
+
+
+def flush_store(store, name=None):
+    """
+    Writes the buffered results into new partitions
+    :param store: results store, see open_store()
+    :param name: the name of the result to flush (default: all results)
+    """
+    names = list(store['buffers']) if name is None else [name]
+    for name in names:
+        buffer = store['buffers'].get(name)
+        if not buffer:
+            continue
+        folder = os.path.join(store['folder'], name.replace('.csv', ''))
+        os.makedirs(folder, exist_ok=True)
+        n = len(glob.glob(os.path.join(folder, 'part-*.npz')))
+        building_names, dfs = zip(*buffer)
+        df = pd.concat(dfs, ignore_index=True)
+        df['Building name'] = np.repeat(np.array(building_names, dtype=object), [len(x) for x in dfs])
+        write_partition(os.path.join(folder, 'part-%05d.npz' % n), df)
+        store['buffers'][name] = []
+    return
+
+
+def write_results(parent_dir, name, df, clear=False):
+    """
+    Writes a dataframe as a new partition of a result that is not split by simulation (e.g. stock results)
+    :param parent_dir: batch simulation folder
+    :param name: the name of the result, e.g., 'stock_results.csv'
+    :param df: dataframe
+    :param clear: True if the partitions already in the store should be deleted (default: False)
+    """
+    folder = os.path.join(parent_dir, store_folder, name.replace('.csv', ''))
+    if clear and os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder, exist_ok=True)
+    n = len(glob.glob(os.path.join(folder, 'part-*.npz')))
+    write_partition(os.path.join(folder, 'part-%05d.npz' % n), df)
+    return
+
+
+def write_partition(filename, df):
+    """
+    Writes a dataframe into a partition file, text columns are saved as codes and vocabulary (the codes of categorical
+    columns are used as they are)
+    :param filename: partition file
+    :param df: dataframe
+    """
+    arrays = {'columns': np.array(df.columns, dtype=str)}
+    for i, col in enumerate(df.columns):
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            arrays['c%d_vocab' % i] = np.array(df[col].cat.categories, dtype=str)
+            arrays['c%d_codes' % i] = df[col].cat.codes.to_numpy().astype(np.int32)
+            continue
+        values = df[col].to_numpy()
+        if values.dtype == object:
+            isnull = pd.isnull(values)
+            vocab, codes = np.unique(values[~isnull].astype(str), return_inverse=True)
+            all_codes = np.full(len(values), -1, dtype=np.int32)
+            all_codes[~isnull] = codes
+            arrays['c%d_vocab' % i] = vocab
+            arrays['c%d_codes' % i] = all_codes
+        else:
+            arrays['c%d_values' % i] = values
+    np.savez(filename, **arrays)
+    return
+
+
+def scan_results(parent_dir, name):
+    """
+    Reads all partitions of a result into one dataframe, text columns are returned as categorical columns
+    :param parent_dir: batch simulation folder
+    :param name: the name of the csv file with results, e.g., 'mat_demand.csv'
+    :return: pandas dataframe (or None if the store has no partitions of the result)
+    """
+    files = sorted(glob.glob(os.path.join(parent_dir, store_folder, name.replace('.csv', ''), 'part-*.npz')))
+    if not files:
+        return None
+    columns = None
+    parts = []
+    for filename in files:
+        with np.load(filename) as data:
+            if columns is None:
+                columns = [str(col) for col in data['columns']]
+            elif [str(col) for col in data['columns']] != columns:
+                raise Exception(f'The partitions of {name} in the results store have different columns')
+            parts.append({key: data[key] for key in data.files})
+    df = {}
+    for i, col in enumerate(columns):
+        if 'c%d_vocab' % i in parts[0]:
+            vocab = {}
+            codes = []
+            for part in parts:
+                mapping = np.array([vocab.setdefault(v, len(vocab)) for v in part['c%d_vocab' % i]] + [-1],
+                                   dtype=np.int32)
+                codes.append(mapping[part['c%d_codes' % i]])
+            df[col] = pd.Categorical.from_codes(np.concatenate(codes), categories=list(vocab))
+        else:
+            df[col] = np.concatenate([part['c%d_values' % i] for part in parts])
+    return pd.DataFrame(df, columns=columns)
+
+
+def load_summary(parent_dir, name, aspect_names, order=None):
+    """
+    Creates the summary table of a result (e.g. 'summary_mat_demand.csv') from the results store
+    :param parent_dir: batch simulation folder
+    :param name: the name of the csv file with results, e.g., 'mat_demand.csv'
+    :param aspect_names: names of the BuildME aspects, e.g., ['region', 'occupation', ...]
+    :param order: list of building names in the order of the summary (default: order of appending)
+    :return: pandas dataframe indexed by the aspects (or None if the store has no partitions of the result)
+    """
+    df = scan_results(parent_dir, name)
+    if df is None:
+        return None
+    sims = df['Building name'].cat
+    if order is not None:
+        rank = pd.Series(np.arange(len(order)), index=order).reindex(sims.categories).fillna(len(order))
+        df = df.iloc[np.argsort(rank.to_numpy()[sims.codes], kind='stable')]
+        sims = df['Building name'].cat
+    # the aspects are looked up once per simulation
+    aspects = batch.get_aspects(parent_dir, sims.categories, aspect_names)
+    index = []
+    for j in range(len(aspect_names)):
+        values = pd.Categorical(aspects[:, j])
+        index.append(pd.Categorical.from_codes(values.codes[sims.codes], categories=values.categories))
+    df.index = pd.MultiIndex.from_arrays(index, names=aspect_names)
+    return df[['Building name'] + [col for col in df.columns if col != 'Building name']]
+
+
+def save_summaries(parent_dir, names, aspect_names, order=None, material_summaries=False):
+    """
+    Saves the summary files (e.g. 'summary_energy_demand.csv') of the results in the store
+    :param parent_dir: batch simulation folder
+    :param names: the names of the csv files with results
+    :param aspect_names: names of the BuildME aspects, e.g., ['region', 'occupation', ...]
+    :param order: list of building names in the order of the summary (default: order of appending)
+    :param material_summaries: True if the summary files of the long material tables ('summary_mat_demand.csv' and
+        'summary_mat_demand_categorized.csv') should also be saved (default: False, the material demand is available
+        in the material demand matrix, see results.py)
+    """
+    if not material_summaries:
+        names = [name for name in names if name not in long_results]
+    for name in names:
+        summary_df = load_summary(parent_dir, name, aspect_names, order)
+        if summary_df is not None:
+            summary_df.to_csv(os.path.join(parent_dir, 'summary_' + name))
+    return
@@ -0,0 +1,302 @@
+"""
+Surrogate elements (basement, foundation, beams, columns, studs, roof beams and shear walls) compiled into arrays
+
+The "surrogate elements" sheet of the config file is compiled once into a surrogate table. The rows of a simulation are
+selected by occupation, region and BuildME aspects (en-std, res) and their material mass is calculated from the
+geometry statistics of the building (see material.get_building_geometry_stats()) for any number of simulations at once,
+e.g. for all simulations of a batch with calc_batch_surrogate_masses() (see simulate.calculate_materials_in_memory()).
+"""
+import numpy as np
+import pandas as pd
+
+# surrogate elements and their codes in the surrogate table
+element_codes = {'basement': 0, 'foundation': 1, 'beams': 2, 'columns': 3, 'studs': 4, 'roof_beams': 5,
+                 'shear_walls': 6}
+# columns used to select the surrogate elements of a simulation
+selection_columns = ['occupation', 'region', 'en-std', 'res']
+# geometry statistics used by the surrogate elements
+geometry_columns = ['footprint_area', 'footprint_perimeter', 'building_height', 'num_of_floors']
+# basement height (meters)
+room_h = 2.8
+# the footprint of the shear walls to the floor area
+shear_wall_ratio = 0.02
+# surrogate table of the config file, see get_surrogate_table()
+config_table = None
+
+
+def get_surrogate_table():
+    """
+    Returns the surrogate table of the config file (settings.surrogate_elements), which is compiled on the first call
+    :return: surrogate table, see compile_surrogate_table()
+    """
+    global config_table
+    if config_table is None:
+        from BuildME import settings
+        config_table = compile_surrogate_table(settings.surrogate_elements)
+    return config_table
+
+
+def parse_list(value, dtype=float):
+    """
+    Parses a cell of the surrogate elements sheet, e.g. '[0.98, 0.02]', 'Concrete_surrogate' or 2400
+    :param value: string, number or list
+    :param dtype: type of the list items
+    :return: list
+    """
+    if type(value) is str:
+        return [dtype(str(i).strip()) for i in value.replace('[', '').replace(']', '').split(',')]
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [dtype(i) for i in value]
+    return [value]
+
+
+def compile_surrogate_table(surrogates):
+    """
+    Compiles the surrogate elements into arrays. The material, share and density lists of each row are converted into
+    matrices (rows x materials), so that the material mass of all rows can be calculated at once.
+    :param surrogates: pandas dataframe with surrogate element information (as in settings.surrogate_elements) or a
+        dictionary like {'surrogate': {'height': ..., 'materials': ...}} (as created by convert_surrogates_df_to_dict())
+    :return: table: dictionary with the selection columns (0 = any value), the surrogate names, element codes
+        (-1 = unknown), multipliers (e.g. 'basement*2'), parameters (rows x [height, width, length, distance]), the list
+        of materials, the material shares and densities (rows x materials), the materials of each row and the rows
+        that are empty or invalid
+    """
+    if isinstance(surrogates, dict):
+        surrogates = pd.DataFrame.from_dict(surrogates, orient='index').rename_axis('surrogate').reset_index()
+        surrogates['surrogate'] = surrogates['surrogate'].astype(object)
+    surrogates = surrogates.reset_index(drop=True)
+    n = len(surrogates)
+    table = {'columns': {col: surrogates[col].to_numpy(dtype=object) for col in selection_columns
+                         if col in surrogates.columns},
+             'names': surrogates['surrogate'].astype(str).tolist(),
+             'element': np.full(n, -1, dtype=int),
+             'multiplier': np.ones(n),
+             'params': np.zeros((n, 4)),
+             'materials': [],
+             'row_materials': [],
+             'empty': np.zeros(n, dtype=bool),
+             'errors': {},
+             'selections': {}}
+    row_materials = []
+    for i, row in surrogates.iterrows():
+        name = table['names'][i]
+        if name.startswith('basement'):
+            table['element'][i] = element_codes['basement']
+            if '*' in name:
+                table['multiplier'][i] = float(name.split('*')[1])
+        elif name in element_codes:
+            table['element'][i] = element_codes[name]
+        params = [row.get(col, 0) for col in ['height', 'width', 'length', 'distance']]
+        table['params'][i] = [float(p) if p is not None else 0 for p in params]
+        cells = [row.get(col, 0) for col in ['materials', 'shares', 'densities']]
+        table['empty'][i] = all(not isinstance(v, (str, list, tuple, np.ndarray)) and v == 0 for v in params + cells)
+        if table['empty'][i]:
+            row_materials.append([])
+            continue
+        materials = parse_list(cells[0], str)
+        shares = parse_list(cells[1])
+        densities = parse_list(cells[2])
+        if shares == [0]:  # the cell was empty
+            shares = [1]
+        if not len(materials) == len(shares) == len(densities):
+            table['errors'][i] = 'The lengths of the provided material lists are not consistent'
+        elif sum(shares) != 1:
+            table['errors'][i] = 'The shares of the provided materials do not sum to 1'
+        row_materials.append(list(zip(materials, shares, densities)))
+        for mat in materials:
+            if mat not in table['materials']:
+                table['materials'].append(mat)
+    table['shares'] = np.zeros((n, len(table['materials'])))
+    table['densities'] = np.zeros((n, len(table['materials'])))
+    for i, items in enumerate(row_materials):
+        table['row_materials'].append([table['materials'].index(mat) for mat, share, density in items])
+        if i not in table['errors']:
+            for mat, share, density in items:
+                table['shares'][i, table['materials'].index(mat)] = float(share)
+                table['densities'][i, table['materials'].index(mat)] = float(density)
+    return table
+
+
+def select_surrogates(table, occupation, replace_dict=None, region=None):
+    """
+    Selects the surrogate elements of a simulation. A row is selected if its occupation matches and its region,
+    en-std and res match or are empty (0). If a surrogate element is selected several times, the first row is kept.
+    Empty rows and unknown elements are skipped. The selections are cached in the table.
+    :param table: surrogate table, see compile_surrogate_table()
+    :param occupation: archetype name
+    :param replace_dict: dictionary with BuildME replacement aspects
+    :param region: name of the region (only used if the table has a "region" column)
+    :return: tuple with the selected rows
+    """
+    key = (occupation, region, None if replace_dict is None else tuple(replace_dict.items()))
+    if key in table['selections']:
+        return table['selections'][key]
+    columns = table['columns']
+    mask = columns['occupation'] == occupation if 'occupation' in columns else np.ones(len(table['names']), bool)
+    if region is not None and 'region' in columns:
+        mask &= (columns['region'] == region) | (columns['region'] == 0)
+    if replace_dict is not None:
+        for k, v in replace_dict.items():
+            if k in columns:
+                mask &= (columns[k] == v) | (columns[k] == 0)
+    rows = []
+    names = []
+    for i in np.where(mask)[0]:
+        if table['names'][i] not in names:
+            names.append(table['names'][i])
+            rows.append(int(i))
+    if len(rows) < mask.sum():
+        print('Warning: duplicates found in the "surrogates" dataframe. Only the first entry will be kept.')
+    if not rows:
+        print(f'Warning: No surrogate elements found for archetype {occupation} '
+              f'and aspects {replace_dict}. '
+              f'\n Surrogate element calculations will be skipped.')
+    table['selections'][key] = skip_rows(table, rows)
+    return table['selections'][key]
+
+
+def skip_rows(table, rows):
+    """
+    Removes the empty rows and the rows with unknown elements (with a warning) from a selection
+    :param table: surrogate table, see compile_surrogate_table()
+    :param rows: list with row numbers
+    :return: tuple with the remaining rows
+    """
+    selected = []
+    for i in rows:
+        if table['empty'][i]:
+            continue
+        elif table['element'][i] == -1:
+            print(f"Warning: surrogate element {table['names'][i]} not recognized")
+        elif i in table['errors']:
+            raise Exception(table['errors'][i])
+        else:
+            selected.append(i)
+    return tuple(selected)
+
+
+def compile_surrogates_dict(surrogates_dict):
+    """
+    Compiles the surrogate elements of one simulation into a surrogate table with the rows to be calculated
+    :param surrogates_dict: dictionary like {'surrogate': {'height': ..., 'materials': ...}} (as created by
+        simulate.convert_surrogates_df_to_dict())
+    :return: surrogate table, see compile_surrogate_table()
+    """
+    table = compile_surrogate_table(surrogates_dict)
+    return get_surrogate_rows(table, skip_rows(table, range(len(table['names']))))
+
+
+def get_surrogate_rows(table, rows):
+    """
+    Creates a surrogate table with the given rows only, e.g. the selection of one simulation. Its materials are sorted
+    in the order of their first appearance in the rows.
+    :param table: surrogate table, see compile_surrogate_table()
+    :param rows: list or tuple with the row numbers
+    :return: surrogate table
+    """
+    rows = list(rows)
+    mats = []
+    for i in rows:
+        for j in table['row_materials'][i]:
+            if j not in mats:
+                mats.append(j)
+    sub = {'columns': {col: values[rows] for col, values in table['columns'].items()},
+           'names': [table['names'][i] for i in rows],
+           'element': table['element'][rows],
+           'multiplier': table['multiplier'][rows],
+           'params': table['params'][rows],
+           'materials': [table['materials'][j] for j in mats],
+           'shares': table['shares'][rows][:, mats].reshape(len(rows), len(mats)),
+           'densities': table['densities'][rows][:, mats].reshape(len(rows), len(mats)),
+           'row_materials': [[mats.index(j) for j in table['row_materials'][i]] for i in rows],
+           'empty': table['empty'][rows],
+           'errors': {},
+           'selections': {}}
+    return sub
+
+
+def is_surrogate_table(surrogates):
+    """
+    Checks if the surrogate element information is a compiled surrogate table (and not a dictionary like
+    {'surrogate': {'height': ..., 'materials': ...}})
+    :param surrogates: surrogate element information
+    :return: boolean
+    """
+    return isinstance(surrogates, dict) and 'element' in surrogates and isinstance(surrogates['element'], np.ndarray)
+
+
+def calc_surrogate_volumes(element, params, geom):
+    """
+    Calculates the volume of surrogate elements:
+    - basement: floor slab and perimeter walls of the height room_h, both with the thickness 'height'
+    - foundation: footprint area x 'height'
+    - beams: beams along one side (perimeter / 4) of the building every 'distance' meters on each floor
+    - columns: columns of the building height every 'distance' meters along the perimeter
+    - studs: studs of the height 'height' every 'distance' meters along the perimeter on each floor
+    - roof_beams: beams along one side (perimeter / 4) of the building every 'distance' meters
+    - shear_walls: footprint of the shear walls of shear_wall_ratio to the floor area, over the building height
+      (based on: https://ascelibrary.org/doi/full/10.1061/(ASCE)ST.1943-541X.0000785)
+    The beams, columns, studs and roof beams have the cross-section 'width' x 'length'.
+    :param element: numpy array with the element codes (rows)
+    :param params: numpy array (rows x [height, width, length, distance])
+    :param geom: dictionary with numpy arrays of the geometry statistics of the building of each row
+    :return: volume: numpy array with the volumes (m3), floor_area: numpy array with the floor area of the basements
+    """
+    height, width, length, distance = params.T
+    area, perimeter = geom['footprint_area'], geom['footprint_perimeter']
+    side = perimeter / 4
+    # number of columns, beams etc. (no elements if the distance is zero)
+    safe_distance = np.where(distance == 0, 1, distance)
+    n_perimeter = np.where(distance == 0, 0, perimeter / safe_distance + 1)
+    n_side = np.where(distance == 0, 0, side / safe_distance + 1)
+    volumes = {element_codes['basement']: height * (area + perimeter * room_h),
+               element_codes['foundation']: area * height,
+               element_codes['beams']: n_side * (side * width * length) * geom['num_of_floors'],
+               element_codes['columns']: n_perimeter * (geom['building_height'] * width * length),
+               element_codes['studs']: n_perimeter * geom['num_of_floors'] * (height * width * length),
+               element_codes['roof_beams']: length * width * side * n_side,
+               element_codes['shear_walls']: geom['building_height'] * area * shear_wall_ratio}
+    volume = np.select([element == code for code in volumes], list(volumes.values()), 0.0)
+    floor_area = np.where(element == element_codes['basement'], area, 0.0)
+    return volume, floor_area
+
+
+def calc_surrogate_masses(table, geom_stats, rows=None, sims=None):
+    """
+    Calculates the material mass of surrogate elements for one or several simulations in one pass
+    :param table: surrogate table, see compile_surrogate_table()
+    :param geom_stats: dictionary with the geometry statistics of one building or pandas dataframe with one row per
+        simulation and the columns in geometry_columns
+    :param rows: numpy array with the table rows to be calculated (default: all rows)
+    :param sims: numpy array with the position of the simulation in geom_stats for each row (default: 0)
+    :return: mat_mass: numpy array (simulations x table materials) with the mass (kg),
+        floor_area: numpy array with the floor area added by the basements for each simulation (m2)
+    """
+    if isinstance(geom_stats, dict):
+        geom_stats = pd.DataFrame([geom_stats])
+    rows = np.arange(len(table['names'])) if rows is None else np.asarray(rows, dtype=int)
+    sims = np.zeros(len(rows), dtype=int) if sims is None else np.asarray(sims, dtype=int)
+    geom = {col: geom_stats[col].to_numpy(dtype=float)[sims] for col in geometry_columns}
+    volume, floor_area = calc_surrogate_volumes(table['element'][rows], table['params'][rows], geom)
+    multiplier = table['multiplier'][rows]
+    row_mass = volume[:, None] * table['shares'][rows] * table['densities'][rows] * multiplier[:, None]
+    mat_mass = np.zeros((len(geom_stats), len(table['materials'])))
+    np.add.at(mat_mass, sims, row_mass)
+    return mat_mass, np.bincount(sims, floor_area * multiplier, minlength=len(geom_stats))
+
+
+def calc_batch_surrogate_masses(table, selections, geom_stats):
+    """
+    Calculates the material mass of the surrogate elements of all simulations of a batch in one pass
+    :param table: surrogate table, see compile_surrogate_table()
+    :param selections: dictionary like {sim: rows} with the rows of each simulation (see select_surrogates())
+    :param geom_stats: pandas dataframe with the geometry statistics (index: simulations, columns: geometry_columns)
+    :return: mat_mass: pandas dataframe (simulations x materials) with the mass (kg), floor_area: pandas series with
+        the floor area added by the basements (m2)
+    """
+    geom_stats = geom_stats.loc[list(selections.keys())]
+    rows = np.array([i for sim_rows in selections.values() for i in sim_rows], dtype=int)
+    sims = np.repeat(np.arange(len(selections)), [len(sim_rows) for sim_rows in selections.values()])
+    mat_mass, floor_area = calc_surrogate_masses(table, geom_stats, rows, sims)
+    return (pd.DataFrame(mat_mass, index=geom_stats.index, columns=table['materials']),
+            pd.Series(floor_area, index=geom_stats.index, name='basement_floor_area'))
@@ -0,0 +1,256 @@
+"""
+Monte Carlo uncertainty analysis of the material demand
+
+The densities and thicknesses of the materials and the dimensions of the surrogate elements are sampled from
+distributions around their point values, either with one relative band for all inputs or with a band and distribution
+per material (or surrogate element). All samples of a building are evaluated at once with the matrices of the material
+demand calculation (see material.make_material_inputs()). The samples are kept as float32 arrays.
+"""
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from BuildME import material, settings, simulate, surrogate
+
+# percentiles saved for the material demand
+percentiles = [5, 25, 50, 75, 95]
+# available distributions of the relative factors
+distribution_types = ['uniform', 'normal', 'triangular']
+# result files of the uncertainty analysis
+result_files = ['mat_demand_samples.npz', 'mat_demand_uncertainty.csv', 'mat_demand_aggregated_uncertainty.csv']
+
+
+def sample_factors(rng, n_samples, bands, distributions):
+    """
+    Samples relative factors around 1, e.g. 0.9 to 1.1 for a band of 0.1 (negative factors are set to 0)
+    :param rng: numpy random generator
+    :param n_samples: number of samples
+    :param bands: list or numpy array with the band of each value; the half-width for 'uniform' and 'triangular'
+        distributions and the standard deviation for 'normal' distributions (relative to the point value)
+    :param distributions: list with the distribution of each value, see distribution_types
+    :return: numpy array (samples x values)
+    """
+    bands = np.asarray(bands, dtype=float)
+    factors = np.ones((n_samples, len(bands)))
+    for distribution in set(distributions):
+        cols = np.array([d == distribution for d in distributions])
+        shape = (n_samples, cols.sum())
+        if distribution == 'uniform':
+            factors[:, cols] += rng.uniform(-1, 1, shape) * bands[cols]
+        elif distribution == 'normal':
+            factors[:, cols] += rng.standard_normal(shape) * bands[cols]
+        elif distribution == 'triangular':
+            factors[:, cols] += rng.triangular(-1, 0, 1, shape) * bands[cols]
+        else:
+            raise Exception(f"Distribution '{distribution}' not known, use one of {distribution_types}")
+    return np.maximum(factors, 0)
+
+
+def get_bands(names, quantity, band=0.1, distributions=None, distribution='uniform'):
+    """
+    Looks up the band and distribution of each material or surrogate element
+    :param names: list with material or surrogate element names
+    :param quantity: 'density', 'thickness' or 'dimensions'
+    :param band: default band (e.g. 0.1 for +/-10%)
+    :param distributions: dictionary like {'material1': {'distribution': 'normal', 'density': 0.05, 'thickness': 0.1},
+        'columns': {'dimensions': 0.05}} with the bands that differ from the default (optional)
+    :param distribution: default distribution, see distribution_types
+    :return: bands: list with the bands, types: list with the distributions
+    """
+    if distributions is None:
+        distributions = {}
+    bands = [distributions.get(name, {}).get(quantity, band) for name in names]
+    types = [distributions.get(name, {}).get('distribution', distribution) for name in names]
+    return bands, types
+
+
+def get_material_names(inputs, surrogates=None):
+    """
+    Lists the materials of a building: the materials of the constructions followed by the materials of the surrogate
+    elements that are not used in the constructions
+    :param inputs: material inputs of the building, see material.make_material_inputs()
+    :param surrogates: surrogate table with the surrogate elements of the building or None
+    :return: list with the material names
+    """
+    mat_names = list(inputs['mat_names'])
+    if surrogates is not None:
+        mat_names += [mat for mat in surrogates['materials'] if mat not in mat_names]
+    return mat_names
+
+
+def calc_sample_masses(inputs, surrogates, thickness_factors, density_factors, dimension_factors):
+    """
+    Calculates the material mass of a building (incl. surrogate elements) for all samples at once
+    :param inputs: material inputs of the building, see material.make_material_inputs()
+    :param surrogates: surrogate table with the surrogate elements of the building (see surrogate.get_surrogate_rows())
+        or None
+    :param thickness_factors: numpy array (samples x building materials)
+    :param density_factors: numpy array (samples x materials), the building materials followed by the surrogate
+        materials that are not used in the building
+    :param dimension_factors: numpy array (samples x surrogate elements x 4)
+    :return: mat_names: list with the materials, mat_mass: numpy array (samples x materials) with the mass (kg)
+    """
+    mat_names = get_material_names(inputs, surrogates)
+    n_mat = len(inputs['mat_names'])
+    mat_vol = material.calc_mat_vol_matrix(inputs['net_areas'], inputs['thickness'])
+    mat_mass = np.zeros(density_factors.shape)
+    mat_mass[:, :n_mat] = material.calc_mat_mass_matrix(mat_vol * thickness_factors,
+                                                        inputs['densities'] * density_factors[:, :n_mat])
+    if surrogates is not None and len(surrogates['names']):
+        n_samples, n_rows = dimension_factors.shape[:2]
+        params = (surrogates['params'][None] * dimension_factors).reshape(-1, 4)
+        geom = {col: np.full(n_samples * n_rows, float(inputs['geom_stats'][col]))
+                for col in surrogate.geometry_columns}
+        volume = surrogate.calc_surrogate_volumes(np.tile(surrogates['element'], n_samples), params, geom)[0]
+        volume = volume.reshape(n_samples, n_rows) * surrogates['multiplier'][None]
+        cols = [mat_names.index(mat) for mat in surrogates['materials']]
+        mat_mass[:, cols] += (np.einsum('sk,km->sm', volume, surrogates['shares'] * surrogates['densities'])
+                              * density_factors[:, cols])
+    return mat_names, mat_mass
+
+
+def sample_material_demand(inputs, surrogates=None, n_samples=1000, band=0.1, distributions=None,
+                           distribution='uniform', seed=None):
+    """
+    Samples the densities and thicknesses of the materials and the dimensions of the surrogate elements and calculates
+    the material mass of a building for all samples
+    :param inputs: material inputs of the building, see material.make_material_inputs()
+    :param surrogates: surrogate table with the surrogate elements of the building (see surrogate.get_surrogate_rows())
+        or None
+    :param n_samples: number of samples (default: 1000)
+    :param band: default band of all inputs (default: 0.1, i.e. +/-10% for uniform distributions)
+    :param distributions: dictionary with the bands and distributions per material or surrogate element, see get_bands()
+    :param distribution: default distribution, see distribution_types (default: 'uniform')
+    :param seed: seed of the random generator (optional)
+    :return: mat_names: list with the materials, samples: float32 numpy array (samples x materials) with the mass (kg)
+    """
+    rng = np.random.default_rng(seed)
+    mat_names = get_material_names(inputs, surrogates)
+    thickness_factors = sample_factors(rng, n_samples, *get_bands(inputs['mat_names'], 'thickness', band,
+                                                                   distributions, distribution))
+    density_factors = sample_factors(rng, n_samples, *get_bands(mat_names, 'density', band, distributions,
+                                                                 distribution))
+    if surrogates is None:
+        dimension_factors = np.ones((n_samples, 0, 4))
+    else:
+        bands, types = get_bands(surrogates['names'], 'dimensions', band, distributions, distribution)
+        dimension_factors = sample_factors(rng, n_samples, np.repeat(bands, 4), np.repeat(types, 4).tolist())
+        dimension_factors = dimension_factors.reshape(n_samples, len(bands), 4)
+    mat_names, samples = calc_sample_masses(inputs, surrogates, thickness_factors, density_factors,
+                                            dimension_factors)
+    return mat_names, samples.astype(np.float32)
+
+
+def aggregate_samples(mat_names, samples, aggregation_categories):
+    """
+    Aggregates the material mass samples by material category (as in mat_demand_aggregated.csv)
+    :param mat_names: list with the materials
+    :param samples: numpy array (samples x materials)
+    :param aggregation_categories: dict with materials and their aggregation categories
+    :return: categories: list with the categories (sorted, followed by 'TOTAL'), numpy array (samples x categories)
+    """
+    mat_categories = [aggregation_categories.get(mat, '?') for mat in mat_names]
+    categories = sorted(set(mat_categories))
+    columns = np.array([categories.index(category) for category in mat_categories], dtype=int)
+    aggregated = np.zeros((samples.shape[0], len(categories) + 1), dtype=samples.dtype)
+    np.add.at(aggregated.T, columns, samples.T)
+    aggregated[:, -1] = aggregated[:, :-1].sum(axis=1)
+    return categories + ['TOTAL'], aggregated
+
+
+def calc_percentile_table(names, samples, point=None, name_column='Material name'):
+    """
+    Summarises the samples by their mean and percentiles
+    :param names: list with the material names or categories
+    :param samples: numpy array (samples x materials)
+    :param point: numpy array with the point values (optional)
+    :param name_column: header of the column with the names
+    :return: pandas dataframe with the columns name_column, 'Unit', 'Value' (point value), 'Mean', 'P5', 'P25', ...
+    """
+    df = pd.DataFrame({name_column: names, 'Unit': 'kg'})
+    if point is not None:
+        df['Value'] = np.asarray(point, dtype=float)
+    df['Mean'] = samples.mean(axis=0, dtype=float)
+    bands = np.percentile(samples, percentiles, axis=0).astype(float)
+    for p, values in zip(percentiles, bands):
+        df[f'P{p}'] = values
+    return df
+
+
+def perform_uncertainty_analysis(folder, ep_dir, atypical_materials, surrogates=None, ifsurrogates=True,
+                                 replace_dict=None, n_samples=1000, band=0.1, distributions=None,
+                                 distribution='uniform', seed=None, snapshot=None):
+    """
+    Runs the Monte Carlo uncertainty analysis of the material demand of a prepared simulation folder (i.e. one
+    containing 'in.idf') and saves the samples ('mat_demand_samples.npz', float32) and their percentiles
+    ('mat_demand_uncertainty.csv' and 'mat_demand_aggregated_uncertainty.csv')
+    :param folder: simulation folder
+    :param ep_dir: EnergyPlus directory
+    :param atypical_materials: pandas dataframe with thicknesses and densities of atypical materials
+    :param surrogates: surrogate elements (surrogate table, see surrogate.get_surrogate_rows(), or dictionary)
+    :param ifsurrogates: True if the surrogate elements should be included (default: True)
+    :param replace_dict: dictionary with BuildME replacement aspects
+    :param n_samples: number of samples (default: 1000)
+    :param band: default band of all inputs (default: 0.1)
+    :param distributions: dictionary with the bands and distributions per material or surrogate element, see get_bands()
+    :param distribution: default distribution, see distribution_types (default: 'uniform')
+    :param seed: seed of the random generator (optional)
+    :param snapshot: geometry snapshot of the archetype (see material.make_geometry_snapshot()), if already known
+    :returns: geometry snapshot of the archetype
+    """
+    idf_file = simulate.read_idf(ep_dir, os.path.join(folder, 'in.idf'))
+    atypical_materials = simulate.check_atypical_materials(idf_file, atypical_materials, folder, config=False)
+    inputs = material.make_material_inputs(idf_file, atypical_materials, replace_dict, snapshot)
+    if not ifsurrogates:
+        surrogates = None
+    elif not surrogate.is_surrogate_table(surrogates):
+        surrogates = surrogate.compile_surrogates_dict(surrogates)
+    mat_names, samples = sample_material_demand(inputs, surrogates, n_samples, band, distributions, distribution,
+                                                seed)
+    n_rows = 0 if surrogates is None else len(surrogates['names'])
+    point = calc_sample_masses(inputs, surrogates, np.ones((1, len(inputs['mat_names']))),
+                               np.ones((1, len(mat_names))), np.ones((1, n_rows, 4)))[1][0]
+    np.savez_compressed(os.path.join(folder, 'mat_demand_samples.npz'), materials=np.array(mat_names),
+                        samples=samples)
+    calc_percentile_table(mat_names, samples, point).to_csv(os.path.join(folder, 'mat_demand_uncertainty.csv'),
+                                                           index=False)
+    categories, aggregated = aggregate_samples(mat_names, samples, settings.material_aggregation)
+    point_aggregated = aggregate_samples(mat_names, point[None], settings.material_aggregation)[1][0]
+    calc_percentile_table(categories, aggregated, point_aggregated, 'Material type').to_csv(
+        os.path.join(folder, 'mat_demand_aggregated_uncertainty.csv'), index=False)
+    return inputs['snapshot']
+
+
+def calculate_uncertainty(batch_sim, ifsurrogates=True, n_samples=1000, band=0.1, distributions=None,
+                          distribution='uniform', seed=None):
+    """
+    Runs the Monte Carlo uncertainty analysis of the material demand for all simulations of a batch simulation. The
+    simulation folders need to be prepared (e.g. by simulate.calculate_materials()). The analysis is performed once
+    per group of simulations with the same material demand (see simulate.group_material_simulations()) and the
+    results are copied to the other simulations of the group.
+    :param batch_sim: dictionary with batch simulation information
+    :param ifsurrogates: True if the surrogate elements should be included (default: True)
+    :param n_samples: number of samples per simulation (default: 1000)
+    :param band: default band of all inputs (default: 0.1)
+    :param distributions: dictionary with the bands and distributions per material or surrogate element, see get_bands()
+    :param distribution: default distribution, see distribution_types (default: 'uniform')
+    :param seed: seed of the random generator (optional, the same seed is used for every simulation)
+    """
+    print("Initiating uncertainty analysis of the material demand...")
+    groups, surrogates_dicts = simulate.group_material_simulations(batch_sim, ifsurrogates)
+    snapshots = {}
+    for sims in tqdm(groups.values()):
+        sim = sims[0]
+        out_dir = batch_sim[sim]['run_folder']
+        idf_path = batch_sim[sim]['archetype_file']
+        snapshots[idf_path] = perform_uncertainty_analysis(out_dir, settings.ep_path, settings.atypical_materials,
+                                                           surrogates_dicts[sim], ifsurrogates,
+                                                           batch_sim[sim]['replace_dict'], n_samples, band,
+                                                           distributions, distribution, seed,
+                                                           snapshots.get(idf_path))
+        for other_sim in sims[1:]:
+            for f in result_files:
+                shutil.copy(os.path.join(out_dir, f), os.path.join(batch_sim[other_sim]['run_folder'], f))
+    print('Uncertainty analysis finished.')
+    return
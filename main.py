@@ -1,29 +1,39 @@
 import subprocess
 import sys
 
-from BuildME import settings, batch, simulate, __version__
+from BuildME import settings, batch, simulate, pipeline, __version__
 
 
-def run_batch_simulation(run_new=True, run_eplus=True):
+def run_batch_simulation(run_new=True, run_eplus=True, pipelined=False, in_memory=False):
+    # Material-only simulations can be kept in memory with in_memory=True: no simulation folders and summary files are
+    #  written, only the material demand matrix 'mat_demand_matrix.npz' (see results.py)
+    in_memory = in_memory and not run_eplus
     if run_new:
         print("Running new simulation...")
         # Creating the scenario combinations
         combinations = settings.debug_combinations
-        batch_simulation, run = batch.create_batch_simulation(combinations)
+        batch_simulation, run = batch.create_batch_simulation(combinations, subfolders=not in_memory)
     else:
         print("Continuing previous simulation...")
         batch_simulation = batch.find_and_load_last_run()
+    if in_memory:
+        simulate.calculate_materials_in_memory(batch_simulation)
+        print("Done.")
+        return
+    if pipelined:
+        # Each simulation flows through all stages independently; the summary files are written at the end
+        pipeline.run_pipeline(batch_simulation, run_eplus=run_eplus, unit='kWh')
+        print("Done.")
+        return
+    # Checking the material data before starting EnergyPlus
+    simulate.audit_materials(batch_simulation)
     # Performing simulations
     if run_eplus:
         simulate.calculate_energy(batch_simulation, parallel=True)
-    simulate.calculate_materials(batch_simulation)
+    simulate.calculate_materials(batch_simulation, parallel=True)
 
     # Postprocessing
-    if run_eplus:
-        simulate.aggregate_energy(batch_simulation, unit='kWh')
-    simulate.aggregate_materials(batch_simulation)
-    simulate.calculate_intensities(batch_simulation)
-    simulate.collect_results(batch_simulation)
+    simulate.postprocess(batch_simulation, run_eplus=run_eplus, unit='kWh')
     # simulate.weighing_climate_region(batch_simulation)
     # simulate.cleanup(batch_simulation, archive=True, del_temp=True)
     print("Done.")
@@ -0,0 +1,91 @@
+"""
+Benchmark of reading the energy demand from a large 'eplusout.csv' file
+
+Version 1.0
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+import numpy as np
+import pandas as pd
+# Make sure that you have selected the correct working directory (BUILDME)
+if os.path.basename(os.getcwd()) != 'BuildME':
+    os.chdir('../..')
+sys.path.append(os.getcwd())
+from BuildME import energy
+
+variables = ("Heating:EnergyTransfer [J](Annual)", "Cooling:EnergyTransfer [J](Annual)",
+             "InteriorLights:Electricity [J](Annual)", "InteriorEquipment:Electricity [J](Annual)")
+
+
+def write_hourly_eplusout(filename, n_columns=500, n_rows=8760, seed=0):
+    """
+    Writes a synthetic 'eplusout.csv' with hourly output variables and the four annual meters used by BuildME (the
+    annual values are only given in the last row, like in the files written by ReadVarsESO)
+    :param filename: path of the file
+    :param n_columns: number of hourly output variables
+    :param n_rows: number of rows (hours)
+    :param seed: seed of the random values
+    """
+    rng = np.random.default_rng(seed)
+    columns = ['ZONE %d:Zone Mean Air Temperature [C](Hourly)' % i for i in range(n_columns)]
+    df = pd.DataFrame(rng.uniform(15, 25, (n_rows, n_columns)).round(6), columns=columns)
+    for i, variable in enumerate(variables):
+        df[variable] = np.nan
+        df.loc[n_rows - 1, variable] = rng.uniform(1e9, 1e10)
+    df.insert(0, 'Date/Time', [' %02d/%02d  %02d:00:00' % (1 + i // 720 % 12, 1 + i // 24 % 30, 1 + i % 24)
+                               for i in range(n_rows)])
+    df.to_csv(filename, index=False)
+    return
+
+
+def read_full(ep_file):
+    """
+    Previous implementation: reads the whole file and selects the columns afterwards
+    """
+    ep_out = pd.read_csv(ep_file)
+    results_to_collect = [col for col in ep_out.columns for v in variables if col.startswith(v)]
+    return ep_out.loc[:, results_to_collect].sum()
+
+
+def measure(function, *args):
+    """
+    Measures the time and the peak memory (numpy/pandas allocations traced by tracemalloc) of a function call
+    :return: result, time (s), peak memory (MB)
+    """
+    tracemalloc.start()
+    start = perf_counter()
+    result = function(*args)
+    duration = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 10**6
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+def benchmark_eplusout(n_columns=500, n_rows=8760):
+    """
+    Compares reading the whole 'eplusout.csv' (previous implementation) with energy.sum_eplusout_columns() on a
+    synthetic file with hourly output variables
+    :param n_columns: number of hourly output variables
+    :param n_rows: number of rows (hours)
+    :return: dictionary like {method: (time in s, peak memory in MB)}
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        ep_file = os.path.join(folder, 'eplusout.csv')
+        write_hourly_eplusout(ep_file, n_columns, n_rows)
+        print(f"'eplusout.csv' with {n_columns} hourly columns and {n_rows} rows: "
+              f"{os.path.getsize(ep_file) / 10**6:.0f} MB")
+        full, *results['full'] = measure(read_full, ep_file)
+        streamed, *results['streamed'] = measure(energy.sum_eplusout_columns, ep_file, variables)
+    if not np.array_equal(full.to_numpy(), streamed.to_numpy()):
+        raise Exception('The energy demand of both methods differs')
+    for method, (duration, peak) in results.items():
+        print(f"{method}: {duration:.2f} s, peak memory {peak:.0f} MB")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_eplusout()
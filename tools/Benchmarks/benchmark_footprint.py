@@ -0,0 +1,53 @@
+"""
+Benchmarks of the footprint calculation on all archetypes
+
+Version 1.0
+"""
+import glob
+import os
+import sys
+from time import perf_counter
+# Make sure that you have selected the correct working directory (BUILDME)
+if os.path.basename(os.getcwd()) != 'BuildME':
+    os.chdir('../..')
+sys.path.append(os.getcwd())
+from BuildME import geometry, material, settings
+from BuildME.simulate import read_idf
+
+
+def benchmark_footprint(archetypes=settings.archetypes, ep_dir=settings.ep_path):
+    """
+    Compares the footprint area and perimeter of the rectangle around the ground floors ('bbox') with the outline of
+    the ground floors ('polygon') for all archetypes. Only the footprint calculation is timed, reading the IDF files
+    and creating the geometry tables is not.
+    :param archetypes: folder with the archetypes (searched recursively for IDF files)
+    :param ep_dir: EnergyPlus directory (for the IDD file)
+    :return: dictionary like {idf_path: (bbox area, bbox perimeter, polygon area, polygon perimeter)}, total time (s)
+        of the polygon calculation
+    """
+    models = {}
+    for idf_path in sorted(glob.glob(os.path.join(archetypes, '**', '*.idf'), recursive=True)):
+        idf = read_idf(ep_dir, idf_path)
+        surfaces = material.get_surfaces(idf)
+        geometry.get_geometry_table(idf)
+        models[idf_path] = (idf, surfaces)
+    results = {}
+    total = 0
+    for idf_path, (idf, surfaces) in models.items():
+        start = perf_counter()
+        area, perimeter = geometry.calc_footprint(*material.get_ground_floor_vertices(idf, surfaces))
+        total += perf_counter() - start
+        table = geometry.get_geometry_table(idf)
+        bbox = table['bbox'][[table['index'][surface.Name] for surface in surfaces['ext_floor']]]
+        dx = bbox[:, 3].max(initial=0) - bbox[:, 0].min(initial=0)
+        dy = bbox[:, 4].max(initial=0) - bbox[:, 1].min(initial=0)
+        results[idf_path] = (dx * dy, 2 * (dx + dy), area, perimeter)
+        print(f"{os.path.relpath(idf_path, archetypes)}: {len(surfaces['ext_floor'])} 'ext_floor' surfaces, "
+              f"area {dx * dy:.1f} (bbox) / {area:.1f} (polygon) m2, "
+              f"perimeter {2 * (dx + dy):.1f} (bbox) / {perimeter:.1f} (polygon) m")
+    print(f"Polygon footprint of {len(results)} archetypes calculated in {total:.3f} s")
+    return results, total
+
+
+if __name__ == "__main__":
+    benchmark_footprint()
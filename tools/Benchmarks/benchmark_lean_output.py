@@ -0,0 +1,86 @@
+"""
+Benchmark of the lean output mode (removal of the reporting objects not read by BuildME) on the archetypes
+
+Version 1.0
+"""
+import glob
+import os
+import sys
+import tempfile
+from time import perf_counter
+# Make sure that you have selected the correct working directory (BUILDME)
+if os.path.basename(os.getcwd()) != 'BuildME':
+    os.chdir('../..')
+sys.path.append(os.getcwd())
+from BuildME import energy, settings, simulate
+
+
+def count_outputs(idf_file):
+    """
+    Counts the reporting objects of an IDF file
+    :param idf_file: IDF file
+    :return: number of objects of the types in simulate.output_obj_types
+    """
+    return sum(len(idf_file.idfobjects[obj_type.upper()]) for obj_type in simulate.output_obj_types)
+
+
+def get_folder_size(folder):
+    """
+    Sums up the size of the simulation results in a folder (without the EnergyPlus executables and the weather file)
+    :param folder: simulation folder
+    :return: size in MB
+    """
+    exclude = [os.path.basename(f) for f in energy.get_exec_files()] + ['in.epw']
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)
+               if f not in exclude and os.path.isfile(os.path.join(folder, f))) / 10**6
+
+
+def simulate_archetype(idf_path, folder, lean_output, epw_path):
+    """
+    Runs the energy simulation of an archetype with or without the lean output mode
+    :param idf_path: path to the IDF file
+    :param folder: empty simulation folder
+    :param lean_output: True if the reporting objects not read by BuildME should be removed
+    :param epw_path: path to the EPW file with weather data
+    :return: runtime of EnergyPlus (s), size of the results (MB)
+    """
+    archetype = os.path.basename(idf_path).replace('.idf', '')
+    simulate.copy_idf_file(idf_path, folder, {}, archetype, settings.ep_path, None, lean_output=lean_output)
+    start = perf_counter()
+    energy.perform_energy_calculation(folder, settings.ep_path, epw_path, keep_all=True)
+    return perf_counter() - start, get_folder_size(folder)
+
+
+def benchmark_lean_output(archetype_dir=os.path.join(settings.archetypes, 'USA'), run_eplus=None):
+    """
+    Compares the archetypes with all their reporting objects and in the lean output mode: number of reporting objects
+    and, if EnergyPlus is installed in settings.ep_path, the runtime and the size of the simulation results
+    :param archetype_dir: folder with the archetype IDF files
+    :param run_eplus: True if the simulations should be run (default: if the EnergyPlus executable is found)
+    :return: dictionary like {archetype: {'objects': (full, lean), 'runtime': (full, lean), 'size': (full, lean)}}
+    """
+    epw_path = os.path.join(settings.climate_files_path, 'USA_NY_New.York-dummy.epw')
+    if run_eplus is None:
+        run_eplus = os.path.exists(os.path.join(settings.ep_path, energy.get_exec_files()[0]))
+    results = {}
+    for idf_path in sorted(glob.glob(os.path.join(archetype_dir, '*.idf'))):
+        archetype = os.path.basename(idf_path)
+        idf_file = simulate.read_idf(settings.ep_path, idf_path)
+        n_full = count_outputs(idf_file)
+        n_lean = count_outputs(simulate.strip_outputs(idf_file, settings.keep_outputs, settings.sqlite))
+        results[archetype] = {'objects': (n_full, n_lean)}
+        line = f"{archetype}: {n_full} reporting objects, {n_lean} in the lean output mode"
+        if run_eplus:
+            with tempfile.TemporaryDirectory() as full_dir, tempfile.TemporaryDirectory() as lean_dir:
+                full = simulate_archetype(idf_path, full_dir, False, epw_path)
+                lean = simulate_archetype(idf_path, lean_dir, True, epw_path)
+            results[archetype]['runtime'], results[archetype]['size'] = zip(full, lean)
+            line += f"; runtime {full[0]:.1f} s / {lean[0]:.1f} s, results {full[1]:.1f} MB / {lean[1]:.1f} MB"
+        print(line)
+    if not run_eplus:
+        print(f"EnergyPlus not found in {settings.ep_path}, the runtime and disk use were not measured")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_lean_output()
@@ -0,0 +1,88 @@
+"""
+Benchmarks of the material demand calculation on large archetypes
+
+Version 1.0
+"""
+import os
+import sys
+from time import perf_counter
+from eppy.bunch_subclass import BadEPFieldError
+# Make sure that you have selected the correct working directory (BUILDME)
+if os.path.basename(os.getcwd()) != 'BuildME':
+    os.chdir('../..')
+sys.path.append(os.getcwd())
+from BuildME import material, settings
+from BuildME.simulate import read_idf, apply_obj_name_change
+
+
+def calc_mat_vol_bdg_scan(idff, surfaces, constr_layers, weights):
+    """
+    Reference implementation of material.calc_mat_vol_bdg() that scans all fenestration objects for every surface
+    :param idff: IDF file
+    :param surfaces: A dictionary for each surface type, e.g. {'ext_wall': [object1, object2], 'roof': [object3]}
+    :param constr_layers: dictionary with constructions and their layers incl. layer thickness
+    :param weights: surface weights (zone multipliers) as created by material.get_surface_weights()
+    :return: mat_vol: dictionary like {'material_name': volume, ...}
+    """
+    mat_vol = {}
+    for surface, weight in zip(material.flatten_surfaces(surfaces), material.flatten_surfaces(weights)):
+        fenestration_area = 0
+        for item in material.get_fenestration_objects_from_surface(idff, surface):
+            try:
+                fenestration_area += item.area
+            except BadEPFieldError:  # Window and Door objects have no 'area' attribute
+                fenestration_area += material.SurrogateElement(item).area
+        area = (material.get_area(surface) - fenestration_area) * weight
+        for mat, thickness in constr_layers.get(surface.Construction_Name, {}).items():
+            mat_vol[mat] = mat_vol.get(mat, 0) + thickness * area
+    return mat_vol
+
+
+def read_archetype(idf_path, ep_dir=settings.ep_path, replace_dict=None):
+    """
+    Reads an archetype and applies the construction name replacements of the BuildME aspects
+    :param idf_path: path to the IDF file
+    :param ep_dir: EnergyPlus directory (for the IDD file)
+    :param replace_dict: dictionary with BuildME replacement aspects (default: standard, RES0)
+    :return: idf file
+    """
+    if replace_dict is None:
+        replace_dict = {'en-std': 'standard', 'res': 'RES0'}
+    idf = read_idf(ep_dir, idf_path)
+    for aspect, aspect_value in replace_dict.items():
+        idf = apply_obj_name_change(idf, aspect, aspect_value)
+    return idf
+
+
+def benchmark_fenestration_index(idf_path, ep_dir=settings.ep_path, repeat=3):
+    """
+    Compares the material volume calculation with fenestration lookups by scanning and by the host surface index
+    :param idf_path: path to the IDF file
+    :param ep_dir: EnergyPlus directory (for the IDD file)
+    :param repeat: number of repetitions (the fastest one is reported)
+    :return: tuple with the time (s) of the scanning and the indexed calculation
+    """
+    idf = read_archetype(idf_path, ep_dir)
+    materials = material.make_materials_dict(idf)
+    constr_layers = material.make_construction_dict(idf, materials, settings.atypical_materials, {'res': 'RES0'})
+    surfaces = material.get_surfaces(idf)
+    weights = material.get_surface_weights(idf, surfaces)
+    t_scan, t_index = [], []
+    for i in range(repeat):
+        start = perf_counter()
+        vol_scan = calc_mat_vol_bdg_scan(idf, surfaces, constr_layers, weights)
+        t_scan.append(perf_counter() - start)
+        start = perf_counter()
+        vol_index = material.calc_mat_vol_bdg(idf, surfaces, constr_layers, material.make_fenestration_dict(idf),
+                                              weights)
+        t_index.append(perf_counter() - start)
+    for mat in vol_scan:
+        assert abs(vol_scan[mat] - vol_index[mat]) <= 1e-9 * max(1, abs(vol_scan[mat])), mat
+    print(f"{os.path.basename(idf_path)}: {sum(material.flatten_surfaces(weights))} surfaces, "
+          f"scan {min(t_scan):.3f} s, index {min(t_index):.3f} s, speedup {min(t_scan) / min(t_index):.1f}x")
+    return min(t_scan), min(t_index)
+
+
+if __name__ == "__main__":
+    for archetype in ['Hospital', 'SchoolSecondary']:
+        benchmark_fenestration_index(os.path.join(settings.archetypes, 'USA', archetype + '.idf'))